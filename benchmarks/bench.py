@@ -0,0 +1,237 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# app.py and controllers.py import their siblings without the package prefix.
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'cleanArchitecture')]
+
+from app import create_app
+from dataset import generate_urls, sequence_code
+from cleanArchitecture.repositories import SQLiteUrlRepository
+from cleanArchitecture.services import UrlShortenerService, JWTService
+from cleanArchitecture.cache import LRUCache
+
+# python benchmarks/bench.py [--quick] [--output results.json] [--compare baseline.json]
+#
+# Every benchmark times each operation individually and reports p50/p90/p99
+# latency in microseconds plus throughput. Results are keyed by name and
+# params, so two JSON files from different runs can be compared with
+# --compare, which exits non-zero when p99 or throughput regress by more
+# than --threshold.
+
+SECRET_KEY = 'benchmark-secret-key-0123456789abcdef'
+
+
+def percentile(sorted_values, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def measure(name: str, func, iterations: int, warmup: int = 0, **params) -> dict:
+    for _ in range(warmup):
+        func()
+    samples = []
+    started = time.perf_counter_ns()
+    for _ in range(iterations):
+        op_started = time.perf_counter_ns()
+        func()
+        samples.append(time.perf_counter_ns() - op_started)
+    elapsed = (time.perf_counter_ns() - started) / 1e9
+    samples.sort()
+    result = {
+        'name': name,
+        'params': params,
+        'iterations': iterations,
+        'p50_us': percentile(samples, 0.50) / 1e3,
+        'p90_us': percentile(samples, 0.90) / 1e3,
+        'p99_us': percentile(samples, 0.99) / 1e3,
+        'mean_us': statistics.fmean(samples) / 1e3,
+        'max_us': samples[-1] / 1e3,
+        'ops_per_sec': iterations / elapsed if elapsed else 0.0,
+    }
+    print(f"{name:<28} {json.dumps(params):<32} p50 {result['p50_us']:>10.1f}us  "
+          f"p99 {result['p99_us']:>10.1f}us  {result['ops_per_sec']:>10.0f} ops/s", file=sys.stderr)
+    return result
+
+
+def app_config(workdir: str, database_path: str, **overrides) -> dict:
+    config = {
+        'SECRET_KEY': SECRET_KEY,
+        'DATABASE_PATH': database_path,
+        'REVOCATION_DB_PATH': os.path.join(workdir, 'revocations.db'),
+        'URL_SHARED_CACHE_PATH': os.path.join(workdir, 'redirect_cache.db'),
+    }
+    config.update(overrides)
+    return config
+
+
+def bench_redirects(workdir: str, iterations: int) -> list:
+    path = os.path.join(workdir, 'redirects.db')
+    generate_urls(path, 10000)
+    codes = [sequence_code(i) for i in range(0, 10000, 7)]
+    results = []
+    for cache_size in (10000, 0):
+        app = create_app(app_config(workdir, path, URL_CACHE_SIZE=cache_size))
+        client = app.test_client()
+        # Request every code once first, so the hit run measures a warm cache.
+        for code in codes:
+            client.get(f'/link/{code}')
+        hits = itertools.cycle(codes)
+        results.append(measure('redirect_short.hit', lambda: client.get(f'/link/{next(hits)}'),
+                               iterations, warmup=100, cache_size=cache_size))
+        misses = iter(range(iterations + 100))
+        results.append(measure('redirect_short.miss', lambda: client.get(f'/link/zz{next(misses):06d}'),
+                               iterations, warmup=100, cache_size=cache_size))
+        service = app.extensions['url_shortener']['url_service']
+        lookups = itertools.cycle(codes)
+        results.append(measure('service.get_long_url', lambda: service.get_long_url(next(lookups)),
+                               iterations, warmup=100, cache_size=cache_size))
+    return results
+
+
+def bench_create(workdir: str, iterations: int, sizes: list) -> list:
+    results = []
+    for rows in [0] + sizes:
+        path = os.path.join(workdir, f'create_{rows}.db')
+        generate_urls(path, rows)
+        for strategy in ('random', 'sequence'):
+            app = create_app(app_config(workdir, path, SHORT_CODE_STRATEGY=strategy,
+                                        CLICK_TRACKING_ENABLED=False))
+            service = app.extensions['url_shortener']['url_service']
+            counter = iter(range(10 ** 9))
+            fill_ratio = service.keyspace_stats()['fill_ratio']
+            result = measure(
+                'create_short_url', lambda: service.create_short_url(f'https://example.com/new/{next(counter)}'),
+                iterations, warmup=10, rows=rows, strategy=strategy
+            )
+            result['fill_ratio'] = fill_ratio
+            results.append(result)
+    return results
+
+
+def bench_list(workdir: str, sizes: list) -> list:
+    results = []
+    for rows in sizes:
+        path = os.path.join(workdir, f'list_{rows}.db')
+        generate_urls(path, rows)
+        repository = SQLiteUrlRepository(path)
+        service = UrlShortenerService(repository)
+        iterations = max(3, min(50, 1000000 // rows))
+        results.append(measure('get_all_urls', service.get_all_urls, iterations, warmup=1, rows=rows))
+        results.append(measure('get_url_page', lambda: service.get_url_page(limit=50), 200, warmup=10, rows=rows))
+        repository.close()
+    return results
+
+
+def bench_jwt(iterations: int) -> list:
+    results = []
+    user = {'id': '1', 'username': 'admin'}
+    for cache_size in (0, 10000):
+        token_cache = LRUCache(max_size=cache_size, ttl=300, negative_ttl=30) if cache_size else None
+        jwt_service = JWTService(SECRET_KEY, token_cache=token_cache)
+        if cache_size == 0:
+            results.append(measure('jwt.generate_token', lambda: jwt_service.generate_token(user),
+                                   iterations, warmup=100))
+        token = jwt_service.generate_token(user)
+        results.append(measure('jwt.validate_token', lambda: jwt_service.validate_token(token),
+                               iterations, warmup=100, cache_size=cache_size))
+    return results
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def result_key(result: dict) -> str:
+    return f"{result['name']} {json.dumps(result['params'], sort_keys=True)}"
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> list:
+    # Returns the regressions: p99 up or throughput down by more than threshold.
+    previous = {result_key(result): result for result in baseline['results']}
+    regressions = []
+    for result in current['results']:
+        before = previous.get(result_key(result))
+        if before is None:
+            continue
+        p99_change = result['p99_us'] / before['p99_us'] - 1 if before['p99_us'] else 0.0
+        ops_change = result['ops_per_sec'] / before['ops_per_sec'] - 1 if before['ops_per_sec'] else 0.0
+        regressed = p99_change > threshold or ops_change < -threshold
+        print(f"{'REGRESSION' if regressed else 'ok':<10} {result_key(result):<60} "
+              f"p99 {p99_change:+.1%}  ops/s {ops_change:+.1%}", file=sys.stderr)
+        if regressed:
+            regressions.append(result_key(result))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python benchmarks/bench.py')
+    parser.add_argument('--quick', action='store_true', help='small tables and fewer iterations')
+    parser.add_argument('--sizes', default='10000,100000,1000000', help='table sizes for listing and creates')
+    parser.add_argument('--iterations', type=int, default=5000)
+    parser.add_argument('--only', help='comma separated groups: redirect,create,list,jwt')
+    parser.add_argument('--output', help='write JSON results here instead of stdout')
+    parser.add_argument('--compare', help='baseline JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=0.10)
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    iterations = args.iterations
+    if args.quick:
+        sizes = [size for size in sizes if size <= 10000] or [10000]
+        iterations = min(iterations, 500)
+    groups = set(args.only.split(',')) if args.only else {'redirect', 'create', 'list', 'jwt'}
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix='url-bench-') as workdir:
+        if 'redirect' in groups:
+            results += bench_redirects(workdir, iterations)
+        if 'create' in groups:
+            results += bench_create(workdir, max(100, iterations // 10), sizes)
+        if 'list' in groups:
+            results += bench_list(workdir, sizes)
+        if 'jwt' in groups:
+            results += bench_jwt(iterations)
+
+    report = {
+        'meta': {
+            'revision': git_revision(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'sqlite': sqlite3.sqlite_version,
+            'quick': args.quick,
+        },
+        'results': results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(baseline, report, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+import argparse
+import os
+import random
+import sqlite3
+import string
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from cleanArchitecture.codes import ALPHABET, SequenceCodeAllocator, encode
+from cleanArchitecture.repositories import SQLiteUrlRepository
+
+# python benchmarks/dataset.py urls.db --rows 1000000 [--seed 42] [--clicks 5000000]
+#
+# Fills a urls database with a reproducible dataset: the same seed and row
+# count always give the same codes, URLs and timestamps. Long URLs mix a
+# few very common hosts with a long tail, and path lengths vary the way
+# shared links do. created_at is spread over --days so paging and ordering
+# look like an aged table rather than one bulk insert.
+
+_HOSTS = ['www.youtube.com', 'github.com', 'docs.google.com', 'twitter.com', 'www.amazon.com',
+          'en.wikipedia.org', 'medium.com', 'www.reddit.com', 'news.ycombinator.com', 'stackoverflow.com']
+_WORDS = ['article', 'watch', 'issues', 'blob', 'main', 'products', 'wiki', 'comments', 'questions',
+          'how', 'to', 'python', 'flask', 'jwt', 'shorten', 'release', 'notes', '2024', 'guide', 'api']
+
+
+def sequence_code(number: int, length: int = 6) -> str:
+    # The code SequenceCodeAllocator hands out for the given number.
+    keyspace = 62 ** length
+    return encode((number * 1580030173 + 92821) % keyspace, length)
+
+
+def random_long_url(rng: random.Random) -> str:
+    if rng.random() < 0.6:
+        host = rng.choice(_HOSTS)
+    else:
+        host = ''.join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 12))) + rng.choice(
+            ['.com', '.org', '.io', '.net', '.dev'])
+    segments = [rng.choice(_WORDS) for _ in range(min(8, int(rng.expovariate(0.6)) + 1))]
+    url = f"https://{host}/{'/'.join(segments)}"
+    if rng.random() < 0.3:
+        url += '?' + '&'.join(f"{rng.choice(_WORDS)}={rng.randint(0, 10 ** 6)}"
+                              for _ in range(rng.randint(1, 4)))
+    return url
+
+
+def generate_urls(path: str, rows: int, seed: int = 42, code_length: int = 6, days: int = 365,
+                  strategy: str = 'sequence', batch_size: int = 50000, progress: bool = False):
+    # The schema (indexes, triggers) comes from the repository, so the file
+    # is usable by the app as is. 'sequence' codes are the ones
+    # SequenceCodeAllocator would produce, and the allocator continues after
+    # them; 'random' draws unique random codes.
+    SQLiteUrlRepository(path, pool_size=1).close()
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=OFF')
+    start = conn.execute('SELECT COUNT(*) FROM urls').fetchone()[0]
+    now = datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+    # Codes already in the file are skipped up front, and rows are counted
+    # by what INSERT OR IGNORE actually wrote, so exactly `rows` are added.
+    seen = {row[0] for row in conn.execute('SELECT short_url FROM urls')} if start else set()
+    number = start
+    written = 0
+    while written < rows:
+        batch = []
+        while len(batch) < min(batch_size, rows - written):
+            if strategy == 'sequence':
+                code = sequence_code(number, code_length)
+                number += 1
+                if code in seen:
+                    continue
+            else:
+                code = ''.join(rng.choices(ALPHABET, k=code_length))
+                while code in seen:
+                    code = ''.join(rng.choices(ALPHABET, k=code_length))
+            seen.add(code)
+            # Older links are rarer than recent ones.
+            age = timedelta(seconds=int(min(rng.expovariate(3.0 / days), days) * 86400))
+            batch.append((code, random_long_url(rng), (now - age).isoformat(' ')))
+        cur = conn.executemany('INSERT OR IGNORE INTO urls (short_url, long_url, created_at) VALUES (?, ?, ?)',
+                               batch)
+        written += cur.rowcount
+        if progress:
+            print(f"{written}/{rows} urls", file=sys.stderr)
+    if strategy == 'sequence':
+        conn.execute('''
+            INSERT INTO code_sequences (name, next_value) VALUES (?, ?)
+            ON CONFLICT(name) DO UPDATE SET next_value = MAX(next_value, excluded.next_value)
+        ''', (SequenceCodeAllocator.SEQUENCE_NAME, number))
+    conn.commit()
+    conn.close()
+
+
+def zipf_weights(count: int, exponent: float) -> list:
+    return [1.0 / rank ** exponent for rank in range(1, count + 1)]
+
+
+def generate_clicks(path: str, clicks: int, seed: int = 42, exponent: float = 1.1, days: int = 30,
+                    batch_size: int = 50000, progress: bool = False):
+    # Zipf-distributed clicks over the existing links, written through the
+    # repository so counts and rollups stay consistent with the raw events.
+    rng = random.Random(seed + 1)
+    repository = SQLiteUrlRepository(path, pool_size=1)
+    with repository.pool.connection() as conn:
+        codes = [row[0] for row in conn.execute('SELECT short_url FROM urls ORDER BY id')]
+    if not codes:
+        repository.close()
+        return
+    rng.shuffle(codes)
+    cumulative = []
+    total = 0.0
+    for weight in zipf_weights(len(codes), exponent):
+        total += weight
+        cumulative.append(total)
+    now = time.time()
+    written = 0
+    while written < clicks:
+        count = min(batch_size, clicks - written)
+        picked = rng.choices(codes, cum_weights=cumulative, k=count)
+        repository.record_clicks([(code, now - rng.random() * days * 86400) for code in picked])
+        written += count
+        if progress:
+            print(f"{written}/{clicks} clicks", file=sys.stderr)
+    repository.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python benchmarks/dataset.py')
+    parser.add_argument('database')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--code-length', type=int, default=6)
+    parser.add_argument('--strategy', choices=['sequence', 'random'], default='sequence')
+    parser.add_argument('--days', type=int, default=365, help='age range of created_at')
+    parser.add_argument('--clicks', type=int, default=0, help='Zipf-distributed click events to add')
+    parser.add_argument('--zipf', type=float, default=1.1, help='Zipf exponent for clicks')
+    args = parser.parse_args(argv)
+
+    started = time.monotonic()
+    generate_urls(args.database, args.rows, args.seed, args.code_length, args.days, args.strategy,
+                  progress=True)
+    if args.clicks:
+        generate_clicks(args.database, args.clicks, args.seed, args.zipf, progress=True)
+    print(f"{args.database}: {args.rows} urls, {args.clicks} clicks in {time.monotonic() - started:.1f}s",
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
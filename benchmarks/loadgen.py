@@ -0,0 +1,269 @@
+import argparse
+import http.client
+import json
+import multiprocessing
+import random
+import sqlite3
+import sys
+import threading
+import time
+from urllib.parse import urlencode, urlsplit
+
+# python benchmarks/loadgen.py --url http://127.0.0.1:5000 --database urls.db \
+#     --mix redirect=90,create=5,auth=5 --concurrency 1,8,32,64 --duration 10
+#
+# Replays a mix of redirects, creates and authenticated calls against a
+# running instance at each concurrency level and reports throughput,
+# latency percentiles and error rates per level and per operation. Redirect
+# targets follow a Zipf distribution over the codes in --database, so a few
+# links get most of the traffic, as they do in production. Fill the database
+# with benchmarks/dataset.py first.
+#
+# One Python process tops out at a few thousand requests per second; use
+# --processes so the generator is not the bottleneck.
+
+OPERATIONS = ('redirect', 'create', 'auth')
+
+
+def percentile(sorted_values, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def parse_mix(text: str) -> dict:
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"Unknown operation {name!r}, expected one of {OPERATIONS}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def load_codes(database: str, limit: int) -> list:
+    conn = sqlite3.connect(f'file:{database}?mode=ro', uri=True)
+    codes = [row[0] for row in conn.execute('SELECT short_url FROM urls ORDER BY id LIMIT ?', (limit,))]
+    conn.close()
+    return codes
+
+
+def login(base_url: str, username: str, password: str) -> str:
+    parts = urlsplit(base_url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=10)
+    conn.request('POST', '/login', urlencode({'username': username, 'password': password}),
+                 {'Content-Type': 'application/x-www-form-urlencoded'})
+    response = conn.getresponse()
+    body = json.loads(response.read() or b'{}')
+    conn.close()
+    if 'token' not in body:
+        raise RuntimeError(f"Login failed: {body}")
+    return body['token']
+
+
+class Worker:
+    # One keep-alive connection per worker thread; http.client reopens it
+    # whenever the server closes it.
+    def __init__(self, settings: dict, seed: int, cumulative: list):
+        parts = urlsplit(settings['url'])
+        self.settings = settings
+        self.rng = random.Random(seed)
+        self.cumulative = cumulative
+        self.conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=settings['timeout'])
+        self.operations = list(settings['mix'])
+        self.weights = [settings['mix'][name] for name in self.operations]
+        self.results = {name: {'latencies': [], 'errors': 0, 'statuses': {}} for name in self.operations}
+        self.counter = 0
+
+    def request(self, method: str, path: str, body=None, headers=None) -> int:
+        try:
+            self.conn.request(method, path, body, headers or {})
+            response = self.conn.getresponse()
+            response.read()
+            return response.status
+        except (OSError, http.client.HTTPException):
+            self.conn.close()
+            return 0
+
+    def run_one(self, record: bool):
+        name = self.rng.choices(self.operations, self.weights)[0]
+        settings = self.settings
+        if name == 'redirect':
+            if self.rng.random() < settings['miss_ratio']:
+                path, expected = f"/link/miss{self.rng.randrange(10 ** 8):08d}", (404,)
+            else:
+                code = self.rng.choices(settings['codes'], cum_weights=self.cumulative)[0]
+                path, expected = f'/link/{code}', (302,)
+            started = time.perf_counter()
+            status = self.request('GET', path)
+        elif name == 'create':
+            self.counter += 1
+            body = urlencode({'long_url': f'https://loadgen.example/{self.rng.randrange(10 ** 9)}/{self.counter}'})
+            expected = (200,)
+            started = time.perf_counter()
+            status = self.request('POST', '/link', body, {'Content-Type': 'application/x-www-form-urlencoded'})
+        else:
+            expected = (200,)
+            started = time.perf_counter()
+            status = self.request('GET', f"/auth?token={settings['token']}")
+        elapsed = time.perf_counter() - started
+        if record:
+            result = self.results[name]
+            result['latencies'].append(elapsed)
+            result['statuses'][status] = result['statuses'].get(status, 0) + 1
+            if status not in expected:
+                result['errors'] += 1
+
+    def run(self, warmup_until: float, stop_at: float):
+        while time.monotonic() < warmup_until:
+            self.run_one(record=False)
+        while time.monotonic() < stop_at:
+            self.run_one(record=True)
+        self.conn.close()
+
+
+def run_workers(settings: dict, threads: int, seed: int) -> dict:
+    # Runs `threads` workers in this process and merges their results.
+    cumulative = []
+    total = 0.0
+    for rank in range(1, len(settings['codes']) + 1):
+        total += 1.0 / rank ** settings['zipf']
+        cumulative.append(total)
+    workers = [Worker(settings, seed * 1000 + i, cumulative) for i in range(threads)]
+    warmup_until = time.monotonic() + settings['warmup']
+    stop_at = warmup_until + settings['duration']
+    pool = [threading.Thread(target=worker.run, args=(warmup_until, stop_at)) for worker in workers]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    merged = {name: {'latencies': [], 'errors': 0, 'statuses': {}} for name in settings['mix']}
+    for worker in workers:
+        for name, result in worker.results.items():
+            merged[name]['latencies'].extend(result['latencies'])
+            merged[name]['errors'] += result['errors']
+            for status, count in result['statuses'].items():
+                merged[name]['statuses'][status] = merged[name]['statuses'].get(status, 0) + count
+    return merged
+
+
+def _run_workers_star(args):
+    return run_workers(*args)
+
+
+def summarize(latencies: list, errors: int, duration: float) -> dict:
+    latencies.sort()
+    requests = len(latencies)
+    return {
+        'requests': requests,
+        'throughput_rps': requests / duration,
+        'error_rate': errors / requests if requests else 0.0,
+        'p50_ms': percentile(latencies, 0.50) * 1e3,
+        'p90_ms': percentile(latencies, 0.90) * 1e3,
+        'p99_ms': percentile(latencies, 0.99) * 1e3,
+        'max_ms': (latencies[-1] if latencies else 0.0) * 1e3,
+    }
+
+
+def run_level(settings: dict, concurrency: int, processes: int) -> dict:
+    processes = max(1, min(processes, concurrency))
+    shares = [concurrency // processes + (1 if i < concurrency % processes else 0) for i in range(processes)]
+    jobs = [(settings, threads, settings['seed'] + i) for i, threads in enumerate(shares)]
+    if processes == 1:
+        parts = [run_workers(*jobs[0])]
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            parts = pool.map(_run_workers_star, jobs)
+
+    level = {'concurrency': concurrency, 'operations': {}}
+    all_latencies, all_errors = [], 0
+    for name in settings['mix']:
+        latencies = [value for part in parts for value in part[name]['latencies']]
+        errors = sum(part[name]['errors'] for part in parts)
+        statuses = {}
+        for part in parts:
+            for status, count in part[name]['statuses'].items():
+                statuses[str(status)] = statuses.get(str(status), 0) + count
+        all_latencies.extend(latencies)
+        all_errors += errors
+        level['operations'][name] = dict(summarize(latencies, errors, settings['duration']), statuses=statuses)
+    level.update(summarize(all_latencies, all_errors, settings['duration']))
+    return level
+
+
+def capacity(levels: list, max_error_rate: float, slo_p99_ms: float) -> dict:
+    # The best throughput among levels that stayed within the error budget
+    # and the p99 objective.
+    healthy = [level for level in levels
+               if level['error_rate'] <= max_error_rate and (not slo_p99_ms or level['p99_ms'] <= slo_p99_ms)]
+    if not healthy:
+        return {'sustained_rps': 0.0, 'concurrency': None}
+    best = max(healthy, key=lambda level: level['throughput_rps'])
+    return {'sustained_rps': best['throughput_rps'], 'concurrency': best['concurrency'], 'p99_ms': best['p99_ms']}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python benchmarks/loadgen.py')
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--database', default='urls.db', help='where to read existing short codes from')
+    parser.add_argument('--max-codes', type=int, default=1000000)
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('redirect=90,create=5,auth=5'))
+    parser.add_argument('--zipf', type=float, default=1.1, help='Zipf exponent over redirect targets')
+    parser.add_argument('--miss-ratio', type=float, default=0.01, help='share of redirects to unknown codes')
+    parser.add_argument('--concurrency', default='1,4,16,64')
+    parser.add_argument('--duration', type=float, default=10.0, help='measured seconds per level')
+    parser.add_argument('--warmup', type=float, default=2.0, help='unmeasured seconds before each level')
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument('--timeout', type=float, default=10.0)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--username', default='admin')
+    parser.add_argument('--password', default='123456')
+    parser.add_argument('--max-error-rate', type=float, default=0.01)
+    parser.add_argument('--slo-p99-ms', type=float, default=0.0, help='p99 objective for the capacity figure')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    args = parser.parse_args(argv)
+
+    codes = load_codes(args.database, args.max_codes) if 'redirect' in args.mix else []
+    if 'redirect' in args.mix and not codes:
+        parser.error(f"No short urls in {args.database}; run benchmarks/dataset.py first")
+    random.Random(args.seed).shuffle(codes)
+    settings = {
+        'url': args.url,
+        'mix': args.mix,
+        'codes': codes,
+        'zipf': args.zipf,
+        'miss_ratio': args.miss_ratio,
+        'duration': args.duration,
+        'warmup': args.warmup,
+        'timeout': args.timeout,
+        'seed': args.seed,
+        'token': login(args.url, args.username, args.password) if 'auth' in args.mix else None,
+    }
+
+    levels = []
+    for concurrency in [int(value) for value in args.concurrency.split(',')]:
+        level = run_level(settings, concurrency, args.processes)
+        levels.append(level)
+        print(f"c={concurrency:<5} {level['throughput_rps']:>9.0f} req/s  p50 {level['p50_ms']:>7.2f}ms  "
+              f"p99 {level['p99_ms']:>8.2f}ms  errors {level['error_rate']:.2%}", file=sys.stderr)
+
+    report = {
+        'target': args.url,
+        'mix': args.mix,
+        'zipf': args.zipf,
+        'codes': len(codes),
+        'duration': args.duration,
+        'levels': levels,
+        'capacity': capacity(levels, args.max_error_rate, args.slo_p99_ms),
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,26 @@
-from flask import Flask
+import atexit
+import os
+from flask import Flask, Response, request
+from config import Config
+from database import SQLiteTuning
+from cache import LRUCache, SharedRedirectCache
+from codes import RandomCodeAllocator, SequenceCodeAllocator
 from repositories import SQLiteUrlRepository, InMemoryAuthRepository
-from services import UrlShortenerService, AuthService, JWTService
-from controllers import UrlController, AuthController, create_token_required_decorator
-from utils import create_token_required_decorator
+from services import UrlShortenerService, AuthService, JWTService, KeyringJWTService
+from jwt_keyring import KeyRing
+from revocation import RevocationList
+from clicks import ClickTracker
+from url_index import IndexedUrlRepository
+from sharding import ShardedUrlRepository
+from replication import ReplicatedUrlRepository, file_replica, postgres_replica, read_your_writes_flask
+from metrics import MetricsRegistry, instrument, instrument_flask, stats_collector
+from rendering import ListingCache
+from profiler import SamplingProfiler, profile_flask
+from controllers import UrlController, ApiController, AuthController, ProfilerController, create_token_required_decorator
 
 def create_app(config=None):
-    app = Flask(__name__)
+    # Templates live at the repository root, shared with main.py.
+    app = Flask(__name__, template_folder='../templates')
 
     # Configuration
     if config:
@@ -17,18 +32,195 @@ def create_app(config=None):
         })
 
     # Dependency Injection
-    url_repository = SQLiteUrlRepository(app.config['DATABASE_PATH'])
+    database_url = app.config.get('DATABASE_URL', Config.DATABASE_URL)
+    if database_url:
+        # Imported here so SQLite-only deployments do not need psycopg2.
+        from postgres import PostgresUrlRepository
+        url_repository = PostgresUrlRepository(
+            database_url,
+            pool_size=app.config.get('DB_POOL_SIZE', Config.DB_POOL_SIZE),
+            pool_timeout=app.config.get('DB_POOL_TIMEOUT', Config.DB_POOL_TIMEOUT),
+            health_check_interval=app.config.get('DB_POOL_HEALTH_CHECK_INTERVAL',
+                                                 Config.DB_POOL_HEALTH_CHECK_INTERVAL),
+            change_log_retention=app.config.get('CHANGE_LOG_RETENTION', Config.CHANGE_LOG_RETENTION)
+        )
+    else:
+        shard_paths = app.config.get('SHARD_PATHS', Config.SHARD_PATHS) or [app.config['DATABASE_PATH']]
+        shards = [SQLiteUrlRepository(
+            path,
+            pool_size=app.config.get('DB_POOL_SIZE', Config.DB_POOL_SIZE),
+            pool_timeout=app.config.get('DB_POOL_TIMEOUT', Config.DB_POOL_TIMEOUT),
+            health_check_interval=app.config.get('DB_POOL_HEALTH_CHECK_INTERVAL',
+                                                 Config.DB_POOL_HEALTH_CHECK_INTERVAL),
+            tuning=SQLiteTuning.from_config(app.config),
+            change_log_retention=app.config.get('CHANGE_LOG_RETENTION', Config.CHANGE_LOG_RETENTION)
+        ) for path in shard_paths]
+        url_repository = ShardedUrlRepository(shards) if len(shards) > 1 else shards[0]
+    replica_paths = app.config.get('REPLICA_PATHS', Config.REPLICA_PATHS)
+    replica_urls = app.config.get('REPLICA_URLS', Config.REPLICA_URLS)
+    replicated = None
+    if isinstance(url_repository, ShardedUrlRepository) and (replica_paths or replica_urls):
+        app.logger.warning("Read replicas are not supported with SHARD_PATHS; ignoring them")
+    elif replica_paths or replica_urls:
+        replica_options = {
+            'pool_size': app.config.get('DB_POOL_SIZE', Config.DB_POOL_SIZE),
+            'pool_timeout': app.config.get('DB_POOL_TIMEOUT', Config.DB_POOL_TIMEOUT),
+        }
+        replicas = [file_replica(path, tuning=SQLiteTuning.from_config(app.config), **replica_options)
+                    for path in replica_paths]
+        replicas += [postgres_replica(url, **replica_options) for url in replica_urls]
+        url_repository = replicated = ReplicatedUrlRepository(
+            url_repository,
+            replicas,
+            max_staleness=app.config.get('REPLICA_MAX_STALENESS', Config.REPLICA_MAX_STALENESS)
+        )
+        read_your_writes_flask(app)
+    storage_problems = url_repository.verify_storage()
+    if storage_problems:
+        app.logger.warning("SQLite settings not applied: %s", storage_problems)
+    metrics = None
+    if app.config.get('METRICS_ENABLED', Config.METRICS_ENABLED):
+        metrics = MetricsRegistry()
+        instrument(url_repository, metrics, 'repository')
+        pool_stats = url_repository.pool_stats if isinstance(url_repository, ShardedUrlRepository) \
+            else url_repository.pool.stats
+        metrics.add_collector(stats_collector('db_pool', pool_stats, 'Connection pool state'))
+        if replicated is not None:
+            metrics.add_collector(stats_collector('replicas', replicated.stats, 'Read replica routing'))
+    if app.config.get('URL_INDEX_ENABLED', Config.URL_INDEX_ENABLED):
+        url_repository = IndexedUrlRepository(
+            url_repository,
+            code_length=app.config.get('SHORT_URL_LENGTH', Config.SHORT_URL_LENGTH),
+            merge_threshold=app.config.get('URL_INDEX_MERGE_THRESHOLD', Config.URL_INDEX_MERGE_THRESHOLD),
+            snapshot_path=app.config.get('URL_INDEX_SNAPSHOT_PATH', Config.URL_INDEX_SNAPSHOT_PATH),
+            sync_interval=app.config.get('URL_INDEX_SYNC_INTERVAL', Config.URL_INDEX_SYNC_INTERVAL)
+        )
+        if metrics is not None:
+            instrument(url_repository, metrics, 'url_index')
+            metrics.add_collector(stats_collector('url_index', url_repository.stats, 'In-memory index state'))
+    atexit.register(url_repository.close)
     auth_repository = InMemoryAuthRepository()
-    jwt_service = JWTService(app.config['SECRET_KEY'])
+    token_cache = None
+    if app.config.get('TOKEN_CACHE_SIZE', Config.TOKEN_CACHE_SIZE) > 0:
+        token_cache = LRUCache(
+            max_size=app.config.get('TOKEN_CACHE_SIZE', Config.TOKEN_CACHE_SIZE),
+            ttl=app.config.get('TOKEN_CACHE_TTL', Config.TOKEN_CACHE_TTL),
+            negative_ttl=app.config.get('TOKEN_CACHE_NEGATIVE_TTL', Config.TOKEN_CACHE_NEGATIVE_TTL)
+        )
+    revocation_path = app.config.get('REVOCATION_DB_PATH', Config.REVOCATION_DB_PATH) or os.path.join(
+        os.path.dirname(app.config.get('DATABASE_PATH') or Config.DATABASE_PATH), 'revocations.db')
+    revocation_list = RevocationList(
+        revocation_path,
+        capacity=app.config.get('REVOCATION_CAPACITY', Config.REVOCATION_CAPACITY),
+        bits_per_entry=app.config.get('REVOCATION_BITS_PER_ENTRY', Config.REVOCATION_BITS_PER_ENTRY)
+    )
+    atexit.register(revocation_list.close)
+
+    keyring_path = app.config.get('JWT_KEYRING_PATH', Config.JWT_KEYRING_PATH)
+    jwt_algorithm = app.config.get('JWT_ALGORITHM', Config.JWT_ALGORITHM)
+    if keyring_path:
+        keyring = KeyRing.from_manifest(
+            keyring_path,
+            reload_interval=app.config.get('JWT_KEYRING_RELOAD_INTERVAL', Config.JWT_KEYRING_RELOAD_INTERVAL)
+        )
+        jwt_service = KeyringJWTService(keyring, token_cache=token_cache, revocation_list=revocation_list)
+    elif jwt_algorithm != 'HS256':
+        # Throwaway key for a single development process; multi-worker
+        # deployments must share keys through JWT_KEYRING_PATH.
+        keyring = KeyRing()
+        keyring.generate('dev', jwt_algorithm)
+        jwt_service = KeyringJWTService(keyring, token_cache=token_cache, revocation_list=revocation_list)
+    else:
+        jwt_service = JWTService(app.config['SECRET_KEY'], token_cache=token_cache,
+                                 revocation_list=revocation_list)
+
+    url_cache = None
+    cache_size = app.config.get('URL_CACHE_SIZE', Config.URL_CACHE_SIZE)
+    cache_ttl = app.config.get('URL_CACHE_TTL', Config.URL_CACHE_TTL)
+    cache_negative_ttl = app.config.get('URL_CACHE_NEGATIVE_TTL', Config.URL_CACHE_NEGATIVE_TTL)
+    if app.config.get('URL_CACHE_BACKEND', Config.URL_CACHE_BACKEND) == 'shared':
+        url_cache = SharedRedirectCache(
+            app.config.get('URL_SHARED_CACHE_PATH', Config.URL_SHARED_CACHE_PATH),
+            ttl=cache_ttl,
+            negative_ttl=cache_negative_ttl,
+            local_size=cache_size,
+            max_size=app.config.get('URL_SHARED_CACHE_SIZE', Config.URL_SHARED_CACHE_SIZE)
+        )
+        atexit.register(url_cache.close)
+    elif cache_size > 0:
+        url_cache = LRUCache(max_size=cache_size, ttl=cache_ttl, negative_ttl=cache_negative_ttl)
+    code_length = app.config.get('SHORT_URL_LENGTH', Config.SHORT_URL_LENGTH)
+    if app.config.get('SHORT_CODE_STRATEGY', Config.SHORT_CODE_STRATEGY) == 'sequence':
+        code_allocator = SequenceCodeAllocator(
+            url_repository,
+            length=code_length,
+            block_size=app.config.get('SHORT_CODE_BLOCK_SIZE', Config.SHORT_CODE_BLOCK_SIZE)
+        )
+    else:
+        code_allocator = RandomCodeAllocator(length=code_length)
 
-    url_service = UrlShortenerService(url_repository)
+    click_tracker = None
+    if app.config.get('CLICK_TRACKING_ENABLED', Config.CLICK_TRACKING_ENABLED):
+        click_tracker = ClickTracker(
+            url_repository,
+            buffer_size=app.config.get('CLICK_BUFFER_SIZE', Config.CLICK_BUFFER_SIZE),
+            flush_size=app.config.get('CLICK_FLUSH_SIZE', Config.CLICK_FLUSH_SIZE),
+            flush_interval=app.config.get('CLICK_FLUSH_INTERVAL', Config.CLICK_FLUSH_INTERVAL),
+            enqueue_timeout=app.config.get('CLICK_ENQUEUE_TIMEOUT', Config.CLICK_ENQUEUE_TIMEOUT),
+            prune_interval=app.config.get('CLICK_ROLLUP_PRUNE_INTERVAL', Config.CLICK_ROLLUP_PRUNE_INTERVAL)
+        )
+        # Registered after the repository, so atexit drains clicks before
+        # the connection pool is closed.
+        atexit.register(click_tracker.close)
+
+    url_service = UrlShortenerService(
+        url_repository,
+        cache=url_cache,
+        code_allocator=code_allocator,
+        default_page_size=app.config.get('DEFAULT_PAGE_SIZE', Config.DEFAULT_PAGE_SIZE),
+        max_page_size=app.config.get('MAX_PAGE_SIZE', Config.MAX_PAGE_SIZE),
+        click_tracker=click_tracker,
+        stale_read_ttl=replicated.max_staleness if replicated is not None else None,
+        max_url_length=app.config.get('MAX_URL_LENGTH', Config.MAX_URL_LENGTH)
+    )
     auth_service = AuthService(auth_repository, jwt_service)
 
-    url_controller = UrlController(url_service)
+    if metrics is not None:
+        instrument(url_service, metrics, 'service')
+        instrument(auth_service, metrics, 'auth')
+        instrument(jwt_service, metrics, 'jwt', ['generate_token', '_decode'])
+        metrics.add_collector(stats_collector('url_cache', url_service.cache_stats, 'Redirect cache state'))
+        metrics.add_collector(stats_collector('token_cache', jwt_service.cache_stats, 'Token cache state'))
+        if click_tracker is not None:
+            metrics.add_collector(stats_collector('clicks', click_tracker.stats, 'Click buffer state'))
+
+    listing_cache = None
+    if app.config.get('LISTING_CACHE_ENABLED', Config.LISTING_CACHE_ENABLED):
+        listing_cache = ListingCache(
+            app.jinja_env,
+            url_service.listing_version,
+            page_size=app.config.get('LISTING_PAGE_CACHE_SIZE', Config.LISTING_PAGE_CACHE_SIZE),
+            fragment_size=app.config.get('LISTING_FRAGMENT_CACHE_SIZE', Config.LISTING_FRAGMENT_CACHE_SIZE)
+        )
+        app.jinja_env.globals['link_row'] = listing_cache.row
+        if metrics is not None:
+            metrics.add_collector(stats_collector('listing_cache', listing_cache.stats, 'Listing render cache state'))
+
+    url_controller = UrlController(url_service, listing_cache)
+    api_controller = ApiController(url_service, listing_cache)
     auth_controller = AuthController(auth_service)
 
     token_required = create_token_required_decorator(auth_service)
 
+    app.extensions['url_shortener'] = {
+        'url_repository': url_repository,
+        'url_service': url_service,
+        'auth_service': auth_service,
+        'token_required': token_required,
+        'metrics': metrics,
+        'listing_cache': listing_cache,
+    }
+
     # Routes
     @app.route('/')
     def home():
@@ -39,6 +231,7 @@ def create_app(config=None):
         return auth_controller.public()
 
     @app.route('/auth')
+    @token_required
     def auth():
         return auth_controller.protected()
 
@@ -46,6 +239,11 @@ def create_app(config=None):
     def login():
         return auth_controller.login()
 
+    @app.route('/logout', methods=['POST'])
+    @token_required
+    def logout():
+        return auth_controller.logout()
+
     @app.route('/link', methods=['GET', 'POST'])
     def index():
         return url_controller.index()
@@ -62,6 +260,60 @@ def create_app(config=None):
     def delete(url_id):
         return url_controller.delete(url_id)
 
+    @app.route('/api/v1/links', methods=['GET', 'POST'])
+    @token_required
+    def api_links():
+        if request.method == 'POST':
+            return api_controller.create()
+        return api_controller.list()
+
+    @app.route('/api/v1/links/<int:url_id>', methods=['GET', 'PUT', 'PATCH', 'DELETE'])
+    @token_required
+    def api_link(url_id):
+        if request.method == 'GET':
+            return api_controller.get(url_id)
+        if request.method == 'DELETE':
+            return api_controller.delete(url_id)
+        return api_controller.update(url_id)
+
+    @app.route('/api/v1/links/bulk', methods=['POST'])
+    @token_required
+    def bulk_create():
+        return url_controller.bulk_create()
+
+    @app.route('/api/v1/links/export')
+    @token_required
+    def export():
+        return url_controller.export()
+
+    if app.config.get('PROFILER_ENABLED', Config.PROFILER_ENABLED):
+        profiler = SamplingProfiler(
+            output_dir=app.config.get('PROFILER_OUTPUT_DIR', Config.PROFILER_OUTPUT_DIR),
+            interval=app.config.get('PROFILER_INTERVAL', Config.PROFILER_INTERVAL),
+            sample_rate=app.config.get('PROFILER_SAMPLE_RATE', Config.PROFILER_SAMPLE_RATE)
+        )
+        profiler_controller = ProfilerController(profiler)
+        profile_flask(app, profiler)
+        atexit.register(profiler.close)
+        app.extensions['url_shortener']['profiler'] = profiler
+
+        @app.route('/debug/profile', methods=['GET', 'POST'])
+        @token_required
+        def profile():
+            return profiler_controller.control()
+
+        @app.route('/debug/profile/dump', methods=['POST'])
+        @token_required
+        def profile_dump():
+            return profiler_controller.dump()
+
+    if metrics is not None:
+        @app.route(app.config.get('METRICS_PATH', Config.METRICS_PATH))
+        def metrics_endpoint():
+            return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+        instrument_flask(app, metrics)
+
     return app
 
 
@@ -0,0 +1,202 @@
+import asyncio
+import io
+import json
+import re
+import sys
+from urllib.parse import parse_qs
+
+from werkzeug.http import parse_cookie
+from werkzeug.urls import iri_to_uri
+
+from app import create_app
+from config import Config
+from replication import LAST_WRITE_COOKIE, restore_last_write
+from repositories import AsyncUrlRepository
+from services import AsyncUrlShortenerService
+
+# Run with any ASGI server, e.g.:
+#   uvicorn --factory asgi:create_asgi_app --workers 4
+# /link/<short_url>, /auth and /logout are served natively on the event loop;
+# every other route is handed to the Flask app on the same bounded executor.
+
+_SHORT_URL_ROUTE = re.compile(r'^/link/([^/]+)$')
+_DONE = object()
+
+
+def create_asgi_app(config=None):
+    flask_app = create_app(config)
+    services = flask_app.extensions['url_shortener']
+    async_repository = AsyncUrlRepository(
+        services['url_repository'],
+        max_workers=flask_app.config.get('ASYNC_EXECUTOR_WORKERS', Config.ASYNC_EXECUTOR_WORKERS),
+        max_pending=flask_app.config.get('ASYNC_MAX_PENDING', Config.ASYNC_MAX_PENDING)
+    )
+    url_service = AsyncUrlShortenerService(services['url_service'], async_repository)
+    return AsyncUrlShortenerApp(flask_app, url_service, services['auth_service'])
+
+
+class AsyncUrlShortenerApp:
+    def __init__(self, flask_app, url_service: AsyncUrlShortenerService, auth_service):
+        self.flask_app = flask_app
+        self.url_service = url_service
+        self.auth_service = auth_service
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        path, method = scope['path'], scope['method']
+        match = _SHORT_URL_ROUTE.match(path)
+        # Digit-only codes belong to the /link/<int:url_id> update route.
+        if match and method in ('GET', 'HEAD') and not match.group(1).isdigit():
+            await self.redirect_short(scope, send, match.group(1))
+        elif path == '/auth' and method == 'GET':
+            await self.protected(scope, send)
+        elif path == '/logout' and method == 'POST':
+            await self.logout(scope, send)
+        else:
+            await self._call_flask(scope, receive, send)
+
+    async def redirect_short(self, scope, send, short_url: str):
+        # As read_your_writes_flask does for Flask routes, so a replica that
+        # has not synced past this user's last write is skipped.
+        cookies = b'; '.join(value for name, value in scope.get('headers', []) if name == b'cookie')
+        restore_last_write(parse_cookie(cookies.decode('latin-1')).get(LAST_WRITE_COOKIE))
+        try:
+            long_url = await self.url_service.get_long_url(short_url)
+        except Exception:
+            await _respond(send, 500, b'Internal Server Error')
+            return
+        if long_url:
+            service = self.url_service.url_service
+            if not service.record_click_nowait(short_url):
+                await self.url_service.run(service.record_click, short_url)
+            await _respond(send, 302, b'', headers=[(b'location', iri_to_uri(long_url).encode('latin-1'))])
+        else:
+            await _respond(send, 404, b'URL not found')
+
+    async def protected(self, scope, send):
+        if await self._check_token(scope, send) is not None:
+            await _respond(send, 200, b'JWT is verified. Welcome to your dashboard')
+
+    async def logout(self, scope, send):
+        token = await self._check_token(scope, send)
+        if token is None:
+            return
+        try:
+            await self.url_service.run(self.auth_service.revoke_token, token)
+        except Exception as e:
+            await _respond_json(send, 400, {'error': str(e)})
+            return
+        await _respond_json(send, 200, {'message': 'Token revoked'})
+
+    async def _check_token(self, scope, send):
+        # Mirrors create_token_required_decorator. A token the token cache
+        # and the revocation filter can answer is checked on the loop; any
+        # other goes to the executor, since verifying it may read the
+        # revocation table or reload the keyring manifest.
+        token = parse_qs(scope.get('query_string', b'').decode('latin-1')).get('token', [None])[0]
+        if not token:
+            await _respond_json(send, 200, {'error': 'Please provide a token'})
+            return None
+        try:
+            user = self.auth_service.validate_token_in_memory(token)
+            if user is None:
+                user = await self.url_service.run(self.auth_service.validate_token, token)
+        except Exception as e:
+            await _respond_json(send, 401, {'error': str(e)})
+            return None
+        if not user:
+            await _respond_json(send, 200, {'error': 'Invalid token'})
+            return None
+        return token
+
+    async def _call_flask(self, scope, receive, send):
+        body = bytearray()
+        while True:
+            message = await receive()
+            body.extend(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                  for name, value in headers]
+
+        environ = _build_environ(scope, bytes(body))
+        result = await self.url_service.run(self.flask_app, environ, start_response)
+        iterator = iter(result)
+        try:
+            first = await self.url_service.run(next, iterator, _DONE)
+            await send({'type': 'http.response.start', 'status': started['status'],
+                        'headers': started['headers']})
+            chunk = first
+            while chunk is not _DONE:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                chunk = await self.url_service.run(next, iterator, _DONE)
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            if hasattr(result, 'close'):
+                await self.url_service.run(result.close)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await asyncio.get_running_loop().run_in_executor(None, self.url_service.url_repository.close)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+def _build_environ(scope, body: bytes) -> dict:
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.input_terminated': True,
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ[name] = value
+        elif name == 'CONTENT_LENGTH':
+            continue  # the body has already been read in full
+        else:
+            key = f'HTTP_{name}'
+            environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+async def _respond(send, status: int, body: bytes, content_type: bytes = b'text/plain; charset=utf-8',
+                   headers=()):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', content_type), (b'content-length', str(len(body)).encode())]
+                + list(headers)})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _respond_json(send, status: int, data: dict):
+    await _respond(send, status, json.dumps(data).encode(), content_type=b'application/json')
@@ -0,0 +1,380 @@
+import mmap
+import os
+import sqlite3
+import struct
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional
+from cleanArchitecture.database import ConnectionPool, SQLiteTuning
+
+MISSING = object()
+
+
+class LRUCache:
+    # Bounded least-recently-used cache with a per-entry TTL. Values may be
+    # None, which callers use to remember "not found" lookups; a miss is
+    # signalled by returning the MISSING sentinel (or the given default).
+    # invalidate() bumps a per-key generation, and fills go through
+    # set_if_current() with the generation read before loading, so a load
+    # that raced an update or delete cannot put the old value back.
+    blocking = False
+
+    def __init__(self, max_size: int = 10000, ttl: float = 300.0, negative_ttl: Optional[float] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._epoch = 0
+        self._generations = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Hashable, default=MISSING):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires_at = entry
+            if expires_at <= now:
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], object], max_ttl: Optional[float] = None):
+        value = self.get(key)
+        if value is MISSING:
+            generation = self.generation(key)
+            value = loader()
+            self.set_if_current(key, value, generation, self.fill_ttl(value, max_ttl))
+        return value
+
+    def fill_ttl(self, value, max_ttl: Optional[float]) -> Optional[float]:
+        # The TTL for a loaded value, capped at max_ttl when the loader may
+        # have read a stale copy.
+        if max_ttl is None:
+            return None
+        return min(max_ttl, self.negative_ttl if value is None else self.ttl)
+
+    def generation(self, key: Hashable):
+        with self._lock:
+            return self._epoch, self._generations.get(key, 0)
+
+    def set_if_current(self, key: Hashable, value, generation, ttl: Optional[float] = None) -> bool:
+        with self._lock:
+            if (self._epoch, self._generations.get(key, 0)) != generation:
+                return False
+            self._store(key, value, ttl)
+            return True
+
+    def set(self, key: Hashable, value, ttl: Optional[float] = None):
+        with self._lock:
+            self._store(key, value, ttl)
+
+    def _store(self, key: Hashable, value, ttl: Optional[float]):
+        if self.max_size <= 0:
+            return
+        if ttl is None:
+            ttl = self.negative_ttl if value is None else self.ttl
+        self._data[key] = (value, time.monotonic() + ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, *keys: Hashable):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+                self._generations[key] = self._generations.get(key, 0) + 1
+            if len(self._generations) > self.max_size:
+                # Forgetting the per-key generations is safe as long as the
+                # epoch moves, which fails every fill still in flight.
+                self._generations.clear()
+                self._epoch += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._generations.clear()
+            self._epoch += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+    def __len__(self):
+        return len(self._data)
+
+
+class MappedCounter:
+    # A single 64-bit sequence number in a small file that every process maps
+    # into memory; reading it is a memory load, not a syscall or a query.
+    _SEQ = struct.Struct('<Q')
+
+    def __init__(self, path: str):
+        self.path = path
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < self._SEQ.size:
+                os.ftruncate(fd, self._SEQ.size)
+            self._map = mmap.mmap(fd, self._SEQ.size)
+        finally:
+            os.close(fd)
+
+    def read(self) -> int:
+        return self._SEQ.unpack_from(self._map, 0)[0]
+
+    def publish(self, value: int):
+        self._SEQ.pack_into(self._map, 0, value)
+
+    def close(self):
+        self._map.close()
+
+
+class SharedRedirectCache:
+    # Host-wide cache shared by every worker process through one SQLite file.
+    # Each key carries a generation that invalidate() bumps, and a fill is only
+    # stored if the generation it read is still current, so a worker that raced
+    # with an update cannot write the old target back. Every invalidation is
+    # appended to a log and its sequence number is published in a small mmap'd
+    # counter file; workers keep a local LRU in front of the shared table and
+    # replay the log only when that counter moves, so a warm hit costs one
+    # memory read plus a dict lookup.
+    #
+    # Every sweep_interval seconds a worker that stores an entry also drops
+    # expired entries and trims the table to max_size, soonest to expire
+    # first. Keys without a generation row read the epoch row's generation;
+    # once there are more than max_size generation rows they are replaced by
+    # a new epoch above all of them, which fails every fill still in flight,
+    # as LRUCache does with its generations.
+    MAX_LOG = 10000
+    SWEEP_BATCH = 10000
+    blocking = True
+
+    def __init__(self, path: str, ttl: float = 300.0, negative_ttl: Optional[float] = None,
+                 local_size: int = 10000, pool_size: int = 4, max_size: int = 100000,
+                 sweep_interval: float = 60.0):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+        self.max_size = max_size
+        self.sweep_interval = sweep_interval
+        self._sweep_at = time.monotonic() + sweep_interval
+        self.swept = 0
+        self.local = LRUCache(max_size=local_size, ttl=ttl, negative_ttl=self.negative_ttl)
+        self.pool = ConnectionPool(path, size=pool_size, tuning=SQLiteTuning(synchronous='OFF'))
+        self.shared_hits = 0
+        self.shared_misses = 0
+        self.stale_fills = 0
+        self._lock = threading.Lock()
+        self._init_db()
+        self._counter = MappedCounter(path + '.seq')
+        self._seen = self._counter.read()
+
+    def _init_db(self):
+        with self.pool.connection() as conn:
+            conn.executescript('''
+                CREATE TABLE IF NOT EXISTS cache_entries (
+                    key TEXT PRIMARY KEY,
+                    value TEXT,
+                    generation INTEGER NOT NULL,
+                    expires_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS cache_generations (
+                    key TEXT PRIMARY KEY,
+                    generation INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS cache_invalidations (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    key TEXT
+                );
+                CREATE INDEX IF NOT EXISTS idx_cache_entries_expires_at ON cache_entries (expires_at);
+                INSERT OR IGNORE INTO cache_generations (key, generation) VALUES ('', 0);
+            ''')
+
+    def _sync(self):
+        if self._counter.read() == self._seen:
+            return
+        with self._lock:
+            seen = self._seen
+            with self.pool.connection() as conn:
+                rows = conn.execute(
+                    'SELECT seq, key FROM cache_invalidations WHERE seq > ? ORDER BY seq', (seen,)
+                ).fetchall()
+            if not rows:
+                # The writer published its sequence before committing; the
+                # rows become visible on a later call.
+                return
+            if rows[0][0] != seen + 1:
+                self.local.clear()  # log was trimmed past us
+            for _, key in rows:
+                if key is None:
+                    self.local.clear()
+                else:
+                    self.local.invalidate(key)
+            self._seen = rows[-1][0]
+
+    def get(self, key: str, default=MISSING):
+        self._sync()
+        value = self.local.get(key)
+        if value is not MISSING:
+            return value
+        found, value, _ = self._get_shared(key)
+        if not found:
+            return default
+        self.local.set(key, value)
+        return value
+
+    def _get_shared(self, key: str):
+        with self.pool.connection() as conn:
+            row = conn.execute('''
+                SELECT COALESCE(g.generation, (SELECT generation FROM cache_generations WHERE key = '')),
+                       e.value, e.generation, e.expires_at
+                FROM (SELECT ? AS key) k
+                LEFT JOIN cache_generations g ON g.key = k.key
+                LEFT JOIN cache_entries e ON e.key = k.key
+            ''', (key,)).fetchone()
+        generation = row[0] or 0
+        if row[2] is not None and row[2] == generation and row[3] > time.time():
+            self.shared_hits += 1
+            return True, row[1], generation
+        self.shared_misses += 1
+        return False, None, generation
+
+    def get_or_load(self, key: str, loader: Callable[[], object], max_ttl: Optional[float] = None):
+        self._sync()
+        value = self.local.get(key)
+        if value is not MISSING:
+            return value
+
+        local_generation = self.local.generation(key)
+        found, value, generation = self._get_shared(key)
+        if found:
+            self.local.set_if_current(key, value, local_generation)
+            return value
+
+        value = loader()
+        ttl = self.local.fill_ttl(value, max_ttl)
+        if self._store(key, value, generation, ttl):
+            self.local.set_if_current(key, value, local_generation, ttl)
+        return value
+
+    def set(self, key: str, value, ttl: Optional[float] = None):
+        self._sync()
+        _, _, generation = self._get_shared(key)
+        if self._store(key, value, generation, ttl):
+            self.local.set(key, value, ttl)
+
+    def _store(self, key: str, value, generation: int, ttl: Optional[float] = None) -> bool:
+        if ttl is None:
+            ttl = self.negative_ttl if value is None else self.ttl
+        with self.pool.connection() as conn:
+            cur = conn.execute('''
+                INSERT OR REPLACE INTO cache_entries (key, value, generation, expires_at)
+                SELECT ?, ?, ?, ?
+                WHERE COALESCE((SELECT generation FROM cache_generations WHERE key = ?),
+                               (SELECT generation FROM cache_generations WHERE key = '')) = ?
+            ''', (key, value, generation, time.time() + ttl, key, generation))
+            conn.commit()
+            stored = cur.rowcount > 0
+        if not stored:
+            self.stale_fills += 1
+        if time.monotonic() >= self._sweep_at:
+            self._sweep()
+        return stored
+
+    def _sweep(self):
+        self._sweep_at = time.monotonic() + self.sweep_interval
+        with self.pool.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                swept = conn.execute('''
+                    DELETE FROM cache_entries WHERE key IN (
+                        SELECT key FROM cache_entries WHERE expires_at <= ? ORDER BY expires_at LIMIT ?)
+                ''', (time.time(), self.SWEEP_BATCH)).rowcount
+                excess = conn.execute('SELECT COUNT(*) FROM cache_entries').fetchone()[0] - self.max_size
+                if excess > 0:
+                    swept += conn.execute('''
+                        DELETE FROM cache_entries WHERE key IN (
+                            SELECT key FROM cache_entries ORDER BY expires_at LIMIT ?)
+                    ''', (excess,)).rowcount
+                if conn.execute('SELECT COUNT(*) FROM cache_generations').fetchone()[0] > self.max_size:
+                    epoch = conn.execute('SELECT MAX(generation) FROM cache_generations').fetchone()[0] + 1
+                    conn.execute('DELETE FROM cache_generations')
+                    conn.execute("INSERT INTO cache_generations (key, generation) VALUES ('', ?)", (epoch,))
+                    # Stored under the old generations, so none of them can match again.
+                    swept += conn.execute('DELETE FROM cache_entries').rowcount
+                conn.commit()
+            except sqlite3.Error:
+                conn.rollback()
+                raise
+        self.swept += swept
+
+    def invalidate(self, *keys: str):
+        if keys:
+            self._publish(keys)
+        self.local.invalidate(*keys)
+
+    def clear(self):
+        self._publish([None])
+        self.local.clear()
+
+    def _publish(self, keys):
+        with self.pool.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                for key in keys:
+                    if key is None:
+                        conn.execute('UPDATE cache_generations SET generation = generation + 1')
+                        conn.execute('DELETE FROM cache_entries')
+                    else:
+                        conn.execute('''
+                            INSERT INTO cache_generations (key, generation)
+                            VALUES (?, (SELECT generation FROM cache_generations WHERE key = '') + 1)
+                            ON CONFLICT(key) DO UPDATE SET generation = generation + 1
+                        ''', (key,))
+                        conn.execute('DELETE FROM cache_entries WHERE key = ?', (key,))
+                    conn.execute('INSERT INTO cache_invalidations (key) VALUES (?)', (key,))
+                seq = conn.execute('SELECT MAX(seq) FROM cache_invalidations').fetchone()[0]
+                conn.execute('DELETE FROM cache_invalidations WHERE seq <= ?', (seq - self.MAX_LOG,))
+                # Still inside the write transaction, so publishes from
+                # different workers are ordered and the counter never goes back.
+                self._counter.publish(seq)
+                conn.commit()
+            except sqlite3.Error:
+                conn.rollback()
+                raise
+
+    def stats(self) -> dict:
+        stats = self.local.stats()
+        stats.update({
+            'shared_hits': self.shared_hits,
+            'shared_misses': self.shared_misses,
+            'stale_fills': self.stale_fills,
+            'swept': self.swept,
+            'sequence': self._seen,
+        })
+        return stats
+
+    def close(self):
+        self.pool.close()
+        self._counter.close()
@@ -0,0 +1,192 @@
+import logging
+import threading
+import time
+from typing import List, Optional
+from cleanArchitecture.models import UrlRepository
+
+logger = logging.getLogger(__name__)
+
+# Rollup granularity -> bucket width in seconds. Buckets are keyed by their
+# UTC start time in epoch seconds.
+ROLLUP_GRANULARITIES = {'minute': 60, 'hour': 3600, 'day': 86400}
+# How long fine-grained buckets are kept, in seconds. These are the widest
+# windows UrlShortenerService.get_top_urls reads at each granularity; day
+# buckets are kept for good.
+ROLLUP_RETENTION = {'minute': 6 * 3600, 'hour': 14 * 86400}
+# Raw click rows are only read to rebuild rollups after a schema upgrade,
+# so they are kept as long as the finest rollup.
+RAW_CLICK_RETENTION = ROLLUP_RETENTION['minute']
+CLICK_PRUNE_BATCH = 10000
+
+
+class RingBuffer:
+    # Fixed-capacity FIFO over a preallocated list. put() never grows the
+    # buffer: when it is full the caller either waits up to a timeout or is
+    # told to drop the item.
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._items = [None] * capacity
+        self._head = 0
+        self._size = 0
+        self._cond = threading.Condition(threading.Lock())
+
+    def put(self, item, timeout: float = 0.0) -> bool:
+        with self._cond:
+            if self._size >= self.capacity:
+                if timeout <= 0 or not self._cond.wait_for(lambda: self._size < self.capacity, timeout):
+                    return False
+            self._items[(self._head + self._size) % self.capacity] = item
+            self._size += 1
+            return True
+
+    def drain(self, max_items: int) -> list:
+        with self._cond:
+            count = min(max_items, self._size)
+            items = []
+            for _ in range(count):
+                items.append(self._items[self._head])
+                self._items[self._head] = None
+                self._head = (self._head + 1) % self.capacity
+            self._size -= count
+            if count:
+                self._cond.notify_all()
+            return items
+
+    def __len__(self):
+        return self._size
+
+
+class ClickTracker:
+    # Redirects only append (short_url, timestamp) to the ring buffer. A
+    # background thread writes the events in batches, once flush_size events
+    # are waiting or every flush_interval seconds, so the SQLite write lock is
+    # taken once per batch instead of once per redirect. The same thread
+    # drops rollup buckets past ROLLUP_RETENTION and raw clicks past
+    # RAW_CLICK_RETENTION every prune_interval seconds.
+    def __init__(self, url_repository: UrlRepository, buffer_size: int = 65536, flush_size: int = 1000,
+                 flush_interval: float = 1.0, enqueue_timeout: float = 0.0, prune_interval: float = 600.0):
+        self.url_repository = url_repository
+        self.buffer = RingBuffer(buffer_size)
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self.prune_interval = prune_interval
+        self._pruned_at = 0.0
+        self.pruned = 0
+        self.recorded = 0
+        self.dropped = 0
+        self.flushed = 0
+        self.failed = 0
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='click-flusher', daemon=True)
+        self._thread.start()
+
+    def record(self, short_url: str, clicked_at: Optional[float] = None) -> bool:
+        if not self.buffer.put((short_url, clicked_at or time.time()), self.enqueue_timeout):
+            self.dropped += 1
+            return False
+        self._accepted()
+        return True
+
+    def record_nowait(self, short_url: str, clicked_at: Optional[float] = None) -> bool:
+        # Never waits. With an enqueue_timeout, a full buffer returns False
+        # without dropping the click, so the caller can record() it where
+        # blocking is allowed; otherwise the click is taken or dropped.
+        item = (short_url, clicked_at or time.time())
+        if self.enqueue_timeout <= 0:
+            self.record(*item)
+            return True
+        if not self.buffer.put(item, 0.0):
+            return False
+        self._accepted()
+        return True
+
+    def _accepted(self):
+        self.recorded += 1
+        if len(self.buffer) >= self.flush_size:
+            self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+            if time.monotonic() - self._pruned_at >= self.prune_interval:
+                self.prune()
+        self.flush()
+
+    def prune(self) -> int:
+        self._pruned_at = time.monotonic()
+        try:
+            now = time.time()
+            pruned = self.url_repository.prune_click_rollups(rollup_cutoffs(now))
+            pruned += self.url_repository.prune_clicks(now - RAW_CLICK_RETENTION)
+        except Exception:
+            logger.exception("Failed to prune click rollups")
+            return 0
+        self.pruned += pruned
+        return pruned
+
+    def flush(self) -> int:
+        total = 0
+        with self._flush_lock:
+            while True:
+                events = self.buffer.drain(self.flush_size)
+                if not events:
+                    break
+                try:
+                    self.url_repository.record_clicks(events)
+                    self.flushed += len(events)
+                except Exception:
+                    self.failed += len(events)
+                    logger.exception("Failed to write %d click events", len(events))
+                total += len(events)
+        return total
+
+    def close(self, timeout: float = 10.0):
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout)
+
+    def stats(self) -> dict:
+        return {
+            'buffered': len(self.buffer),
+            'capacity': self.buffer.capacity,
+            'recorded': self.recorded,
+            'dropped': self.dropped,
+            'flushed': self.flushed,
+            'failed': self.failed,
+            'pruned': self.pruned,
+        }
+
+
+def aggregate_clicks(events: List[tuple]) -> dict:
+    # Collapses raw events into {short_url: (count, last_clicked_at)}.
+    counts = {}
+    for short_url, clicked_at in events:
+        count, last = counts.get(short_url, (0, 0.0))
+        counts[short_url] = (count + 1, max(last, clicked_at))
+    return counts
+
+
+def bucket_start(timestamp: float, granularity: str) -> int:
+    width = ROLLUP_GRANULARITIES[granularity]
+    return int(timestamp // width) * width
+
+
+def rollup_cutoffs(now: float) -> dict:
+    # {granularity: first bucket to keep}
+    return {granularity: bucket_start(now - retention, granularity)
+            for granularity, retention in ROLLUP_RETENTION.items()}
+
+
+def aggregate_rollups(events: List[tuple]) -> dict:
+    # Collapses raw events into {(short_url, granularity, bucket): count}.
+    counts = {}
+    for short_url, clicked_at in events:
+        for granularity in ROLLUP_GRANULARITIES:
+            key = (short_url, granularity, bucket_start(clicked_at, granularity))
+            counts[key] = counts.get(key, 0) + 1
+    return counts
@@ -0,0 +1,122 @@
+import math
+import random
+import string
+import threading
+from abc import ABC, abstractmethod
+from typing import List
+from cleanArchitecture.models import UrlRepository
+
+ALPHABET = string.ascii_letters + string.digits
+BASE = len(ALPHABET)
+_INDEX = {char: i for i, char in enumerate(ALPHABET)}
+
+
+def encode(number: int, length: int) -> str:
+    chars = []
+    for _ in range(length):
+        number, digit = divmod(number, BASE)
+        chars.append(ALPHABET[digit])
+    if number:
+        raise ValueError(f"Number does not fit in {length} base62 characters")
+    return ''.join(reversed(chars))
+
+
+def decode(code: str) -> int:
+    number = 0
+    for char in code:
+        number = number * BASE + _INDEX[char]
+    return number
+
+
+class CodeAllocator(ABC):
+    def __init__(self, length: int = 6):
+        self.length = length
+        self.keyspace = BASE ** length
+
+    @abstractmethod
+    def next_code(self) -> str:
+        pass
+
+    def next_codes(self, count: int) -> List[str]:
+        return [self.next_code() for _ in range(count)]
+
+    @abstractmethod
+    def expected_collision_rate(self, used: int) -> float:
+        pass
+
+
+class RandomCodeAllocator(CodeAllocator):
+    # Random codes, no pre-check: the caller inserts and retries when the
+    # UNIQUE constraint rejects the code.
+    def next_code(self) -> str:
+        return ''.join(random.choices(ALPHABET, k=self.length))
+
+    def expected_collision_rate(self, used: int) -> float:
+        return min(used / self.keyspace, 1.0)
+
+
+class SequenceCodeAllocator(CodeAllocator):
+    # Numbers come from blocks reserved in the repository, so each worker
+    # hands out codes from memory and only touches the database once per
+    # block. An affine permutation of the keyspace turns consecutive numbers
+    # into codes that do not look sequential while staying collision-free.
+    SEQUENCE_NAME = 'short_url'
+
+    def __init__(self, url_repository: UrlRepository, length: int = 6, block_size: int = 1000,
+                 multiplier: int = 1580030173, offset: int = 92821):
+        super().__init__(length)
+        if math.gcd(multiplier, self.keyspace) != 1:
+            raise ValueError("Multiplier must be coprime with the keyspace size")
+        self.url_repository = url_repository
+        self.block_size = block_size
+        self.multiplier = multiplier
+        self.offset = offset
+        self._lock = threading.Lock()
+        self._next = 0
+        self._end = 0
+
+    def next_code(self) -> str:
+        with self._lock:
+            if self._next >= self._end:
+                self._next = self.url_repository.reserve_code_block(self.SEQUENCE_NAME, self.block_size)
+                self._end = self._next + self.block_size
+            number = self._next
+            self._next += 1
+        if number >= self.keyspace:
+            raise RuntimeError(f"Short url keyspace of length {self.length} is exhausted")
+        return encode((number * self.multiplier + self.offset) % self.keyspace, self.length)
+
+    def next_codes(self, count: int) -> List[str]:
+        # Bulk requests reserve everything they are short of in one call
+        # instead of one block at a time.
+        with self._lock:
+            available = self._end - self._next
+            if available < count:
+                needed = max(count - available, self.block_size)
+                start = self.url_repository.reserve_code_block(self.SEQUENCE_NAME, needed)
+                numbers = list(range(self._next, self._end)) + list(range(start, start + count - available))
+                self._next, self._end = start + count - available, start + needed
+            else:
+                numbers = list(range(self._next, self._next + count))
+                self._next += count
+        if numbers and max(numbers) >= self.keyspace:
+            raise RuntimeError(f"Short url keyspace of length {self.length} is exhausted")
+        return [encode((number * self.multiplier + self.offset) % self.keyspace, self.length)
+                for number in numbers]
+
+    def expected_collision_rate(self, used: int) -> float:
+        # The sequence never repeats itself; only codes chosen by hand in
+        # update_url can collide with it.
+        return 0.0
+
+
+def keyspace_report(used: int, allocator: CodeAllocator) -> dict:
+    collision_rate = allocator.expected_collision_rate(used)
+    return {
+        'length': allocator.length,
+        'keyspace': allocator.keyspace,
+        'used': used,
+        'fill_ratio': used / allocator.keyspace,
+        'expected_collision_rate': collision_rate,
+        'expected_attempts': 1 / (1 - collision_rate) if collision_rate < 1 else math.inf,
+    }
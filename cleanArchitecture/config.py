@@ -4,13 +4,83 @@ from datetime import datetime, timedelta
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or '17d12f754a0b418eaab9eb3ef876165e'
     DATABASE_PATH = os.environ.get('DATABASE_PATH') or 'urls.db'
+    DATABASE_URL = os.environ.get('DATABASE_URL')  # PostgreSQL DSN; when set, links are stored there instead
+    # SQLite shard files, in shard order; python -m cleanArchitecture.sharding reshard creates them
+    # Edits cannot move a link to a code that hashes to another shard
+    SHARD_PATHS = [path for path in (os.environ.get('SHARD_PATHS') or '').split(',') if path]
+    # Read replicas for link lookups: local SQLite copies kept current by
+    # python -m cleanArchitecture.replication sync, or PostgreSQL standby DSNs
+    REPLICA_PATHS = [path for path in (os.environ.get('REPLICA_PATHS') or '').split(',') if path]
+    REPLICA_URLS = [url for url in (os.environ.get('REPLICA_URLS') or '').split(',') if url]
+    REPLICA_MAX_STALENESS = float(os.environ.get('REPLICA_MAX_STALENESS') or 2.0)  # seconds
     JWT_EXPIRATION_DELTA = timedelta(hours=1)
+    JWT_ALGORITHM = os.environ.get('JWT_ALGORITHM') or 'HS256'  # HS256, RS256, ES256 or EdDSA
+    JWT_KEYRING_PATH = os.environ.get('JWT_KEYRING_PATH')  # keyring manifest JSON
+    JWT_KEYRING_RELOAD_INTERVAL = 60.0
+    # Shared by all workers; defaults to revocations.db next to DATABASE_PATH
+    REVOCATION_DB_PATH = os.environ.get('REVOCATION_DB_PATH')
+    REVOCATION_CAPACITY = 100000
+    REVOCATION_BITS_PER_ENTRY = 12
+    TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE') or 10000)  # 0 disables the cache
+    TOKEN_CACHE_TTL = 300.0
+    TOKEN_CACHE_NEGATIVE_TTL = 30.0
 
     DEBUG = False
     TESTING = False
 
     SHORT_URL_LENGTH = 6
     MAX_URL_LENGTH = 2048
+    SHORT_CODE_STRATEGY = os.environ.get('SHORT_CODE_STRATEGY') or 'random'  # 'random' or 'sequence'
+    SHORT_CODE_BLOCK_SIZE = 1000
+
+    DEFAULT_PAGE_SIZE = 50
+    MAX_PAGE_SIZE = 500
+
+    LISTING_CACHE_ENABLED = (os.environ.get('LISTING_CACHE_ENABLED') or 'true').lower() == 'true'
+    LISTING_PAGE_CACHE_SIZE = 256  # rendered /link pages, keyed by listing version, cursor and limit
+    LISTING_FRAGMENT_CACHE_SIZE = 10000  # rendered table rows
+
+    CLICK_TRACKING_ENABLED = (os.environ.get('CLICK_TRACKING_ENABLED') or 'true').lower() == 'true'
+    CLICK_BUFFER_SIZE = 65536
+    CLICK_FLUSH_SIZE = 1000
+    CLICK_FLUSH_INTERVAL = 1.0
+    CLICK_ENQUEUE_TIMEOUT = 0.0  # seconds a redirect may wait for buffer space before the click is dropped
+    CLICK_ROLLUP_PRUNE_INTERVAL = 600.0  # seconds between drops of minute/hour rollups and raw clicks past their retention
+
+    METRICS_ENABLED = (os.environ.get('METRICS_ENABLED') or 'true').lower() == 'true'
+    METRICS_PATH = '/metrics'
+
+    PROFILER_ENABLED = (os.environ.get('PROFILER_ENABLED') or 'false').lower() == 'true'
+    PROFILER_SAMPLE_RATE = float(os.environ.get('PROFILER_SAMPLE_RATE') or 0.0)  # share of requests profiled
+    PROFILER_INTERVAL = 0.005
+    PROFILER_OUTPUT_DIR = os.environ.get('PROFILER_OUTPUT_DIR') or 'profiles'
+
+    ASYNC_EXECUTOR_WORKERS = int(os.environ.get('ASYNC_EXECUTOR_WORKERS') or 8)
+    ASYNC_MAX_PENDING = 1000
+
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE') or 5)
+    DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT') or 5.0)
+    DB_POOL_HEALTH_CHECK_INTERVAL = 30.0
+
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE') or 'WAL'
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS') or 'NORMAL'
+    SQLITE_MMAP_SIZE = 256 * 1024 * 1024
+    SQLITE_CACHE_SIZE = -16000
+    SQLITE_BUSY_TIMEOUT = 5000
+    SQLITE_STATEMENT_CACHE_SIZE = 256
+
+    URL_CACHE_SIZE = int(os.environ.get('URL_CACHE_SIZE') or 10000)  # 0 disables the cache
+    URL_CACHE_TTL = 300.0
+    URL_CACHE_NEGATIVE_TTL = 30.0
+    URL_CACHE_BACKEND = os.environ.get('URL_CACHE_BACKEND') or 'local'  # 'local' or 'shared'
+    URL_SHARED_CACHE_PATH = os.environ.get('URL_SHARED_CACHE_PATH') or 'redirect_cache.db'
+    URL_SHARED_CACHE_SIZE = 100000  # rows kept in the shared file
+
+    URL_INDEX_ENABLED = (os.environ.get('URL_INDEX_ENABLED') or 'false').lower() == 'true'
+    URL_INDEX_SNAPSHOT_PATH = os.environ.get('URL_INDEX_SNAPSHOT_PATH')  # python -m cleanArchitecture.snapshot export
+    URL_INDEX_MERGE_THRESHOLD = 10000
+    URL_INDEX_SYNC_INTERVAL = 5.0  # seconds between change log catch-ups
+    CHANGE_LOG_RETENTION = 100000  # url change log rows kept; readers further behind reload, 0 keeps all
 
 class DevelopmentConfig(Config):
     DEBUG = True
@@ -20,13 +90,17 @@ class TestingConfig(Config):
     TESTING = True
     DATABASE_PATH = ':memory' #use in-memory sqlite
     SECRET_KEY = 'test-secret-key'
+    DB_POOL_SIZE = 1
 
 class ProductionConfig(Config):
     SECRET_KEY = os.environ.get('SECRET_KEY')
     DATABASE_PATH = os.environ.get('DATABASE_PATH') or 'prod_urls.db'
 
-    if not SECRET_KEY:
-        raise ValueError("No SECRET_KEY set for production environment")
+    # Checked on instantiation (app.config.from_object(ProductionConfig())) so
+    # that importing this module for pool/storage defaults works without it.
+    def __init__(self):
+        if not self.SECRET_KEY:
+            raise ValueError("No SECRET_KEY set for production environment")
 
 
 config = {
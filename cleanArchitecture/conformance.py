@@ -0,0 +1,353 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+import traceback
+from contextlib import contextmanager
+from typing import Callable, List
+from cleanArchitecture.models import Url, ShortUrlConflictError, ChangeLogGapError
+from cleanArchitecture.repositories import SQLiteUrlRepository, encode_cursor
+from cleanArchitecture.sharding import ShardedUrlRepository, shard_for_code
+
+# python -m cleanArchitecture.conformance [--postgres DSN|local] [--shards N] [--no-sqlite]
+#
+# Runs the same behavioural checks against every UrlRepository backend, so
+# a new backend (or a change to one) can be held to what the services rely
+# on. Each check gets a fresh, empty repository: a temporary SQLite file,
+# a set of temporary shard files, or a throwaway schema in the given
+# PostgreSQL database. --postgres local starts a temporary PostgreSQL
+# server from the pgserver package (pip install pgserver) instead.
+
+CHECKS: List[Callable] = []
+# Run against the sharded backend only, after CHECKS.
+SHARDED_CHECKS: List[Callable] = []
+
+
+def check(func):
+    CHECKS.append(func)
+    return func
+
+
+def sharded_check(func):
+    SHARDED_CHECKS.append(func)
+    return func
+
+
+def expect(condition, message: str):
+    if not condition:
+        raise AssertionError(message)
+
+
+def expect_raises(error, func, *args):
+    try:
+        func(*args)
+    except error:
+        return
+    raise AssertionError(f"{func.__name__} did not raise {error.__name__}")
+
+
+def codes_on_one_shard(repository, prefix: str, count: int) -> List[str]:
+    # A sharded backend only changes a link's code within its shard, so
+    # checks that rename links take all their codes from one shard.
+    shards = len(repository.shards) if isinstance(repository, ShardedUrlRepository) else 1
+    codes = [f'{prefix}{i:03d}' for i in range(1000)]
+    return [code for code in codes if shard_for_code(code, shards) == shard_for_code(codes[0], shards)][:count]
+
+
+@check
+def save_and_find(repository):
+    url = repository.save(Url(id=None, short_url='abc123', long_url='https://example.com/a'))
+    expect(url.id is not None, "save() must assign an id")
+    found = repository.find_by_short_url('abc123')
+    expect(found is not None and found.id == url.id and found.long_url == 'https://example.com/a',
+           f"find_by_short_url returned {found!r}")
+    expect(found.created_at is not None, "created_at must be set by the database")
+    expect(repository.find_by_id(url.id) == found, "find_by_id and find_by_short_url disagree")
+    expect(repository.find_by_short_url('nope00') is None, "unknown code must give None")
+    expect(repository.find_by_id(url.id + 1000) is None, "unknown id must give None")
+    expect(repository.exists_by_short_url('abc123') and not repository.exists_by_short_url('nope00'),
+           "exists_by_short_url is wrong")
+    expect(repository.count() == 1, f"count() is {repository.count()}")
+
+
+@check
+def duplicate_code_conflicts(repository):
+    repository.save(Url(id=None, short_url='dup000', long_url='https://example.com/1'))
+    expect_raises(ShortUrlConflictError, repository.save,
+                  Url(id=None, short_url='dup000', long_url='https://example.com/2'))
+    expect(repository.count() == 1, "a conflicting save must not insert")
+    repository.save(Url(id=None, short_url='dup001', long_url='https://example.com/3'))
+
+
+@check
+def save_many_skips_taken_codes(repository):
+    repository.save(Url(id=None, short_url='taken0', long_url='https://example.com/old'))
+    urls = [Url(id=None, short_url=f'bulk{i:02d}', long_url=f'https://example.com/{i}') for i in range(50)]
+    urls.append(Url(id=None, short_url='taken0', long_url='https://example.com/new'))
+    saved = repository.save_many(urls)
+    expect(len(saved) == 50, f"save_many saved {len(saved)} of 50 free codes")
+    expect(urls[-1].id is None, "the taken code must come back with id None")
+    expect(all(url.id is not None for url in urls[:-1]), "saved urls must get ids")
+    expect(repository.find_by_short_url('taken0').long_url == 'https://example.com/old',
+           "save_many must not overwrite an existing code")
+    expect(repository.find_by_short_url('bulk07').id == urls[7].id, "ids must match the stored rows")
+    expect(repository.save_many([]) == [], "an empty batch saves nothing")
+
+
+@check
+def pages_cover_everything_once(repository):
+    repository.save_many([Url(id=None, short_url=f'page{i:02d}', long_url=f'https://example.com/{i}')
+                          for i in range(23)])
+    seen, cursor = [], None
+    while True:
+        page = repository.get_page(5, cursor)
+        expect(len(page.items) <= 5, "a page must respect the limit")
+        seen.extend(page.items)
+        cursor = page.next_cursor
+        if cursor is None:
+            break
+    expect(len(seen) == 23 and len({url.id for url in seen}) == 23, f"paging returned {len(seen)} rows")
+    keys = [(url.created_at, url.id) for url in seen]
+    expect(keys == sorted(keys, reverse=True), "pages must be newest first")
+    expect_raises(ValueError, repository.get_page, 5, 'not-a-cursor!')
+    expect_raises(ValueError, repository.get_page, 5, encode_cursor('not-a-time', seen[0].id))
+
+
+@check
+def listing_and_export(repository):
+    repository.save_many([Url(id=None, short_url=f'iter{i:02d}', long_url=f'https://example.com/{i}')
+                          for i in range(12)])
+    exported = list(repository.iter_all(chunk_size=5))
+    ids = [url.id for url in exported]
+    expect(len(exported) == 12 and ids == sorted(ids), "iter_all must yield every row in id order")
+    expect(sorted(url.id for url in repository.get_all()) == ids, "get_all and iter_all disagree")
+    # An abandoned export must not keep the connection busy.
+    partial = repository.iter_all(chunk_size=2)
+    next(partial)
+    partial.close()
+    expect(repository.count() == 12, "repository unusable after an abandoned export")
+
+
+@check
+def update_rules(repository):
+    first_code, taken_code, new_code = codes_on_one_shard(repository, 'upd', 3)
+    first = repository.save(Url(id=None, short_url=first_code, long_url='https://example.com/1'))
+    repository.save(Url(id=None, short_url=taken_code, long_url='https://example.com/2'))
+    updated = repository.update(first.id, new_code, 'https://example.com/changed')
+    expect(updated is not None and updated.id == first.id and updated.short_url == new_code and
+           updated.long_url == 'https://example.com/changed', f"update returned {updated!r}")
+    expect(repository.find_by_short_url(first_code) is None, "the old code must be gone")
+    expect_raises(ShortUrlConflictError, repository.update, first.id, taken_code, 'https://example.com/x')
+    expect(repository.find_by_id(first.id).short_url == new_code, "a conflicting update must not apply")
+    expect(repository.update(first.id + 1000, 'upd555', 'https://example.com/y') is None,
+           "updating an unknown id gives None")
+
+
+@sharded_check
+def code_changes_stay_on_their_shard(repository):
+    if len(repository.shards) == 1:
+        return
+    url = repository.save(Url(id=None, short_url='mov000', long_url='https://example.com/1'))
+    home = shard_for_code('mov000', len(repository.shards))
+    elsewhere = next(f'mov{i:03d}' for i in range(1, 1000)
+                     if shard_for_code(f'mov{i:03d}', len(repository.shards)) != home)
+    expect_raises(ValueError, repository.update, url.id, elsewhere, 'https://example.com/2')
+    expect(repository.find_by_id(url.id) == url, "a refused move must leave the link as it was")
+    expect(repository.find_by_short_url(elsewhere) is None, "a refused move must not copy the link")
+
+
+@check
+def delete_removes_clicks(repository):
+    url = repository.save(Url(id=None, short_url='del000', long_url='https://example.com/1'))
+    repository.record_clicks([('del000', time.time())])
+    expect(repository.delete(url.id), "delete of an existing id must return True")
+    expect(not repository.delete(url.id), "a second delete must return False")
+    expect(repository.find_by_id(url.id) is None, "deleted row still found")
+    expect(repository.get_click_counts([url.id]) == {url.id: 0}, "clicks must go with the link")
+    expect(repository.get_click_series(url.id, 'day', 0) == [], "rollups must go with the link")
+
+
+@check
+def code_blocks_do_not_overlap(repository):
+    first = repository.reserve_code_block('conformance', 100)
+    second = repository.reserve_code_block('conformance', 50)
+    other = repository.reserve_code_block('other', 10)
+    expect(first == 0 and second == 100, f"blocks start at {first} and {second}")
+    expect(other == 0, "sequences are independent by name")
+
+
+@check
+def change_log_follows_writes(repository):
+    code, new_code = codes_on_one_shard(repository, 'log', 2)
+    start = repository.current_change_seq()
+    versions = [repository.change_version()]
+    url = repository.save(Url(id=None, short_url=code, long_url='https://example.com/1'))
+    versions.append(repository.change_version())
+    repository.update(url.id, new_code, 'https://example.com/2')
+    versions.append(repository.change_version())
+    repository.delete(url.id)
+    versions.append(repository.change_version())
+    expect(all(a != b for a, b in zip(versions, versions[1:])), "change_version must move on every write")
+    changes = repository.get_changes(start)
+    expect([(change.old_short_url, change.short_url) for change in changes] ==
+           [(None, code), (code, new_code), (new_code, None)], f"change log is {changes!r}")
+    expect(all(change.url_id == url.id for change in changes), "changes must carry the url id")
+    seqs = [change.seq for change in changes]
+    expect(seqs == sorted(set(seqs)) and repository.current_change_seq() == seqs[-1],
+           "seqs must increase and current_change_seq must be the last one")
+    expect(len(repository.get_changes(start, limit=2)) == 2, "get_changes must honour the limit")
+    resumed, position = [], start
+    while True:
+        batch = repository.get_changes(position, limit=1)
+        if not batch:
+            break
+        expect(len(batch) == 1, "get_changes must honour the limit")
+        resumed.append(batch[0].seq)
+        position = batch[0].seq
+    expect(resumed == seqs, "resuming from each returned seq must give the same changes")
+    if hasattr(repository, 'prune_changes'):
+        repository.prune_changes(seqs[1])
+        expect_raises(ChangeLogGapError, repository.get_changes, start)
+        expect([change.seq for change in repository.get_changes(seqs[1])] == seqs[2:], "pruning lost changes")
+        expect(repository.current_change_seq() == seqs[-1], "pruning must not move current_change_seq back")
+
+
+@check
+def clicks_and_rollups(repository):
+    popular = repository.save(Url(id=None, short_url='clk000', long_url='https://example.com/1'))
+    rare = repository.save(Url(id=None, short_url='clk001', long_url='https://example.com/2'))
+    hour = 3600 * 1000
+    events = [('clk000', hour + 10.5)] * 5 + [('clk000', 2 * hour + 1)] * 2 + [('clk001', hour + 20)]
+    events.append(('missing', hour))
+    repository.record_clicks(events)
+    repository.record_clicks([('clk001', 2 * hour + 5)])
+    repository.record_clicks([])
+    expect(repository.get_click_counts([popular.id, rare.id, 999999]) == {popular.id: 7, rare.id: 2, 999999: 0},
+           "click counts are wrong")
+    top = repository.get_top_urls(10)
+    expect([(url.id, clicks) for url, clicks in top] == [(popular.id, 7), (rare.id, 2)], f"top urls {top!r}")
+    windowed = repository.get_top_urls(10, 'hour', 2 * hour)
+    expect([(url.id, clicks) for url, clicks in windowed] == [(popular.id, 2), (rare.id, 1)],
+           f"windowed top urls {windowed!r}")
+    expect(repository.get_click_series(popular.id, 'hour', 0) == [(hour, 5), (2 * hour, 2)], "hourly series")
+    expect(repository.get_click_series(popular.id, 'hour', 0, 2 * hour) == [(hour, 5)], "until is exclusive")
+    expect(repository.prune_click_rollups({'hour': 2 * hour}) == 2, "one old hourly bucket per link is pruned")
+    expect(repository.get_click_series(popular.id, 'hour', 0) == [(2 * hour, 2)], "pruned hourly series")
+    expect(repository.get_click_series(popular.id, 'day', 0) != [], "day buckets are not pruned")
+    expect(repository.get_click_counts([popular.id]) == {popular.id: 7}, "totals survive pruning")
+    expect(repository.prune_clicks(hour + 15) == 5, "raw clicks before the cutoff are pruned")
+    expect(repository.prune_clicks(hour + 15) == 0, "pruning raw clicks twice deletes nothing")
+    expect(repository.get_click_series(popular.id, 'day', 0) != [], "rollups survive raw click pruning")
+
+
+def sqlite_backend():
+    @contextmanager
+    def fresh():
+        with tempfile.TemporaryDirectory(prefix='url-conformance-') as workdir:
+            repository = SQLiteUrlRepository(os.path.join(workdir, 'urls.db'), pool_size=2)
+            try:
+                yield repository
+            finally:
+                repository.close()
+    return fresh
+
+
+def sharded_backend(shards: int):
+    @contextmanager
+    def fresh():
+        with tempfile.TemporaryDirectory(prefix='url-conformance-') as workdir:
+            repository = ShardedUrlRepository([
+                SQLiteUrlRepository(os.path.join(workdir, f'shard{index}.db'), pool_size=2)
+                for index in range(shards)
+            ])
+            try:
+                yield repository
+            finally:
+                repository.close()
+    return fresh
+
+
+def postgres_backend(dsn: str):
+    import psycopg2.extensions
+    from cleanArchitecture.postgres import PostgresUrlRepository
+
+    @contextmanager
+    def fresh():
+        schema = f'url_conformance_{os.getpid()}_{time.monotonic_ns()}'
+        admin = psycopg2.connect(dsn)
+        admin.autocommit = True
+        admin.cursor().execute(f'CREATE SCHEMA {schema}')
+        repository = PostgresUrlRepository(
+            psycopg2.extensions.make_dsn(dsn, options=f'-c search_path={schema}'), pool_size=2)
+        try:
+            yield repository
+        finally:
+            repository.close()
+            admin.cursor().execute(f'DROP SCHEMA {schema} CASCADE')
+            admin.close()
+    return fresh
+
+
+@contextmanager
+def local_postgres():
+    import pgserver
+
+    with tempfile.TemporaryDirectory(prefix='url-conformance-pg-') as workdir:
+        server = pgserver.get_server(workdir, cleanup_mode='delete')
+        try:
+            yield server.get_uri()
+        finally:
+            server.cleanup()
+
+
+def run(name: str, fresh, checks: List[Callable]) -> int:
+    failures = 0
+    for func in checks:
+        started = time.perf_counter()
+        try:
+            with fresh() as repository:
+                func(repository)
+        except Exception:
+            failures += 1
+            print(f"FAIL {name} {func.__name__}\n{traceback.format_exc()}")
+            continue
+        print(f"ok   {name} {func.__name__} ({(time.perf_counter() - started) * 1e3:.0f} ms)")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m cleanArchitecture.conformance')
+    parser.add_argument('--postgres', default=os.environ.get('CONFORMANCE_POSTGRES_DSN'),
+                        help="DSN of a database the checks may create schemas in, or 'local' for a temporary server")
+    parser.add_argument('--no-sqlite', action='store_true')
+    parser.add_argument('--shards', type=int, default=4, help='shard count for the sharded SQLite run, 0 to skip')
+    args = parser.parse_args(argv)
+
+    if args.postgres == 'local':
+        with local_postgres() as dsn:
+            failures, total = run_backends(parser, args, dsn)
+    else:
+        failures, total = run_backends(parser, args, args.postgres)
+    print(f"{total - failures} passed, {failures} failed")
+    sys.exit(1 if failures else 0)
+
+
+def run_backends(parser, args, postgres_dsn):
+    backends = []
+    if not args.no_sqlite:
+        backends.append(('sqlite', sqlite_backend(), CHECKS))
+    if args.shards:
+        backends.append((f'sharded{args.shards}', sharded_backend(args.shards), CHECKS + SHARDED_CHECKS))
+    if postgres_dsn:
+        backends.append(('postgres', postgres_backend(postgres_dsn), CHECKS))
+    if not backends:
+        parser.error("No backend selected")
+
+    failures = sum(run(name, fresh, checks) for name, fresh, checks in backends)
+    total = sum(len(checks) for _, _, checks in backends)
+    return failures, total
+
+
+if __name__ == "__main__":
+    main()
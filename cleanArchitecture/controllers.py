@@ -1,40 +1,63 @@
-from flask import Flask, render_template, request, redirect, jsonify, session
+from flask import Flask, Response, current_app, render_template, request, redirect, jsonify, session, url_for
 from functools import wraps
+import csv, io, json, zlib
 
 from services import UrlShortenerService, AuthService
 
 
+def url_to_dict(url) -> dict:
+    return {
+        'id': url.id,
+        'short_url': url.short_url,
+        'long_url': url.long_url,
+        'created_at': url.created_at.isoformat() if url.created_at else None
+    }
+
+
 class UrlController:
-    def __init__(self, url_service: UrlShortenerService):
+    def __init__(self, url_service: UrlShortenerService, listing_cache=None):
         self.url_service = url_service
+        self.listing_cache = listing_cache
 
     def index(self):
+        cursor = request.args.get('cursor')
+        limit = request.args.get('limit', type=int)
+
         if request.method == 'POST':
             try:
-                long_url = request.form.get['long_url']
+                long_url = request.form.get('long_url')
                 if not long_url:
                     return render_template('index.html', error='Please enter a long url')
 
                 url = self.url_service.create_short_url(long_url)
-                urls = self.url_service.get_all_urls()
-                return render_template('index.html', links=urls, success=f"Short URL created: {url.short_url}")
+                page = self.url_service.get_url_page(limit=limit)
+                return render_template('index.html', links=page.items, next_cursor=page.next_cursor, limit=limit,
+                                       success=f"Short URL created: {url.short_url}")
             except Exception as e:
                 return render_template('index.html', error=e)
 
         try:
-            urls = self.url_service.get_all_urls()
-            return render_template('index.html', links=urls)
+            if self.listing_cache is not None:
+                return self.listing_cache.respond(cursor, limit, lambda: self._render_page(cursor, limit))
+            return self._render_page(cursor, limit)
         except Exception as e:
             return render_template('index.html', error=e)
 
+    def _render_page(self, cursor, limit) -> str:
+        page = self.url_service.get_url_page(cursor=cursor, limit=limit)
+        return render_template('index.html', links=page.items, next_cursor=page.next_cursor, cursor=cursor,
+                               limit=limit)
+
     def redirect_short(self, short_url: str):
         try:
             long_url = self.url_service.get_long_url(short_url)
             if long_url:
+                self.url_service.record_click(short_url)
                 return redirect(long_url, code=302)
             else:
                 return "URL not found", 404
         except Exception:
+            current_app.logger.exception("Redirect for %s failed", short_url)
             return "Internal Server Error", 500
 
     def update(self, url_id: int):
@@ -49,6 +72,8 @@ class UrlController:
                 updated_url = self.url_service.update_url(url_id, short_url, long_url)
                 if not updated_url:
                     return render_template('404.html')
+                if self.listing_cache is not None:
+                    self.listing_cache.invalidate(url_id)
 
                 return render_template('success.html', link=updated_url, success=f"Short URL updated: {short_url}")
 
@@ -69,12 +94,177 @@ class UrlController:
     def delete(self, url_id: int):
         try:
             if self.url_service.delete_url(url_id):
+                if self.listing_cache is not None:
+                    self.listing_cache.invalidate(url_id)
                 return render_template('success.html')
             else:
                 return render_template('404.html', error="URL not found")
         except Exception as e:
             return render_template('delete.html', error=e)
 
+    def bulk_create(self):
+        try:
+            created = self.url_service.bulk_create_short_urls(self._read_bulk_long_urls())
+        except (ValueError, KeyError) as e:
+            return jsonify({'error': f"Invalid bulk request: {e}"}), 400
+        except Exception:
+            return jsonify({'error': 'Internal Server Error'}), 500
+
+        return jsonify({
+            'count': len(created),
+            'links': [url_to_dict(url) for url in created]
+        }), 201
+
+    def export(self):
+        export_format = request.args.get('format', 'ndjson')
+        urls = self.url_service.export_urls()
+
+        if export_format == 'csv':
+            def generate_csv():
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                writer.writerow(['id', 'short_url', 'long_url', 'created_at'])
+                for url in urls:
+                    writer.writerow([url.id, url.short_url, url.long_url,
+                                     url.created_at.isoformat() if url.created_at else ''])
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+                yield buffer.getvalue()
+            return Response(generate_csv(), mimetype='text/csv',
+                            headers={'Content-Disposition': 'attachment; filename=links.csv'})
+
+        if export_format == 'ndjson':
+            def generate_ndjson():
+                for url in urls:
+                    yield json.dumps(url_to_dict(url)) + '\n'
+            return Response(generate_ndjson(), mimetype='application/x-ndjson')
+
+        return jsonify({'error': 'Unsupported export format, use ndjson or csv'}), 400
+
+    def _read_bulk_long_urls(self):
+        # Accepts a JSON array (or {"urls": [...]}), NDJSON or CSV with a
+        # long_url column. NDJSON and CSV are read line by line off the stream.
+        if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+            for line in request.stream:
+                if line.strip():
+                    yield self._bulk_entry(json.loads(line))
+        elif request.mimetype == 'text/csv':
+            for row in csv.DictReader(io.TextIOWrapper(request.stream, encoding='utf-8')):
+                yield row['long_url']
+        else:
+            data = request.get_json(silent=True)
+            if isinstance(data, dict):
+                data = data.get('urls')
+            if not isinstance(data, list):
+                raise ValueError("Expected a JSON list of urls")
+            for entry in data:
+                yield self._bulk_entry(entry)
+
+    @staticmethod
+    def _bulk_entry(entry) -> str:
+        return entry['long_url'] if isinstance(entry, dict) else entry
+
+
+
+class ApiController:
+    # JSON counterpart of UrlController under /api/v1/links.
+    def __init__(self, url_service: UrlShortenerService, listing_cache=None):
+        self.url_service = url_service
+        self.listing_cache = listing_cache
+
+    def list(self):
+        cursor = request.args.get('cursor')
+        limit = request.args.get('limit', type=int)
+        stream = request.args.get('stream', '').lower() in ('1', 'true')
+        # The listing version changes on every write, so an unchanged
+        # listing is answered with a 304 before any rows are read.
+        etag = f"{self.url_service.listing_version():x}-{zlib.crc32(repr((cursor, limit, stream)).encode()):08x}"
+        if request.if_none_match.contains(etag):
+            return self._conditional(Response(status=304), etag)
+
+        if stream:
+            return self._conditional(Response(self._stream_links(), mimetype='application/json'), etag)
+
+        try:
+            page = self.url_service.get_url_page(cursor=cursor, limit=limit)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return self._conditional(jsonify({
+            'links': [url_to_dict(url) for url in page.items],
+            'next_cursor': page.next_cursor,
+            'next': url_for(request.endpoint, cursor=page.next_cursor, limit=limit) if page.next_cursor else None
+        }), etag)
+
+    def _stream_links(self):
+        # Rows are serialized one at a time as the repository yields them,
+        # so memory stays flat however large the table is.
+        yield '{"links": ['
+        separator = ''
+        for url in self.url_service.export_urls():
+            yield separator + json.dumps(url_to_dict(url))
+            separator = ', '
+        yield ']}'
+
+    def create(self):
+        data = request.get_json(silent=True) or {}
+        long_url = data.get('long_url') if isinstance(data, dict) else None
+        if not long_url:
+            return jsonify({'error': 'long_url is required'}), 400
+        try:
+            url = self.url_service.create_short_url(long_url)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        response = jsonify(url_to_dict(url))
+        response.status_code = 201
+        response.headers['Location'] = f'/api/v1/links/{url.id}'
+        return response
+
+    def get(self, url_id: int):
+        url = self.url_service.get_url_by_id(url_id)
+        if not url:
+            return jsonify({'error': 'URL not found'}), 404
+        body = url_to_dict(url)
+        etag = f"{zlib.crc32(json.dumps(body, sort_keys=True).encode()):08x}"
+        if request.if_none_match.contains(etag):
+            return self._conditional(Response(status=304), etag)
+        return self._conditional(jsonify(body), etag)
+
+    def update(self, url_id: int):
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'error': 'Expected a JSON object'}), 400
+        existing = self.url_service.get_url_by_id(url_id)
+        if not existing:
+            return jsonify({'error': 'URL not found'}), 404
+        # PATCH may send only the field that changes.
+        short_url = data.get('short_url', existing.short_url if request.method == 'PATCH' else None)
+        long_url = data.get('long_url', existing.long_url if request.method == 'PATCH' else None)
+        if not short_url or not long_url:
+            return jsonify({'error': 'Both short_url and long_url are required'}), 400
+        try:
+            updated = self.url_service.update_url(url_id, short_url, long_url)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 409
+        if not updated:
+            return jsonify({'error': 'URL not found'}), 404
+        if self.listing_cache is not None:
+            self.listing_cache.invalidate(url_id)
+        return jsonify(url_to_dict(updated))
+
+    def delete(self, url_id: int):
+        if not self.url_service.delete_url(url_id):
+            return jsonify({'error': 'URL not found'}), 404
+        if self.listing_cache is not None:
+            self.listing_cache.invalidate(url_id)
+        return Response(status=204)
+
+    @staticmethod
+    def _conditional(response, etag: str):
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
 
 class AuthController:
     def __init__(self, auth_service: AuthService):
@@ -112,6 +302,34 @@ class AuthController:
     def protected(self):
         return 'JWT is verified. Welcome to your dashboard'
 
+    def logout(self):
+        try:
+            self.auth_service.revoke_token(request.args.get('token'))
+        except Exception as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify({'message': 'Token revoked'})
+
+class ProfilerController:
+    def __init__(self, profiler):
+        self.profiler = profiler
+
+    def control(self):
+        # POST ?seconds=N opens a profiling window, ?rate=F changes the
+        # share of requests sampled outside windows.
+        if request.method == 'POST':
+            seconds = request.args.get('seconds', type=float)
+            rate = request.args.get('rate', type=float)
+            if rate is not None:
+                if not 0.0 <= rate <= 1.0:
+                    return jsonify({'error': 'rate must be between 0 and 1'}), 400
+                self.profiler.sample_rate = rate
+            if seconds:
+                self.profiler.start_window(seconds)
+        return jsonify(self.profiler.status())
+
+    def dump(self):
+        return jsonify({'files': self.profiler.dump()})
+
 def create_token_required_decorator(auth_service: AuthService):
     def token_required(f):
         @wraps(f)
@@ -120,7 +338,10 @@ def create_token_required_decorator(auth_service: AuthService):
             if not token:
                 return jsonify({'error': 'Please provide a token'})
 
-            user = auth_service.validate_token(token)
+            try:
+                user = auth_service.validate_token(token)
+            except Exception as e:
+                return jsonify({'error': str(e)}), 401
             if not user:
                 return jsonify({'error': 'Invalid token'})
 
@@ -0,0 +1,237 @@
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, fields
+from typing import Dict, Optional, Tuple
+from cleanArchitecture.config import Config
+
+
+class PoolClosedError(RuntimeError):
+    pass
+
+
+class PoolTimeoutError(RuntimeError):
+    pass
+
+
+_SYNCHRONOUS_LEVELS = {'OFF': 0, 'NORMAL': 1, 'FULL': 2, 'EXTRA': 3}
+
+
+@dataclass(frozen=True)
+class SQLiteTuning:
+    journal_mode: str = 'WAL'
+    synchronous: str = 'NORMAL'
+    mmap_size: int = 256 * 1024 * 1024
+    cache_size: int = -16000  # negative means KiB, so ~16 MB of page cache
+    busy_timeout: int = 5000  # milliseconds
+    statement_cache_size: int = 256
+
+    _CONFIG_KEYS = {
+        'journal_mode': 'SQLITE_JOURNAL_MODE',
+        'synchronous': 'SQLITE_SYNCHRONOUS',
+        'mmap_size': 'SQLITE_MMAP_SIZE',
+        'cache_size': 'SQLITE_CACHE_SIZE',
+        'busy_timeout': 'SQLITE_BUSY_TIMEOUT',
+        'statement_cache_size': 'SQLITE_STATEMENT_CACHE_SIZE',
+    }
+
+    @classmethod
+    def from_config(cls, config=None) -> 'SQLiteTuning':
+        # Accepts a Flask config mapping or a Config class; missing keys
+        # fall back to the base Config defaults.
+        values = {}
+        for field in fields(cls):
+            key = cls._CONFIG_KEYS[field.name]
+            if isinstance(config, dict) and key in config:
+                values[field.name] = config[key]
+            else:
+                values[field.name] = getattr(config, key, getattr(Config, key))
+        return cls(**values)
+
+    def connect(self, database_path: str, **kwargs) -> sqlite3.Connection:
+        conn = sqlite3.connect(database_path, timeout=self.busy_timeout / 1000,
+                               cached_statements=self.statement_cache_size, **kwargs)
+        self.apply(conn)
+        return conn
+
+    def apply(self, conn: sqlite3.Connection):
+        conn.execute(f'PRAGMA busy_timeout = {int(self.busy_timeout)}')
+        conn.execute(f'PRAGMA journal_mode = {self.journal_mode}').fetchone()
+        conn.execute(f'PRAGMA synchronous = {self.synchronous}')
+        conn.execute(f'PRAGMA mmap_size = {int(self.mmap_size)}').fetchone()
+        conn.execute(f'PRAGMA cache_size = {int(self.cache_size)}')
+
+    def verify(self, conn: sqlite3.Connection) -> Dict[str, Tuple[object, object]]:
+        # Returns {pragma: (expected, actual)} for every setting that did not
+        # take effect; an empty dict means the connection is tuned as configured.
+        expected = {
+            'journal_mode': self.journal_mode.lower(),
+            'synchronous': _SYNCHRONOUS_LEVELS.get(str(self.synchronous).upper(), self.synchronous),
+            'mmap_size': int(self.mmap_size),
+            'cache_size': int(self.cache_size),
+            'busy_timeout': int(self.busy_timeout),
+        }
+        mismatches = {}
+        for pragma, value in expected.items():
+            row = conn.execute(f'PRAGMA {pragma}').fetchone()
+            actual = row[0] if row else None
+            if isinstance(actual, str):
+                actual = actual.lower()
+            if actual != value:
+                mismatches[pragma] = (value, actual)
+        return mismatches
+
+
+class ConnectionPool:
+    # Long-lived SQLite connections shared between threads. A thread gets
+    # back the connection it used last whenever that one is idle, and nested
+    # borrows from the same thread reuse the connection it already holds.
+    def __init__(self, database_path: str, size: int = 5, timeout: float = 5.0,
+                 health_check_interval: float = 30.0, tuning: Optional[SQLiteTuning] = None):
+        if size < 1:
+            raise ValueError("Pool size must be at least 1")
+        self.database_path = database_path
+        self.tuning = tuning or SQLiteTuning()
+        self.size = size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+
+        self._cond = threading.Condition(threading.Lock())
+        self._idle = []
+        self._all = set()
+        self._checked_at = {}
+        self._local = threading.local()
+        self._closed = False
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = self.tuning.connect(self.database_path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _is_healthy(self, conn: sqlite3.Connection) -> bool:
+        now = time.monotonic()
+        if now - self._checked_at.get(id(conn), 0.0) < self.health_check_interval:
+            return True
+        try:
+            conn.execute('SELECT 1').fetchone()
+        except sqlite3.Error:
+            return False
+        self._checked_at[id(conn)] = now
+        return True
+
+    def _discard(self, conn: sqlite3.Connection):
+        with self._cond:
+            self._all.discard(conn)
+            self._checked_at.pop(id(conn), None)
+            self._cond.notify()
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    def _take(self) -> sqlite3.Connection:
+        preferred = getattr(self._local, 'last', None)
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolClosedError("Connection pool is closed")
+                if self._idle:
+                    if preferred in self._idle:
+                        self._idle.remove(preferred)
+                        return preferred
+                    return self._idle.pop()
+                if len(self._all) < self.size:
+                    conn = self._connect()
+                    self._all.add(conn)
+                    self._checked_at[id(conn)] = time.monotonic()
+                    return conn
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeoutError(
+                        f"No connection available within {self.timeout}s (pool size {self.size})")
+                self._cond.wait(remaining)
+
+    def acquire(self) -> sqlite3.Connection:
+        while True:
+            conn = self._take()
+            if self._is_healthy(conn):
+                self._local.last = conn
+                return conn
+            self._discard(conn)
+
+    def release(self, conn: sqlite3.Connection):
+        if conn.in_transaction:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                self._discard(conn)
+                return
+        with self._cond:
+            if self._closed or conn not in self._all:
+                self._all.discard(conn)
+                conn.close()
+                return
+            self._idle.append(conn)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        held = getattr(self._local, 'held', None)
+        if held is not None:
+            self._local.depth += 1
+            try:
+                yield held
+            finally:
+                self._local.depth -= 1
+            return
+
+        conn = self.acquire()
+        self._local.held = conn
+        self._local.depth = 1
+        try:
+            yield conn
+        finally:
+            self._local.held = None
+            self._local.depth = 0
+            self.release(conn)
+
+    def verify(self) -> Dict[str, Tuple[object, object]]:
+        with self.connection() as conn:
+            return self.tuning.verify(conn)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                'size': self.size,
+                'open': len(self._all),
+                'idle': len(self._idle),
+                'in_use': len(self._all) - len(self._idle),
+                'closed': self._closed,
+            }
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            for conn in idle:
+                self._all.discard(conn)
+            self._cond.notify_all()
+        for conn in idle:
+            conn.close()
+
+
+if __name__ == "__main__":
+    # python -m cleanArchitecture.database [database_path]
+    path = sys.argv[1] if len(sys.argv) > 1 else Config.DATABASE_PATH
+    tuning = SQLiteTuning.from_config(Config)
+    conn = tuning.connect(path)
+    problems = tuning.verify(conn)
+    conn.close()
+    if problems:
+        for pragma, (expected, actual) in problems.items():
+            print(f"{pragma}: expected {expected!r}, got {actual!r}")
+        sys.exit(1)
+    print(f"{path}: storage settings applied")
@@ -0,0 +1,224 @@
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+from jwt.algorithms import get_default_algorithms
+
+logger = logging.getLogger(__name__)
+
+class KeyNotFoundError(Exception):
+    pass
+
+
+@dataclass
+class JWTKey:
+    kid: str
+    algorithm: str
+    public_key: object
+    private_key: Optional[object] = None
+    activate_at: float = 0.0
+    retire_at: Optional[float] = None
+
+    def can_sign(self, now: float) -> bool:
+        return self.private_key is not None and self.activate_at <= now and not self.is_retired(now)
+
+    def is_retired(self, now: float) -> bool:
+        return self.retire_at is not None and now >= self.retire_at
+
+
+def infer_algorithm(key) -> str:
+    if isinstance(key, (rsa.RSAPrivateKey, rsa.RSAPublicKey)):
+        return 'RS256'
+    if isinstance(key, (ec.EllipticCurvePrivateKey, ec.EllipticCurvePublicKey)):
+        return 'ES256'
+    if isinstance(key, (ed25519.Ed25519PrivateKey, ed25519.Ed25519PublicKey)):
+        return 'EdDSA'
+    raise ValueError(f"Unsupported key type: {type(key).__name__}")
+
+
+def generate_private_key(algorithm: str):
+    if algorithm == 'RS256':
+        return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    if algorithm == 'ES256':
+        return ec.generate_private_key(ec.SECP256R1())
+    if algorithm == 'EdDSA':
+        return ed25519.Ed25519PrivateKey.generate()
+    raise ValueError(f"Unsupported algorithm: {algorithm}")
+
+
+def _timestamp(value) -> Optional[float]:
+    if value is None or isinstance(value, (int, float)):
+        return value
+    return datetime.fromisoformat(value).timestamp()
+
+
+class KeyRing:
+    # Keys are parsed once when they are added and kept as cryptography key
+    # objects indexed by kid, so verifying a token is a dict lookup plus the
+    # signature check. Scheduling is expressed through activate_at (when a key
+    # starts signing) and retire_at (when tokens signed with it stop being
+    # accepted); the gap between a successor's activation and the old key's
+    # retirement is the overlap window and should cover the token lifetime.
+    def __init__(self, keys: Optional[List[JWTKey]] = None):
+        self._keys: Dict[str, JWTKey] = {}
+        self._lock = threading.Lock()
+        self.manifest_path = None
+        self.reload_interval = 60.0
+        self._manifest_mtime = None
+        self._checked_at = 0.0
+        for key in keys or []:
+            self.add(key)
+
+    def add(self, key: JWTKey) -> JWTKey:
+        with self._lock:
+            self._keys[key.kid] = key
+        return key
+
+    def add_pem(self, kid: str, private_pem: Optional[bytes] = None, public_pem: Optional[bytes] = None,
+                algorithm: Optional[str] = None, activate_at=0.0, retire_at=None) -> JWTKey:
+        if private_pem is None and public_pem is None:
+            raise ValueError(f"Key {kid} needs a private or a public PEM")
+        private_key = serialization.load_pem_private_key(private_pem, password=None) if private_pem else None
+        public_key = private_key.public_key() if private_key else serialization.load_pem_public_key(public_pem)
+        return self.add(JWTKey(
+            kid=kid,
+            algorithm=algorithm or infer_algorithm(public_key),
+            public_key=public_key,
+            private_key=private_key,
+            activate_at=_timestamp(activate_at) or 0.0,
+            retire_at=_timestamp(retire_at),
+        ))
+
+    def generate(self, kid: str, algorithm: str = 'RS256', activate_at: Optional[float] = None,
+                 retire_at: Optional[float] = None) -> JWTKey:
+        private_key = generate_private_key(algorithm)
+        return self.add(JWTKey(
+            kid=kid,
+            algorithm=algorithm,
+            public_key=private_key.public_key(),
+            private_key=private_key,
+            activate_at=time.time() if activate_at is None else activate_at,
+            retire_at=retire_at,
+        ))
+
+    def rotate(self, kid: str, algorithm: str = 'RS256', activate_at: Optional[float] = None,
+               overlap: float = 3660.0) -> JWTKey:
+        # Schedules a new signing key; the keys signing today keep verifying
+        # until overlap seconds after the new one takes over.
+        activate_at = time.time() if activate_at is None else activate_at
+        new_key = self.generate(kid, algorithm, activate_at=activate_at)
+        with self._lock:
+            for key in self._keys.values():
+                if key is not new_key and key.private_key is not None and key.retire_at is None:
+                    key.retire_at = activate_at + overlap
+        return new_key
+
+    def signing_key(self, now: Optional[float] = None) -> JWTKey:
+        self.reload_if_changed()
+        now = time.time() if now is None else now
+        candidates = [key for key in list(self._keys.values()) if key.can_sign(now)]
+        if not candidates:
+            raise KeyNotFoundError("No active signing key")
+        return max(candidates, key=lambda key: key.activate_at)
+
+    def verification_key(self, kid: Optional[str], now: Optional[float] = None) -> JWTKey:
+        self.reload_if_changed()
+        key = self._keys.get(kid)
+        if key is None:
+            raise KeyNotFoundError(f"Unknown key id: {kid}")
+        if key.is_retired(time.time() if now is None else now):
+            raise KeyNotFoundError(f"Key {kid} has been retired")
+        return key
+
+    def prune(self, now: Optional[float] = None):
+        now = time.time() if now is None else now
+        with self._lock:
+            for kid in [kid for kid, key in self._keys.items() if key.is_retired(now)]:
+                del self._keys[kid]
+
+    def jwks(self) -> dict:
+        # Public half of every non-retired key, for services that only verify.
+        now = time.time()
+        algorithms = get_default_algorithms()
+        keys = []
+        for key in list(self._keys.values()):
+            if key.is_retired(now):
+                continue
+            jwk = algorithms[key.algorithm].to_jwk(key.public_key, as_dict=True)
+            jwk.update({'kid': key.kid, 'alg': key.algorithm, 'use': 'sig'})
+            keys.append(jwk)
+        return {'keys': keys}
+
+    @classmethod
+    def from_manifest(cls, path: str, reload_interval: float = 60.0) -> 'KeyRing':
+        keyring = cls()
+        keyring.manifest_path = path
+        keyring.reload_interval = reload_interval
+        keyring.load_manifest()
+        return keyring
+
+    def load_manifest(self):
+        # Manifest format: {"keys": [{"kid", "private_key" or "public_key"
+        # (PEM paths relative to the manifest), "algorithm", "activate_at",
+        # "retire_at"}]}. Timestamps are epoch seconds or ISO 8601 strings.
+        base_dir = os.path.dirname(os.path.abspath(self.manifest_path))
+        mtime = os.path.getmtime(self.manifest_path)
+        with open(self.manifest_path) as f:
+            entries = json.load(f)['keys']
+
+        loaded = KeyRing()
+        for entry in entries:
+            known = self._keys.get(entry['kid'])
+            if known is not None:
+                # Already parsed; only the schedule may have changed.
+                loaded.add(JWTKey(kid=known.kid, algorithm=entry.get('algorithm') or known.algorithm,
+                                  public_key=known.public_key, private_key=known.private_key,
+                                  activate_at=_timestamp(entry.get('activate_at')) or 0.0,
+                                  retire_at=_timestamp(entry.get('retire_at'))))
+                continue
+            pems = {}
+            for field in ('private_key', 'public_key'):
+                if entry.get(field):
+                    with open(os.path.join(base_dir, entry[field]), 'rb') as f:
+                        pems[field] = f.read()
+            loaded.add_pem(entry['kid'], private_pem=pems.get('private_key'), public_pem=pems.get('public_key'),
+                           algorithm=entry.get('algorithm'), activate_at=entry.get('activate_at'),
+                           retire_at=entry.get('retire_at'))
+
+        with self._lock:
+            self._keys = loaded._keys
+            self._manifest_mtime = mtime
+
+    def reload_if_changed(self):
+        if self.manifest_path is None:
+            return
+        now = time.monotonic()
+        if now - self._checked_at < self.reload_interval:
+            return
+        self._checked_at = now
+        # This runs on the verify path, so a manifest that is missing or
+        # half written mid-rotation must not fail requests: keep the keys
+        # we have and try again after the next interval.
+        try:
+            if os.path.getmtime(self.manifest_path) != self._manifest_mtime:
+                self.load_manifest()
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning("Keeping current keys, could not reload %s: %s", self.manifest_path, e)
+
+
+def write_manifest(path: str, entries: List[dict]):
+    # Writes to a temporary file in the same directory and renames it over
+    # the manifest, so running services see either the old or the new one.
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'keys': entries}, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
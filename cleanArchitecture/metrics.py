@@ -0,0 +1,297 @@
+import functools
+import inspect
+import threading
+import time
+import weakref
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Latency buckets in seconds, from 10us to 10s.
+DEFAULT_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _Shard:
+    # One thread's private slice of every metric: {metric: [values]}. Only
+    # its own thread writes to it, so recording needs no lock. When the
+    # thread ends its thread-local goes away and the shard folds itself into
+    # the registry's retired totals.
+    __slots__ = ('registry', 'values', 'merged', '__weakref__')
+
+    def __init__(self, registry: 'MetricsRegistry'):
+        self.registry = registry
+        self.values = {}
+        self.merged = False
+
+    def __del__(self):
+        try:
+            self.registry._retire(self)
+        except Exception:
+            pass  # interpreter shutdown
+
+
+class _Metric:
+    __slots__ = ('registry', 'name', 'labels', 'size', '_local')
+    kind = ''
+
+    def __init__(self, registry: 'MetricsRegistry', name: str, labels: Tuple[Tuple[str, str], ...], size: int):
+        self.registry = registry
+        self._local = registry._local
+        self.name = name
+        self.labels = labels
+        self.size = size
+
+    def _values(self) -> list:
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self.registry._new_shard()
+        values = shard.values.get(self)
+        if values is None:
+            values = shard.values[self] = [0] * self.size
+        return values
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1):
+        try:
+            values = self._local.shard.values[self]
+        except (AttributeError, KeyError):
+            values = self._values()
+        values[0] += amount
+
+
+class Histogram(_Metric):
+    # values: one count per bucket, one for +Inf, then the sum.
+    __slots__ = ('buckets',)
+    kind = 'histogram'
+
+    def __init__(self, registry, name, labels, buckets):
+        super().__init__(registry, name, labels, len(buckets) + 2)
+        self.buckets = buckets
+
+    def observe(self, value: float):
+        try:
+            values = self._local.shard.values[self]
+        except (AttributeError, KeyError):
+            values = self._values()
+        values[bisect_left(self.buckets, value)] += 1
+        values[-1] += value
+
+
+class MetricsRegistry:
+    # Counters and histograms sharded per thread. Recording touches only the
+    # calling thread's shard; the registry lock is taken when a metric is
+    # first created, when a thread exits, and on scrape, never on a hot
+    # path. Collectors add gauges computed at scrape time.
+    def __init__(self, namespace: str = 'url_shortener', buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.namespace = namespace
+        self.buckets = buckets
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = weakref.WeakSet()
+        self._retired: Dict[_Metric, list] = {}
+        self._metrics: Dict[tuple, _Metric] = {}
+        self._help: Dict[str, Tuple[str, str]] = {}
+        self._collectors: List[Callable[[], list]] = []
+
+    def _new_shard(self) -> _Shard:
+        shard = _Shard(self)
+        self._local.shard = shard
+        self._shards.add(shard)
+        return shard
+
+    def _retire(self, shard: _Shard):
+        with self._lock:
+            for metric, values in shard.values.items():
+                self._add(self._retired, metric, values)
+            shard.merged = True
+
+    @staticmethod
+    def _add(totals: dict, metric: _Metric, values: list):
+        current = totals.get(metric)
+        if current is None:
+            totals[metric] = list(values)
+        else:
+            for i, value in enumerate(values):
+                current[i] += value
+
+    def _get(self, cls, name: str, help_text: str, labels: dict, *args) -> _Metric:
+        full_name = f'{self.namespace}_{name}'
+        key = (full_name, tuple(sorted(labels.items())))
+        metric = self._metrics.get(key)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(key)
+                if metric is None:
+                    metric = cls(self, full_name, key[1], *args)
+                    self._metrics[key] = metric
+                    self._help.setdefault(full_name, (cls.kind, help_text))
+        return metric
+
+    def counter(self, name: str, help_text: str = '', **labels) -> Counter:
+        return self._get(Counter, name, help_text, labels, 1)
+
+    def histogram(self, name: str, help_text: str = '', buckets: Optional[Tuple[float, ...]] = None,
+                  **labels) -> Histogram:
+        return self._get(Histogram, name, help_text, labels, buckets or self.buckets)
+
+    def add_collector(self, collector: Callable[[], list]):
+        # collector() returns [(name, help, labels, value)] gauges.
+        self._collectors.append(collector)
+
+    def snapshot(self) -> Dict[_Metric, list]:
+        while True:
+            try:
+                shards = list(self._shards)
+                break
+            except RuntimeError:
+                continue  # a thread registered mid-iteration
+        with self._lock:
+            totals = {metric: list(values) for metric, values in self._retired.items()}
+            for shard in shards:
+                if shard.merged:
+                    continue
+                while True:
+                    try:
+                        items = list(shard.values.items())
+                        break
+                    except RuntimeError:
+                        continue
+                for metric, values in items:
+                    self._add(totals, metric, values)
+        return totals
+
+    def render(self) -> str:
+        # Prometheus text exposition format, version 0.0.4.
+        totals = self.snapshot()
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+        by_name: Dict[str, List[_Metric]] = {}
+        for metric in metrics:
+            by_name.setdefault(metric.name, []).append(metric)
+        for name in sorted(by_name):
+            kind, help_text = self._help[name]
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for metric in by_name[name]:
+                values = totals.get(metric, [0] * metric.size)
+                if kind == 'counter':
+                    lines.append(f'{name}{_labels(metric.labels)} {_number(values[0])}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (float('inf'),), values):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'{name}_bucket{_labels(metric.labels + (("le", le),))} {cumulative}')
+                lines.append(f'{name}_sum{_labels(metric.labels)} {_number(values[-1])}')
+                lines.append(f'{name}_count{_labels(metric.labels)} {cumulative}')
+
+        gauges: Dict[str, list] = {}
+        for collector in self._collectors:
+            for name, help_text, labels, value in collector():
+                gauges.setdefault(f'{self.namespace}_{name}', []).append((help_text, labels, value))
+        for name in sorted(gauges):
+            lines.append(f'# HELP {name} {gauges[name][0][0]}')
+            lines.append(f'# TYPE {name} gauge')
+            for _, labels, value in gauges[name]:
+                lines.append(f'{name}{_labels(tuple(sorted(labels.items())))} {_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels: tuple) -> str:
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+
+def _number(value) -> str:
+    if isinstance(value, float) and value != int(value):
+        return repr(value)
+    return str(int(value))
+
+
+def instrument(obj, registry: MetricsRegistry, component: str, methods: Optional[List[str]] = None):
+    # Replaces obj's public methods (or the given ones) with timed versions
+    # on the instance, so every caller holding obj is measured. Generator
+    # methods are left alone: their time is spent in the consumer.
+    if methods is None:
+        methods = [name for name in dir(obj) if not name.startswith('_')]
+    for name in methods:
+        method = getattr(obj, name, None)
+        if not inspect.ismethod(method) or inspect.isgeneratorfunction(method):
+            continue
+        setattr(obj, name, _timed(method, registry, component, name))
+    return obj
+
+
+def _timed(method, registry: MetricsRegistry, component: str, name: str):
+    histogram = registry.histogram('call_duration_seconds', 'Time spent in service, repository and JWT calls',
+                                   component=component, method=name)
+    errors = registry.counter('call_errors_total', 'Calls that raised', component=component, method=name)
+    perf_counter = time.perf_counter
+
+    @functools.wraps(method)
+    def timed(*args, **kwargs):
+        started = perf_counter()
+        try:
+            return method(*args, **kwargs)
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            histogram.observe(perf_counter() - started)
+    return timed
+
+
+def instrument_flask(app, registry: MetricsRegistry):
+    # Times every view function (controller dispatch) and template render,
+    # and counts responses by route and status. Call after all routes are
+    # registered.
+    from flask import g, request, before_render_template, template_rendered
+
+    perf_counter = time.perf_counter
+    for endpoint, view in list(app.view_functions.items()):
+        if endpoint == 'static':
+            continue
+        histogram = registry.histogram('route_duration_seconds', 'Time spent in the view for a route',
+                                       route=endpoint)
+
+        def timed_view(*args, _view=view, _histogram=histogram, **kwargs):
+            started = perf_counter()
+            try:
+                return _view(*args, **kwargs)
+            finally:
+                _histogram.observe(perf_counter() - started)
+        app.view_functions[endpoint] = functools.wraps(view)(timed_view)
+
+    @app.after_request
+    def count_response(response):
+        registry.counter('requests_total', 'Responses by route and status',
+                         route=request.endpoint or 'none', status=str(response.status_code)).inc()
+        return response
+
+    def render_started(sender, template, context, **extra):
+        g._metrics_render_started = perf_counter()
+
+    def render_finished(sender, template, context, **extra):
+        started = g.pop('_metrics_render_started', None)
+        if started is not None:
+            registry.histogram('template_render_seconds', 'Time spent rendering templates',
+                               template=template.name or 'string').observe(perf_counter() - started)
+
+    before_render_template.connect(render_started, app, weak=False)
+    template_rendered.connect(render_finished, app, weak=False)
+
+
+def stats_collector(prefix: str, stats: Callable[[], Optional[dict]], help_text: str, **labels):
+    # Turns a component's stats() dict into gauges, e.g. cache hits.
+    def collect():
+        values = stats() or {}
+        return [(f'{prefix}_{key}', help_text, labels, float(value))
+                for key, value in values.items() if isinstance(value, (int, float))]
+    return collect
@@ -1,18 +1,71 @@
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
 from datetime import datetime
-from typing import List, Optional
+from typing import Dict, Iterator, List, Optional, Tuple, Union
 import string, random
 
-@dataclass
+class ShortUrlConflictError(ValueError):
+    pass
+
+
+class ChangeLogGapError(LookupError):
+    # The requested changes have been pruned; the reader has to reload.
+    pass
+
+
 class Url:
-    id: Optional[int]
-    short_url: str
-    long_url: str
+    # Slotted, and created_at is kept as SQLite's text until it is first
+    # read, since listings and exports mostly never look at it.
+    __slots__ = ('id', 'short_url', 'long_url', '_created_at')
+
+    def __init__(self, id: Optional[int], short_url: str, long_url: str,
+                 created_at: Union[datetime, str, None] = None):
+        self.id = id
+        self.short_url = short_url
+        self.long_url = long_url
+        self._created_at = created_at
+
+    @property
+    def created_at(self) -> Optional[datetime]:
+        value = self._created_at
+        if isinstance(value, str):
+            value = self._created_at = datetime.fromisoformat(value)
+        return value
+
+    @created_at.setter
+    def created_at(self, value: Union[datetime, str, None]):
+        self._created_at = value
+
+    def __eq__(self, other):
+        if not isinstance(other, Url):
+            return NotImplemented
+        return (self.id, self.short_url, self.long_url, self.created_at) == \
+            (other.id, other.short_url, other.long_url, other.created_at)
+
+    def __repr__(self):
+        return (f"Url(id={self.id!r}, short_url={self.short_url!r}, long_url={self.long_url!r}, "
+                f"created_at={self.created_at!r})")
+
+
+@dataclass(slots=True)
+class UrlPage:
+    items: List[Url]
+    next_cursor: Optional[str] = None
+
+
+@dataclass(slots=True)
+class UrlChange:
+    # One row of the url change log. old_short_url is None for an insert,
+    # short_url is None for a delete.
+    seq: int
+    url_id: int
+    old_short_url: Optional[str]
+    short_url: Optional[str]
+    long_url: Optional[str]
     created_at: Optional[datetime] = None
 
 
-@dataclass
+@dataclass(slots=True)
 class User:
     username: str
     password: str
@@ -23,6 +76,10 @@ class UrlRepository(ABC):
     def save(self, url: Url) -> Url:
         pass
 
+    @abstractmethod
+    def save_many(self, urls: List[Url]) -> List[Url]:
+        pass
+
     @abstractmethod
     def find_by_short_url(self, short_url: str) -> Optional[Url]:
         pass
@@ -35,6 +92,14 @@ class UrlRepository(ABC):
     def get_all(self) -> List[Url]:
         pass
 
+    @abstractmethod
+    def get_page(self, limit: int, cursor: Optional[str] = None) -> UrlPage:
+        pass
+
+    @abstractmethod
+    def iter_all(self, chunk_size: int = 1000) -> Iterator[Url]:
+        pass
+
     @abstractmethod
     def update(self, url_id: int, short_url: str, long_url:str) -> Optional[Url]:
         pass
@@ -47,6 +112,59 @@ class UrlRepository(ABC):
     def exists_by_short_url(self, short_url: str) -> bool:
         pass
 
+    @abstractmethod
+    def count(self) -> int:
+        pass
+
+    @abstractmethod
+    def reserve_code_block(self, name: str, size: int) -> int:
+        pass
+
+    @abstractmethod
+    def current_change_seq(self) -> int:
+        pass
+
+    @abstractmethod
+    def get_changes(self, since_seq: int, limit: int = 1000) -> List[UrlChange]:
+        pass
+
+    @abstractmethod
+    def record_clicks(self, events: List[Tuple[str, float]]):
+        pass
+
+    @abstractmethod
+    def prune_click_rollups(self, cutoffs: Dict[str, int]) -> int:
+        pass
+
+    @abstractmethod
+    def prune_clicks(self, before: float) -> int:
+        pass
+
+    @abstractmethod
+    def get_click_counts(self, url_ids: List[int]) -> Dict[int, int]:
+        pass
+
+    @abstractmethod
+    def get_top_urls(self, limit: int, granularity: Optional[str] = None,
+                     since: Optional[int] = None) -> List[Tuple[Url, int]]:
+        pass
+
+    @abstractmethod
+    def get_click_series(self, url_id: int, granularity: str, since: int,
+                         until: Optional[int] = None) -> List[Tuple[int, int]]:
+        pass
+
+    def authoritative(self) -> 'UrlRepository':
+        # Where reads made for a write (conflict checks, finding the cache
+        # keys to invalidate) go. Wrappers that may answer from a stale copy
+        # return the repository they write to.
+        return self
+
+    def change_version(self) -> int:
+        # Moves on every committed change, for ETags. Unlike
+        # current_change_seq it need not be a position get_changes accepts.
+        return self.current_change_seq()
+
 
 class AuthRepository(ABC):
     @abstractmethod
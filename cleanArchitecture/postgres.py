@@ -0,0 +1,620 @@
+import itertools
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+import psycopg2
+import psycopg2.errors
+import psycopg2.extras
+import psycopg2.extensions
+from cleanArchitecture.models import UrlRepository, Url, UrlPage, UrlChange, ShortUrlConflictError, \
+    ChangeLogGapError
+from cleanArchitecture.database import ConnectionPool
+from cleanArchitecture.repositories import encode_cursor, decode_cursor
+from cleanArchitecture.clicks import ROLLUP_GRANULARITIES, CLICK_PRUNE_BATCH, aggregate_clicks, aggregate_rollups
+
+# Serializes schema creation between nodes starting at the same time, and
+# url_changes_order() runs; writers never take either lock (see _init_db).
+_SCHEMA_LOCK = 0x75726c73
+_CHANGE_ORDER_LOCK = 0x75726c63
+
+_URL_COLUMNS = 'id, short_url, long_url, created_at'
+_cursor_names = itertools.count()
+
+
+class PostgresConnectionPool(ConnectionPool):
+    # database.ConnectionPool with psycopg2 connections: the same bounded,
+    # blocking borrow with thread affinity and periodic health checks.
+    # (psycopg2.pool closes every connection above minconn on return, so it
+    # would reconnect on nearly every call.)
+    def __init__(self, dsn: str, size: int = 5, timeout: float = 5.0, health_check_interval: float = 30.0):
+        super().__init__(dsn, size=size, timeout=timeout, health_check_interval=health_check_interval)
+        self.dsn = dsn
+
+    def _connect(self):
+        return psycopg2.connect(self.dsn)
+
+    def _is_healthy(self, conn) -> bool:
+        if conn.closed:
+            return False
+        now = time.monotonic()
+        if now - self._checked_at.get(id(conn), 0.0) < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            conn.rollback()
+        except psycopg2.Error:
+            return False
+        self._checked_at[id(conn)] = now
+        return True
+
+    def _discard(self, conn):
+        with self._cond:
+            self._all.discard(conn)
+            self._checked_at.pop(id(conn), None)
+            self._cond.notify()
+        conn.close()
+
+    def release(self, conn):
+        # Read-only calls leave their transaction open; ending it here keeps
+        # idle connections out of "idle in transaction".
+        if conn.closed:
+            self._discard(conn)
+            return
+        if conn.status != psycopg2.extensions.STATUS_READY:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                self._discard(conn)
+                return
+        with self._cond:
+            if self._closed or conn not in self._all:
+                self._all.discard(conn)
+                conn.close()
+                return
+            self._idle.append(conn)
+            self._cond.notify()
+
+    def verify(self):
+        return {}
+
+
+class PostgresUrlRepository(UrlRepository):
+    # Same schema and semantics as SQLiteUrlRepository, for deployments where
+    # several nodes create links concurrently. created_at is a UTC timestamp
+    # without time zone, as SQLite's CURRENT_TIMESTAMP is. With
+    # init_schema=False nothing is created or written at startup, for hot
+    # standbys, which reject DDL and advisory locks.
+    def __init__(self, dsn: str, pool_size: int = 5, pool_timeout: float = 5.0,
+                 health_check_interval: float = 30.0, batch_size: int = 1000,
+                 change_log_retention: Optional[int] = None, init_schema: bool = True):
+        self.dsn = dsn
+        self.batch_size = batch_size
+        self.pool = PostgresConnectionPool(dsn, size=pool_size, timeout=pool_timeout,
+                                           health_check_interval=health_check_interval)
+        if init_schema:
+            self._init_db()
+        if init_schema and change_log_retention is not None:
+            self.set_change_log_retention(change_log_retention)
+
+    def _init_db(self):
+        with self._get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute('SELECT pg_advisory_xact_lock(%s)', (_SCHEMA_LOCK,))
+            cur.execute('''
+                    CREATE TABLE IF NOT EXISTS urls (
+                        id BIGSERIAL PRIMARY KEY,
+                        short_url VARCHAR(64) UNIQUE NOT NULL,
+                        long_url TEXT NOT NULL,
+                        created_at TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc')
+                    )
+                ''')
+            cur.execute('CREATE INDEX IF NOT EXISTS idx_urls_created_at_id ON urls (created_at DESC, id DESC)')
+            cur.execute('''
+                    SELECT to_regclass('url_changes') IS NOT NULL AND NOT EXISTS (
+                        SELECT 1 FROM information_schema.columns
+                        WHERE table_schema = current_schema() AND table_name = 'url_changes'
+                        AND column_name = 'pos')
+                ''')
+            unordered_log = cur.fetchone()[0]
+            # seq is handed out at insert, before commit, so a reader could
+            # see seq 11 committed while seq 10 is still in flight. Readers
+            # therefore page by pos instead, which url_changes_order() assigns
+            # to committed rows in the order it finds them committed.
+            cur.execute('''
+                    CREATE TABLE IF NOT EXISTS url_changes (
+                        seq BIGSERIAL PRIMARY KEY,
+                        url_id BIGINT NOT NULL,
+                        old_short_url TEXT,
+                        short_url TEXT,
+                        long_url TEXT,
+                        created_at TIMESTAMP,
+                        pos BIGINT
+                    )
+                ''')
+            if unordered_log:
+                # Written under the old global change log lock, so seq order
+                # is already commit order.
+                cur.execute('ALTER TABLE url_changes ADD COLUMN pos BIGINT')
+                cur.execute('UPDATE url_changes SET pos = seq')
+            cur.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_url_changes_pos ON url_changes (pos)')
+            cur.execute('CREATE INDEX IF NOT EXISTS idx_url_changes_unordered ON url_changes (seq) WHERE pos IS NULL')
+            cur.execute('''
+                    CREATE OR REPLACE FUNCTION urls_log_change() RETURNS trigger AS $$
+                    BEGIN
+                        IF TG_OP = 'INSERT' THEN
+                            INSERT INTO url_changes (url_id, short_url, long_url, created_at)
+                            VALUES (NEW.id, NEW.short_url, NEW.long_url, NEW.created_at);
+                        ELSIF TG_OP = 'UPDATE' THEN
+                            INSERT INTO url_changes (url_id, old_short_url, short_url, long_url, created_at)
+                            VALUES (NEW.id, OLD.short_url, NEW.short_url, NEW.long_url, NEW.created_at);
+                        ELSE
+                            INSERT INTO url_changes (url_id, old_short_url) VALUES (OLD.id, OLD.short_url);
+                        END IF;
+                        RETURN NULL;
+                    END;
+                    $$ LANGUAGE plpgsql
+                ''')
+            cur.execute('DROP TRIGGER IF EXISTS urls_log ON urls')
+            cur.execute('''
+                    CREATE TRIGGER urls_log AFTER INSERT OR UPDATE OR DELETE ON urls
+                    FOR EACH ROW EXECUTE FUNCTION urls_log_change()
+                ''')
+            cur.execute('''
+                    CREATE TABLE IF NOT EXISTS click_counts (
+                        url_id BIGINT PRIMARY KEY,
+                        clicks BIGINT NOT NULL,
+                        last_clicked_at DOUBLE PRECISION
+                    )
+                ''')
+            cur.execute('''
+                    CREATE TABLE IF NOT EXISTS clicks (
+                        id BIGSERIAL PRIMARY KEY,
+                        url_id BIGINT NOT NULL,
+                        clicked_at DOUBLE PRECISION NOT NULL
+                    )
+                ''')
+            cur.execute('CREATE INDEX IF NOT EXISTS idx_clicks_url_id_clicked_at ON clicks (url_id, clicked_at)')
+            cur.execute('CREATE INDEX IF NOT EXISTS idx_clicks_clicked_at ON clicks (clicked_at)')
+            cur.execute('CREATE INDEX IF NOT EXISTS idx_click_counts_clicks ON click_counts (clicks DESC)')
+            cur.execute("SELECT to_regclass('click_rollups') IS NOT NULL")
+            rollups_exist = cur.fetchone()[0]
+            cur.execute('''
+                    CREATE TABLE IF NOT EXISTS click_rollups (
+                        url_id BIGINT NOT NULL,
+                        granularity TEXT NOT NULL,
+                        bucket BIGINT NOT NULL,
+                        clicks BIGINT NOT NULL,
+                        PRIMARY KEY (url_id, granularity, bucket)
+                    )
+                ''')
+            cur.execute('''
+                    CREATE INDEX IF NOT EXISTS idx_click_rollups_window
+                    ON click_rollups (granularity, bucket, url_id) INCLUDE (clicks)
+                ''')
+            if not rollups_exist:
+                for granularity, width in ROLLUP_GRANULARITIES.items():
+                    cur.execute('''
+                            INSERT INTO click_rollups (url_id, granularity, bucket, clicks)
+                            SELECT url_id, %s, FLOOR(clicked_at / %s)::BIGINT * %s, COUNT(*)
+                            FROM clicks GROUP BY 1, 2, 3
+                        ''', (granularity, width, width))
+            cur.execute('''
+                    CREATE TABLE IF NOT EXISTS code_sequences (
+                        name TEXT PRIMARY KEY,
+                        next_value BIGINT NOT NULL
+                    )
+                ''')
+            cur.execute('''
+                    CREATE TABLE IF NOT EXISTS storage_meta (
+                        name TEXT PRIMARY KEY,
+                        value BIGINT NOT NULL
+                    )
+                ''')
+            cur.execute('''
+                    INSERT INTO storage_meta (name, value)
+                    SELECT name, next_value FROM code_sequences WHERE name = 'url_changes_pruned'
+                    ON CONFLICT (name) DO NOTHING
+                ''')
+            cur.execute("DELETE FROM code_sequences WHERE name = 'url_changes_pruned'")
+            cur.execute('''
+                    INSERT INTO storage_meta (name, value)
+                    SELECT 'url_changes_pos', GREATEST(
+                        (SELECT MAX(pos) FROM url_changes),
+                        (SELECT value FROM storage_meta WHERE name = 'url_changes_pruned'),
+                        0)
+                    ON CONFLICT (name) DO NOTHING
+                ''')
+            # Numbers the committed, unordered changes after the last pos.
+            # Each statement here takes a fresh snapshot after the lock, so
+            # every row committed before an earlier run returned is already
+            # numbered and later commits can only get higher positions. When
+            # another run holds the lock this one returns straight away. Same
+            # retention rule as the SQLite url_changes_retention trigger, on
+            # pos instead of seq.
+            cur.execute('''
+                    CREATE OR REPLACE FUNCTION url_changes_order() RETURNS void AS $$
+                    DECLARE
+                        last_pos BIGINT;
+                        ordered BIGINT;
+                        keep BIGINT;
+                    BEGIN
+                        IF NOT pg_try_advisory_xact_lock(%s) THEN
+                            RETURN;
+                        END IF;
+                        SELECT value INTO last_pos FROM storage_meta WHERE name = 'url_changes_pos';
+                        UPDATE url_changes c SET pos = last_pos + p.n
+                        FROM (SELECT seq, row_number() OVER (ORDER BY seq) AS n
+                              FROM url_changes WHERE pos IS NULL) p
+                        WHERE c.seq = p.seq;
+                        GET DIAGNOSTICS ordered = ROW_COUNT;
+                        IF ordered = 0 THEN
+                            RETURN;
+                        END IF;
+                        UPDATE storage_meta SET value = last_pos + ordered WHERE name = 'url_changes_pos';
+                        SELECT value INTO keep FROM storage_meta WHERE name = 'url_changes_retention';
+                        IF keep > 0 AND last_pos + ordered > keep
+                                AND (last_pos + ordered) / 1000 > last_pos / 1000 THEN
+                            INSERT INTO storage_meta (name, value) VALUES ('url_changes_pruned', last_pos + ordered - keep)
+                            ON CONFLICT (name) DO UPDATE SET value = GREATEST(storage_meta.value, EXCLUDED.value);
+                            DELETE FROM url_changes WHERE pos <= last_pos + ordered - keep;
+                        END IF;
+                    END;
+                    $$ LANGUAGE plpgsql
+                ''', (_CHANGE_ORDER_LOCK,))
+            # Readers order the log whenever they read it; this keeps it
+            # ordered and trimmed on nodes that never do.
+            cur.execute('''
+                    CREATE OR REPLACE FUNCTION url_changes_retain() RETURNS trigger AS $$
+                    BEGIN
+                        PERFORM url_changes_order();
+                        RETURN NULL;
+                    END;
+                    $$ LANGUAGE plpgsql
+                ''')
+            cur.execute('DROP TRIGGER IF EXISTS url_changes_retention ON url_changes')
+            cur.execute('''
+                    CREATE TRIGGER url_changes_retention AFTER INSERT ON url_changes
+                    FOR EACH ROW WHEN (NEW.seq % 1000 = 0) EXECUTE FUNCTION url_changes_retain()
+                ''')
+            conn.commit()
+
+    @contextmanager
+    def _get_connection(self):
+        with self.pool.connection() as conn:
+            try:
+                yield conn
+            except psycopg2.Error as e:
+                conn.rollback()
+                raise RuntimeError(f"Database error: {e}")
+
+    def verify_storage(self):
+        return self.pool.verify()
+
+    def close(self):
+        self.pool.close()
+
+    def save(self, url: Url) -> Url:
+        with self._get_connection() as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute(
+                        'INSERT INTO urls (short_url, long_url) VALUES (%s, %s) RETURNING id, created_at',
+                        (url.short_url, url.long_url)
+                    )
+            except psycopg2.errors.UniqueViolation:
+                conn.rollback()
+                raise ShortUrlConflictError("Short url already exists")
+            url.id, url.created_at = cur.fetchone()
+            conn.commit()
+            return url
+
+    def save_many(self, urls: List[Url]) -> List[Url]:
+        # Multi-row INSERTs of batch_size rows in one transaction. Taken
+        # codes are skipped by ON CONFLICT and come back with id None, as in
+        # SQLiteUrlRepository.
+        if not urls:
+            return []
+        with self._get_connection() as conn:
+            cur = conn.cursor()
+            rows = psycopg2.extras.execute_values(
+                    cur,
+                    '''INSERT INTO urls (short_url, long_url) VALUES %s
+                       ON CONFLICT (short_url) DO NOTHING RETURNING id, short_url, created_at''',
+                    [(url.short_url, url.long_url) for url in urls],
+                    page_size=self.batch_size, fetch=True
+                )
+            conn.commit()
+
+        inserted = {short_url: (url_id, created_at) for url_id, short_url, created_at in rows}
+        saved = []
+        for url in urls:
+            row = inserted.pop(url.short_url, None)
+            if row is not None:
+                url.id, url.created_at = row
+                saved.append(url)
+        return saved
+
+    def find_by_short_url(self, short_url: str) -> Optional[Url]:
+        with self._get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute(f'SELECT {_URL_COLUMNS} FROM urls WHERE short_url = %s', (short_url,))
+            row = cur.fetchone()
+            return Url(*row) if row else None
+
+    def find_by_id(self, url_id: int) -> Optional[Url]:
+        with self._get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute(f'SELECT {_URL_COLUMNS} FROM urls WHERE id = %s', (url_id,))
+            row = cur.fetchone()
+            return Url(*row) if row else None
+
+    def get_all(self) -> List[Url]:
+        with self._get_connection() as conn:
+            urls = [Url(*row) for row in self._server_cursor(conn, f'SELECT {_URL_COLUMNS} FROM urls', 10000)]
+            return urls
+
+    def get_page(self, limit: int, cursor: Optional[str] = None) -> UrlPage:
+        with self._get_connection() as conn:
+            cur = conn.cursor()
+            if cursor:
+                created_at, url_id = decode_cursor(cursor)
+                cur.execute(f'''
+                        SELECT {_URL_COLUMNS} FROM urls
+                        WHERE (created_at, id) < (%s::timestamp, %s)
+                        ORDER BY created_at DESC, id DESC LIMIT %s
+                    ''', (created_at, url_id, limit + 1))
+            else:
+                cur.execute(f'''
+                        SELECT {_URL_COLUMNS} FROM urls
+                        ORDER BY created_at DESC, id DESC LIMIT %s
+                    ''', (limit + 1,))
+            rows = cur.fetchall()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1][3].isoformat(' '), rows[-1][0])
+        return UrlPage(items=[Url(*row) for row in rows], next_cursor=next_cursor)
+
+    def iter_all(self, chunk_size: int = 1000) -> Iterator[Url]:
+        # One server-side cursor over a single snapshot, fetched chunk_size
+        # rows per round trip. Unlike SQLite's keyset walk this keeps a
+        # connection until the consumer is done, or drops the generator.
+        with self._get_connection() as conn:
+            for row in self._server_cursor(conn, f'SELECT {_URL_COLUMNS} FROM urls ORDER BY id', chunk_size):
+                yield Url(*row)
+
+    def update(self, url_id: int, short_url: str, long_url: str) -> Optional[Url]:
+        with self._get_connection() as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute(
+                        f'UPDATE urls SET short_url = %s, long_url = %s WHERE id = %s RETURNING {_URL_COLUMNS}',
+                        (short_url, long_url, url_id)
+                    )
+            except psycopg2.errors.UniqueViolation:
+                conn.rollback()
+                raise ShortUrlConflictError("Short url already exists")
+            row = cur.fetchone()
+            conn.commit()
+            return Url(*row) if row else None
+
+    def delete(self, url_id: int) -> bool:
+        with self._get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute('DELETE FROM urls WHERE id = %s', (url_id,))
+            deleted = cur.rowcount > 0
+            if deleted:
+                cur.execute('DELETE FROM click_counts WHERE url_id = %s', (url_id,))
+                cur.execute('DELETE FROM clicks WHERE url_id = %s', (url_id,))
+                cur.execute('DELETE FROM click_rollups WHERE url_id = %s', (url_id,))
+            conn.commit()
+            return deleted
+
+    def exists_by_short_url(self, short_url: str) -> bool:
+        with self._get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute('SELECT 1 FROM urls WHERE short_url = %s', (short_url,))
+            exists = cur.fetchone() is not None
+            return exists
+
+    def count(self) -> int:
+        with self._get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute('SELECT COUNT(*) FROM urls')
+            total = cur.fetchone()[0]
+            return total
+
+    def reserve_code_block(self, name: str, size: int) -> int:
+        with self._get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute('''
+                    INSERT INTO code_sequences (name, next_value) VALUES (%s, %s)
+                    ON CONFLICT (name) DO UPDATE SET next_value = code_sequences.next_value + EXCLUDED.next_value
+                    RETURNING next_value
+                ''', (name, size))
+            end = cur.fetchone()[0]
+            conn.commit()
+            return end - size
+
+    def _order_changes(self, conn):
+        cur = conn.cursor()
+        cur.execute('SELECT url_changes_order()')
+        conn.commit()
+        return cur
+
+    def current_change_seq(self) -> int:
+        # The highest pos handed out; no lower pos can show up after it.
+        with self._get_connection() as conn:
+            cur = self._order_changes(conn)
+            cur.execute("SELECT value FROM storage_meta WHERE name = 'url_changes_pos'")
+            seq = cur.fetchone()[0]
+            return seq
+
+    def change_version(self) -> int:
+        # Committed changes so far: ordering moves rows from the unordered
+        # count into pos, so the sum only grows when a change commits. Read
+        # only, so listing requests never run url_changes_order().
+        with self._get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute('''
+                    SELECT (SELECT value FROM storage_meta WHERE name = 'url_changes_pos')
+                         + (SELECT COUNT(*) FROM url_changes WHERE pos IS NULL)
+                ''')
+            return cur.fetchone()[0]
+
+    def get_changes(self, since_seq: int, limit: int = 1000) -> List[UrlChange]:
+        with self._get_connection() as conn:
+            cur = self._order_changes(conn)
+            cur.execute("SELECT value FROM storage_meta WHERE name = 'url_changes_pruned'")
+            pruned = cur.fetchone()
+            if pruned is not None and since_seq < pruned[0]:
+                raise ChangeLogGapError(f"Changes up to {pruned[0]} have been pruned")
+            cur.execute('''
+                    SELECT pos, url_id, old_short_url, short_url, long_url, created_at FROM url_changes
+                    WHERE pos > %s ORDER BY pos LIMIT %s
+                ''', (since_seq, limit))
+            rows = cur.fetchall()
+        return [UrlChange(*row) for row in rows]
+
+    def prune_changes(self, up_to_seq: int) -> int:
+        with self._get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute('DELETE FROM url_changes WHERE pos <= %s', (up_to_seq,))
+            deleted = cur.rowcount
+            cur.execute('''
+                    INSERT INTO storage_meta (name, value) VALUES ('url_changes_pruned', %s)
+                    ON CONFLICT (name) DO UPDATE SET value = GREATEST(storage_meta.value, EXCLUDED.value)
+                ''', (up_to_seq,))
+            conn.commit()
+            return deleted
+
+    def set_change_log_retention(self, keep: int):
+        with self._get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute('''
+                    INSERT INTO storage_meta (name, value) VALUES ('url_changes_retention', %s)
+                    ON CONFLICT (name) DO UPDATE SET value = EXCLUDED.value
+                ''', (keep,))
+            conn.commit()
+
+    def record_clicks(self, events: List[Tuple[str, float]]):
+        # Same transaction shape as SQLiteUrlRepository.record_clicks. Upsert
+        # rows are sorted by key so two nodes flushing overlapping links
+        # lock them in the same order instead of deadlocking.
+        if not events:
+            return
+        counts = aggregate_clicks(events)
+        rollups = aggregate_rollups(events)
+        with self._get_connection() as conn:
+            cur = conn.cursor()
+            psycopg2.extras.execute_values(cur, '''
+                    INSERT INTO clicks (url_id, clicked_at)
+                    SELECT urls.id, v.clicked_at FROM (VALUES %s) AS v (short_url, clicked_at)
+                    JOIN urls ON urls.short_url = v.short_url
+                ''', [(short_url, float(clicked_at)) for short_url, clicked_at in events],
+                page_size=self.batch_size)
+            psycopg2.extras.execute_values(cur, '''
+                    INSERT INTO click_counts (url_id, clicks, last_clicked_at)
+                    SELECT urls.id, v.clicks, v.last_clicked_at FROM (VALUES %s) AS v (short_url, clicks, last_clicked_at)
+                    JOIN urls ON urls.short_url = v.short_url
+                    ORDER BY urls.id
+                    ON CONFLICT (url_id) DO UPDATE SET
+                        clicks = click_counts.clicks + EXCLUDED.clicks,
+                        last_clicked_at = GREATEST(click_counts.last_clicked_at, EXCLUDED.last_clicked_at)
+                ''', [(short_url, count, float(last)) for short_url, (count, last) in sorted(counts.items())],
+                page_size=self.batch_size)
+            psycopg2.extras.execute_values(cur, '''
+                    INSERT INTO click_rollups (url_id, granularity, bucket, clicks)
+                    SELECT urls.id, v.granularity, v.bucket, v.clicks
+                    FROM (VALUES %s) AS v (short_url, granularity, bucket, clicks)
+                    JOIN urls ON urls.short_url = v.short_url
+                    ORDER BY urls.id, v.granularity, v.bucket
+                    ON CONFLICT (url_id, granularity, bucket) DO UPDATE
+                    SET clicks = click_rollups.clicks + EXCLUDED.clicks
+                ''', [(short_url, granularity, bucket, count)
+                      for (short_url, granularity, bucket), count in sorted(rollups.items())],
+                page_size=self.batch_size)
+            conn.commit()
+
+    def prune_click_rollups(self, cutoffs: Dict[str, int]) -> int:
+        with self._get_connection() as conn:
+            cur = conn.cursor()
+            deleted = 0
+            for granularity, cutoff in cutoffs.items():
+                cur.execute('DELETE FROM click_rollups WHERE granularity = %s AND bucket < %s',
+                            (granularity, cutoff))
+                deleted += cur.rowcount
+            conn.commit()
+            return deleted
+
+    def prune_clicks(self, before: float) -> int:
+        deleted = 0
+        while True:
+            with self._get_connection() as conn:
+                cur = conn.cursor()
+                cur.execute('''
+                        DELETE FROM clicks WHERE id IN (
+                            SELECT id FROM clicks WHERE clicked_at < %s LIMIT %s)
+                    ''', (before, CLICK_PRUNE_BATCH))
+                batch = cur.rowcount
+                conn.commit()
+            deleted += batch
+            if batch < CLICK_PRUNE_BATCH:
+                return deleted
+
+    def get_click_counts(self, url_ids: List[int]) -> Dict[int, int]:
+        if not url_ids:
+            return {}
+        with self._get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute('SELECT url_id, clicks FROM click_counts WHERE url_id = ANY(%s)', (list(url_ids),))
+            rows = cur.fetchall()
+        counts = {url_id: 0 for url_id in url_ids}
+        counts.update(rows)
+        return counts
+
+    def get_top_urls(self, limit: int, granularity: Optional[str] = None,
+                     since: Optional[int] = None) -> List[Tuple[Url, int]]:
+        with self._get_connection() as conn:
+            cur = conn.cursor()
+            if granularity is None:
+                cur.execute('''
+                        SELECT urls.id, short_url, long_url, created_at, clicks FROM click_counts
+                        JOIN urls ON urls.id = click_counts.url_id
+                        ORDER BY click_counts.clicks DESC LIMIT %s
+                    ''', (limit,))
+            else:
+                cur.execute('''
+                        SELECT urls.id, short_url, long_url, created_at, ranked.total FROM (
+                            SELECT url_id, SUM(clicks) AS total FROM click_rollups
+                            WHERE granularity = %s AND bucket >= %s
+                            GROUP BY url_id ORDER BY total DESC LIMIT %s
+                        ) AS ranked
+                        JOIN urls ON urls.id = ranked.url_id
+                        ORDER BY ranked.total DESC
+                    ''', (granularity, since or 0, limit))
+            rows = cur.fetchall()
+        return [(Url(*row[:4]), int(row[4])) for row in rows]
+
+    def get_click_series(self, url_id: int, granularity: str, since: int,
+                         until: Optional[int] = None) -> List[Tuple[int, int]]:
+        with self._get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute('''
+                    SELECT bucket, clicks FROM click_rollups
+                    WHERE url_id = %s AND granularity = %s AND bucket >= %s AND bucket < %s
+                    ORDER BY bucket
+                ''', (url_id, granularity, since, until if until is not None else 2 ** 62))
+            rows = cur.fetchall()
+        return [(bucket, clicks) for bucket, clicks in rows]
+
+    @staticmethod
+    def _server_cursor(conn, query: str, itersize: int):
+        # A named cursor lives on the server; iterating it fetches itersize
+        # rows per round trip instead of materializing the whole result.
+        cur = conn.cursor(name=f'urls_{next(_cursor_names)}')
+        cur.itersize = itersize
+        cur.execute(query)
+        return cur
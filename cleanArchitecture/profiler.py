@@ -0,0 +1,141 @@
+import os
+import random
+import re
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+
+_UNSAFE = re.compile(r'[^A-Za-z0-9_.-]')
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'.replace(';', ':')
+
+
+def collapse(frame) -> str:
+    # Root-first, ';'-separated, as flamegraph.pl and speedscope expect.
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class SamplingProfiler:
+    # Statistical profiler for request threads. A request is profiled when a
+    # triggered window is open or, otherwise, with probability sample_rate.
+    # Profiled threads are registered in a dict that a single sampler thread
+    # reads every `interval` seconds through sys._current_frames(); it
+    # aggregates collapsed stacks per route. Unprofiled requests pay one
+    # random() call. The sampler sleeps while nothing is being profiled.
+    def __init__(self, output_dir: str = 'profiles', interval: float = 0.005, sample_rate: float = 0.0):
+        self.output_dir = output_dir
+        self.interval = interval
+        self.sample_rate = sample_rate
+        self.window_until = 0.0
+        self.samples = 0
+        self._active: Dict[int, str] = {}
+        self._stacks: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def begin(self, route: str) -> bool:
+        if time.monotonic() >= self.window_until and (not self.sample_rate or random.random() >= self.sample_rate):
+            return False
+        self._active[threading.get_ident()] = route
+        self._ensure_sampler()
+        self._wake.set()
+        return True
+
+    def end(self):
+        self._active.pop(threading.get_ident(), None)
+
+    def start_window(self, seconds: float):
+        self.window_until = time.monotonic() + seconds
+        self._ensure_sampler()
+        self._wake.set()
+
+    def _ensure_sampler(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            if not self._active:
+                self._wake.clear()
+                if time.monotonic() >= self.window_until:
+                    self._wake.wait(1.0)
+                    continue
+            self._sample()
+            time.sleep(self.interval)
+
+    def _sample(self):
+        active = dict(self._active)
+        if not active:
+            return
+        frames = sys._current_frames()
+        with self._lock:
+            for thread_id, route in active.items():
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                stacks = self._stacks.setdefault(route, {})
+                stack = collapse(frame)
+                stacks[stack] = stacks.get(stack, 0) + 1
+                self.samples += 1
+
+    def dump(self, reset: bool = True) -> List[str]:
+        # Writes one <route>-<timestamp>.collapsed file per route.
+        with self._lock:
+            stacks = self._stacks
+            if reset:
+                self._stacks = {}
+        os.makedirs(self.output_dir, exist_ok=True)
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        paths = []
+        for route, counts in stacks.items():
+            path = os.path.join(self.output_dir, f"{_UNSAFE.sub('_', route)}-{stamp}.collapsed")
+            with open(path, 'w') as f:
+                for stack, count in sorted(counts.items(), key=lambda item: -item[1]):
+                    f.write(f'{stack} {count}\n')
+            paths.append(path)
+        return paths
+
+    def status(self) -> dict:
+        with self._lock:
+            routes = {route: sum(counts.values()) for route, counts in self._stacks.items()}
+        return {
+            'sample_rate': self.sample_rate,
+            'interval': self.interval,
+            'window_remaining': max(0.0, self.window_until - time.monotonic()),
+            'active_requests': len(self._active),
+            'samples': self.samples,
+            'routes': routes,
+        }
+
+    def close(self):
+        self._stop.set()
+        self._wake.set()
+
+
+def profile_flask(app, profiler: SamplingProfiler):
+    # Decides per request whether to profile it; the route label is the
+    # Flask endpoint name, e.g. redirect_short or index.
+    from flask import g, request
+
+    @app.before_request
+    def begin_profile():
+        if request.endpoint and profiler.begin(request.endpoint):
+            g._profiled = True
+
+    @app.teardown_request
+    def end_profile(exc=None):
+        if g.pop('_profiled', False):
+            profiler.end()
@@ -0,0 +1,86 @@
+import time
+import zlib
+from typing import Callable, Optional
+from flask import make_response, request
+from markupsafe import Markup
+from cleanArchitecture.cache import LRUCache
+
+_NOT_CACHED = object()
+
+
+class ListingCache:
+    # Two levels of caching for the /link listing. Row fragments are rendered
+    # once per link version, (id, short_url, long_url), and shared by every
+    # page that shows the row. Whole GET pages are kept per listing version,
+    # which is the url change log sequence: the urls triggers advance it on
+    # every save, update and delete, whichever process made the change, so a
+    # cached page never outlives the rows it shows. The version is also the
+    # ETag, so revalidating an unchanged listing costs one indexed read and
+    # a 304 with no page query and no rendering.
+    def __init__(self, jinja_env, version: Callable[[], int], page_size: int = 256,
+                 fragment_size: int = 10000, row_template: str = '_link_row.html'):
+        self.jinja_env = jinja_env
+        self.version = version
+        self.row_template_name = row_template
+        self._row_template = None
+        # Entries are keyed by version, so the TTL only bounds memory held
+        # by pages nobody asks for any more.
+        self.pages = LRUCache(max_size=page_size, ttl=3600.0)
+        self.fragments = LRUCache(max_size=fragment_size, ttl=3600.0)
+        self._modified = (None, None)  # (version, first seen at)
+
+    def row(self, link) -> Markup:
+        key = link.id
+        cached = self.fragments.get(key, _NOT_CACHED)
+        if cached is not _NOT_CACHED and cached[0] == link.short_url and cached[1] == link.long_url:
+            return cached[2]
+        if self._row_template is None:
+            self._row_template = self.jinja_env.get_template(self.row_template_name)
+        html = Markup(self._row_template.render(link=link))
+        self.fragments.set(key, (link.short_url, link.long_url, html))
+        return html
+
+    def respond(self, cursor: Optional[str], limit: Optional[int], render: Callable[[], str]):
+        version = self.version()
+        key = (version, cursor, limit)
+        etag = f'{version:x}-{zlib.crc32(repr((cursor, limit)).encode()):08x}'
+        last_modified = self._last_modified(version)
+
+        if request.if_none_match.contains(etag):
+            response = make_response('', 304)
+        else:
+            body = self.pages.get(key, _NOT_CACHED)
+            if body is _NOT_CACHED:
+                body = render()
+                self.pages.set(key, body)
+            response = make_response(body)
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        response.headers['Cache-Control'] = 'no-cache'
+        return response.make_conditional(request)
+
+    def _last_modified(self, version: int) -> float:
+        # When this process first saw the version; close enough for
+        # If-Modified-Since, the ETag is what makes revalidation exact.
+        seen_version, seen_at = self._modified
+        if seen_version != version:
+            seen_at = time.time()
+            self._modified = (version, seen_at)
+        return seen_at
+
+    def invalidate(self, url_id: Optional[int] = None):
+        if url_id is not None:
+            self.fragments.invalidate(url_id)
+        self.pages.clear()
+
+    def stats(self) -> dict:
+        pages = self.pages.stats()
+        fragments = self.fragments.stats()
+        return {
+            'pages': pages['size'],
+            'page_hits': pages['hits'],
+            'page_misses': pages['misses'],
+            'fragments': fragments['size'],
+            'fragment_hits': fragments['hits'],
+            'fragment_misses': fragments['misses'],
+        }
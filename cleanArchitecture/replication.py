@@ -0,0 +1,409 @@
+import argparse
+import contextvars
+import itertools
+import sqlite3
+import sys
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+from cleanArchitecture.models import UrlRepository, Url, UrlPage, UrlChange, ChangeLogGapError
+from cleanArchitecture.cache import MappedCounter
+from cleanArchitecture.database import SQLiteTuning
+from cleanArchitecture.repositories import SQLiteUrlRepository
+
+# When the current request last wrote, as epoch seconds. A replica only
+# serves the request once it has synced past that point.
+_last_write: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar('last_write', default=None)
+LAST_WRITE_COOKIE = 'last_write'
+
+
+def heartbeat_path(replica_path: str) -> str:
+    return replica_path + '.synced'
+
+
+class Replica:
+    # A read-only copy of the primary plus a way to tell how fresh it is:
+    # synced_at() returns the epoch time up to which every write committed
+    # on the primary is known to be present in the copy.
+    def __init__(self, repository: UrlRepository, synced_at: Callable[[], float], name: str = 'replica'):
+        self.repository = repository
+        self.synced_at = synced_at
+        self.name = name
+
+    def close(self):
+        self.repository.close()
+
+
+def file_replica(path: str, **repository_options) -> Replica:
+    # A local SQLite copy kept in sync by `python -m cleanArchitecture.replication sync`.
+    # Its heartbeat is an mmap'd counter, so checking freshness is a memory load.
+    heartbeat = MappedCounter(heartbeat_path(path))
+    replica = Replica(SQLiteUrlRepository(path, **repository_options), lambda: heartbeat.read() / 1000.0, path)
+    repository_close = replica.close
+
+    def close():
+        repository_close()
+        heartbeat.close()
+    replica.close = close
+    return replica
+
+
+def postgres_replica(dsn: str, check_interval: float = 0.5, **repository_options) -> Replica:
+    # A PostgreSQL streaming replica. It is current when it has replayed
+    # everything it received, otherwise as of its last replayed commit. The
+    # answer is cached for check_interval seconds since it costs a query.
+    # The standby is read-only, so the schema is left to the primary and
+    # only lookups are sent here.
+    from cleanArchitecture.postgres import PostgresUrlRepository
+
+    repository = PostgresUrlRepository(dsn, init_schema=False, **repository_options)
+    cached = [0.0, 0.0]  # checked at (monotonic), synced at (epoch)
+
+    def synced_at() -> float:
+        now = time.monotonic()
+        if now - cached[0] >= check_interval:
+            with repository.pool.connection() as conn:
+                cur = conn.cursor()
+                cur.execute('''
+                        SELECT CASE
+                            WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn()
+                            THEN EXTRACT(EPOCH FROM now())
+                            ELSE EXTRACT(EPOCH FROM pg_last_xact_replay_timestamp())
+                        END
+                    ''')
+                value = cur.fetchone()[0]
+            cached[0], cached[1] = now, float(value or 0.0)
+        return cached[1]
+    return Replica(repository, synced_at, dsn)
+
+
+class ReplicatedUrlRepository(UrlRepository):
+    # Sends link lookups (find_by_short_url, find_by_id and
+    # exists_by_short_url) to replicas and everything else to the primary. A
+    # replica is used only while it is within max_staleness seconds of the
+    # present and has synced past the current request's own last write
+    # (read-your-writes, see read_your_writes_flask); otherwise the lookup
+    # goes to the primary. A replica miss is retried on the primary, since
+    # the link may be newer than the copy and callers cache misses. Listing
+    # pages stay on the primary because their version and ETag come from
+    # the primary's change log. Works with any UrlRepository on either side.
+    def __init__(self, primary: UrlRepository, replicas: Sequence[Replica], max_staleness: float = 2.0):
+        self.primary = primary
+        self.replicas = list(replicas)
+        self.max_staleness = max_staleness
+        self._next = itertools.cycle(range(len(self.replicas))) if self.replicas else None
+        self._lock = threading.Lock()
+        self.replica_reads = 0
+        self.primary_reads = 0
+        self.stale_fallbacks = 0
+        self.own_write_fallbacks = 0
+        self.miss_fallbacks = 0
+
+    def _reader(self) -> UrlRepository:
+        if not self.replicas:
+            return self.primary
+        now = time.time()
+        last_write = _last_write.get()
+        own_write = False
+        with self._lock:
+            start = next(self._next)
+        for offset in range(len(self.replicas)):
+            replica = self.replicas[(start + offset) % len(self.replicas)]
+            synced_at = replica.synced_at()
+            if now - synced_at > self.max_staleness:
+                continue
+            if last_write is not None and synced_at <= last_write:
+                own_write = True
+                continue
+            self.replica_reads += 1
+            return replica.repository
+        if own_write:
+            self.own_write_fallbacks += 1
+        else:
+            self.stale_fallbacks += 1
+        self.primary_reads += 1
+        return self.primary
+
+    def _lookup(self, name: str, *args):
+        reader = self._reader()
+        found = getattr(reader, name)(*args)
+        if not found and reader is not self.primary:
+            self.miss_fallbacks += 1
+            self.primary_reads += 1
+            found = getattr(self.primary, name)(*args)
+        return found
+
+    @staticmethod
+    def _wrote():
+        _last_write.set(time.time())
+
+    def save(self, url: Url) -> Url:
+        saved = self.primary.save(url)
+        self._wrote()
+        return saved
+
+    def save_many(self, urls: List[Url]) -> List[Url]:
+        saved = self.primary.save_many(urls)
+        self._wrote()
+        return saved
+
+    def find_by_short_url(self, short_url: str) -> Optional[Url]:
+        return self._lookup('find_by_short_url', short_url)
+
+    def find_by_id(self, url_id: int) -> Optional[Url]:
+        return self._lookup('find_by_id', url_id)
+
+    def authoritative(self) -> UrlRepository:
+        return self.primary
+
+    def get_all(self) -> List[Url]:
+        return self.primary.get_all()
+
+    def get_page(self, limit: int, cursor: Optional[str] = None) -> UrlPage:
+        return self.primary.get_page(limit, cursor)
+
+    def iter_all(self, chunk_size: int = 1000) -> Iterator[Url]:
+        return self.primary.iter_all(chunk_size)
+
+    def update(self, url_id: int, short_url: str, long_url: str) -> Optional[Url]:
+        try:
+            return self.primary.update(url_id, short_url, long_url)
+        finally:
+            self._wrote()
+
+    def delete(self, url_id: int) -> bool:
+        try:
+            return self.primary.delete(url_id)
+        finally:
+            self._wrote()
+
+    def exists_by_short_url(self, short_url: str) -> bool:
+        return self._lookup('exists_by_short_url', short_url)
+
+    def count(self) -> int:
+        return self.primary.count()
+
+    def reserve_code_block(self, name: str, size: int) -> int:
+        return self.primary.reserve_code_block(name, size)
+
+    def current_change_seq(self) -> int:
+        return self.primary.current_change_seq()
+
+    def change_version(self) -> int:
+        return self.primary.change_version()
+
+    def get_changes(self, since_seq: int, limit: int = 1000) -> List[UrlChange]:
+        return self.primary.get_changes(since_seq, limit)
+
+    def record_clicks(self, events: List[Tuple[str, float]]):
+        self.primary.record_clicks(events)
+
+    def prune_click_rollups(self, cutoffs: Dict[str, int]) -> int:
+        return self.primary.prune_click_rollups(cutoffs)
+
+    def prune_clicks(self, before: float) -> int:
+        return self.primary.prune_clicks(before)
+
+    def get_click_counts(self, url_ids: List[int]) -> Dict[int, int]:
+        return self.primary.get_click_counts(url_ids)
+
+    def get_top_urls(self, limit: int, granularity: Optional[str] = None,
+                     since: Optional[int] = None) -> List[Tuple[Url, int]]:
+        return self.primary.get_top_urls(limit, granularity, since)
+
+    def get_click_series(self, url_id: int, granularity: str, since: int,
+                         until: Optional[int] = None) -> List[Tuple[int, int]]:
+        return self.primary.get_click_series(url_id, granularity, since, until)
+
+    def verify_storage(self):
+        return self.primary.verify_storage()
+
+    @property
+    def pool(self):
+        return self.primary.pool
+
+    def stats(self) -> dict:
+        now = time.time()
+        stats = {
+            'replica_reads': self.replica_reads,
+            'primary_reads': self.primary_reads,
+            'stale_fallbacks': self.stale_fallbacks,
+            'own_write_fallbacks': self.own_write_fallbacks,
+            'miss_fallbacks': self.miss_fallbacks,
+        }
+        for index, replica in enumerate(self.replicas):
+            stats[f'replica{index}_lag_seconds'] = max(0.0, now - replica.synced_at())
+        return stats
+
+    def close(self):
+        for replica in self.replicas:
+            replica.close()
+        self.primary.close()
+
+
+def restore_last_write(value: Optional[str]):
+    # Sets the current request's last write from its cookie value.
+    try:
+        _last_write.set(float(value) if value else None)
+    except ValueError:
+        _last_write.set(None)
+
+
+def read_your_writes_flask(app, cookie_name: str = LAST_WRITE_COOKIE, max_age: int = 300):
+    # Carries a user's last write time between requests in a cookie, so
+    # the requests that follow an update skip replicas that have not synced
+    # past it, whichever worker serves them.
+    from flask import request
+
+    @app.before_request
+    def restore_request_last_write():
+        restore_last_write(request.cookies.get(cookie_name))
+
+    @app.after_request
+    def remember_last_write(response):
+        value = _last_write.get()
+        if value is not None and repr(value) != request.cookies.get(cookie_name):
+            response.set_cookie(cookie_name, repr(value), max_age=max_age, httponly=True, samesite='Lax')
+        return response
+
+
+class ReplicaSync:
+    # Keeps a local SQLite copy of the primary current. The copy starts as
+    # an online backup of the primary; from then on the primary's change log
+    # is replayed into it, and after each pass the start time of the pass is
+    # published as the heartbeat: every write committed before it is in the
+    # copy. A change log gap (pruned past our position) restarts from a
+    # fresh backup.
+    SYNCED_SEQ = 'replica_synced_seq'
+
+    def __init__(self, primary_path: str, replica_path: str, batch_size: int = 1000,
+                 tuning: Optional[SQLiteTuning] = None):
+        self.primary_path = primary_path
+        self.replica_path = replica_path
+        self.batch_size = batch_size
+        self.tuning = tuning or SQLiteTuning()
+        self.primary = SQLiteUrlRepository(primary_path, pool_size=1, tuning=self.tuning)
+        self.conn = self.tuning.connect(replica_path)
+        self.heartbeat = MappedCounter(heartbeat_path(replica_path))
+        self.synced_seq = self._read_synced_seq()
+        self.applied = 0
+
+    def _read_synced_seq(self) -> Optional[int]:
+        # Copies synced before storage_meta existed kept the position in
+        # code_sequences; they start over from a fresh backup.
+        try:
+            row = self.conn.execute('SELECT value FROM storage_meta WHERE name = ?', (self.SYNCED_SEQ,)).fetchone()
+        except sqlite3.OperationalError:
+            return None  # empty file, never synced
+        return row[0] if row else None
+
+    def bootstrap(self):
+        # The backup is one consistent snapshot of the primary, change log
+        # position included.
+        with self.primary.pool.connection() as source:
+            source.backup(self.conn)
+        seq = self.conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'url_changes'").fetchone()
+        self.synced_seq = seq[0] if seq else 0
+        self.conn.execute('DELETE FROM url_changes')
+        self.conn.execute('''
+                INSERT INTO storage_meta (name, value) VALUES (?, ?)
+                ON CONFLICT(name) DO UPDATE SET value = excluded.value
+            ''', (self.SYNCED_SEQ, self.synced_seq))
+        self.conn.commit()
+
+    def sync_once(self) -> int:
+        # Applies everything committed on the primary so far; returns the
+        # number of changes applied.
+        started = time.time()
+        if self.synced_seq is None:
+            self.bootstrap()
+        applied = 0
+        while True:
+            try:
+                changes = self.primary.get_changes(self.synced_seq, self.batch_size)
+            except ChangeLogGapError:
+                self.bootstrap()
+                continue
+            if not changes:
+                break
+            self._apply(changes)
+            applied += len(changes)
+            if len(changes) < self.batch_size:
+                break
+        self.heartbeat.publish(int(started * 1000))
+        self.applied += applied
+        return applied
+
+    def _apply(self, changes: List[UrlChange]):
+        conn = self.conn
+        if not conn.in_transaction:
+            conn.execute('BEGIN IMMEDIATE')
+        for change in changes:
+            if change.short_url is None:
+                conn.execute('DELETE FROM urls WHERE id = ?', (change.url_id,))
+            else:
+                # REPLACE also clears a row still holding the code, which
+                # only happens mid-sequence while replaying a swap.
+                conn.execute('INSERT OR REPLACE INTO urls (id, short_url, long_url, created_at) VALUES (?, ?, ?, ?)',
+                             (change.url_id, change.short_url, change.long_url,
+                              change.created_at.isoformat(' ') if change.created_at else None))
+        self.synced_seq = changes[-1].seq
+        # The copy's own triggers log the replayed writes; nothing reads them.
+        conn.execute('DELETE FROM url_changes')
+        conn.execute('UPDATE storage_meta SET value = ? WHERE name = ?', (self.synced_seq, self.SYNCED_SEQ))
+        conn.commit()
+
+    def run(self, interval: float = 0.5, stop: Optional[threading.Event] = None):
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            self.sync_once()
+            stop.wait(interval)
+
+    def close(self):
+        self.conn.close()
+        self.heartbeat.close()
+        self.primary.close()
+
+
+def main(argv=None):
+    # python -m cleanArchitecture.replication sync urls.db replica1.db [replica2.db ...] [--interval 0.5]
+    # python -m cleanArchitecture.replication status replica1.db
+    parser = argparse.ArgumentParser(prog='python -m cleanArchitecture.replication')
+    commands = parser.add_subparsers(dest='command', required=True)
+    sync_parser = commands.add_parser('sync', help='keep local replica files in sync with the primary')
+    sync_parser.add_argument('primary')
+    sync_parser.add_argument('replicas', nargs='+')
+    sync_parser.add_argument('--interval', type=float, default=0.5, help='seconds between passes')
+    sync_parser.add_argument('--once', action='store_true')
+    status_parser = commands.add_parser('status', help='show how far behind replica files are')
+    status_parser.add_argument('replicas', nargs='+')
+    args = parser.parse_args(argv)
+
+    if args.command == 'status':
+        for path in args.replicas:
+            heartbeat = MappedCounter(heartbeat_path(path))
+            synced_at = heartbeat.read() / 1000.0
+            heartbeat.close()
+            print(f"{path}: " + (f"{time.time() - synced_at:.3f}s behind" if synced_at else "never synced"))
+        return
+
+    syncs = [ReplicaSync(args.primary, path) for path in args.replicas]
+    try:
+        while True:
+            for sync in syncs:
+                applied = sync.sync_once()
+                if applied:
+                    print(f"{sync.replica_path}: applied {applied} changes, at seq {sync.synced_seq}",
+                          file=sys.stderr)
+            if args.once:
+                break
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for sync in syncs:
+            sync.close()
+
+
+if __name__ == "__main__":
+    main()
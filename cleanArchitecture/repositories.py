@@ -1,14 +1,44 @@
 from datetime import datetime
+import asyncio
+import base64
+import contextvars
+import functools
 import sqlite3
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
-from typing import List, Optional
-from cleanArchitecture.models import UrlRepository, Url, AuthRepository
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from cleanArchitecture.models import UrlRepository, Url, UrlPage, UrlChange, AuthRepository, ShortUrlConflictError, \
+    ChangeLogGapError
+from cleanArchitecture.database import ConnectionPool, SQLiteTuning
+from cleanArchitecture.clicks import ROLLUP_GRANULARITIES, CLICK_PRUNE_BATCH, aggregate_clicks, aggregate_rollups
+
+
+def encode_cursor(created_at: str, url_id: int) -> str:
+    raw = f"{created_at}|{url_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, url_id = base64.urlsafe_b64decode(padded).decode().rsplit('|', 1)
+        # Checked here so PostgreSQL's timestamp cast never sees a bad value.
+        datetime.fromisoformat(created_at)
+        return created_at, int(url_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid page cursor")
 
 
 class SQLiteUrlRepository(UrlRepository):
-    def __init__(self, database_path: str):
+    def __init__(self, database_path: str, pool_size: int = 5, pool_timeout: float = 5.0,
+                 health_check_interval: float = 30.0, tuning: Optional[SQLiteTuning] = None,
+                 change_log_retention: Optional[int] = None):
         self.database_path = database_path
+        self.pool = ConnectionPool(database_path, size=pool_size, timeout=pool_timeout,
+                                   health_check_interval=health_check_interval, tuning=tuning)
         self._init_db()
+        if change_log_retention is not None:
+            self.set_change_log_retention(change_log_retention)
 
     def _init_db(self):
         try:
@@ -22,64 +52,249 @@ class SQLiteUrlRepository(UrlRepository):
                             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                         )
                     ''')
+                cur.execute('''
+                        CREATE INDEX IF NOT EXISTS idx_urls_created_at_id
+                        ON urls (created_at DESC, id DESC)
+                    ''')
+                # Every change to urls is logged by triggers, whoever makes it,
+                # so in-memory indexes and snapshots can catch up.
+                cur.execute('''
+                        CREATE TABLE IF NOT EXISTS url_changes (
+                            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                            url_id INTEGER NOT NULL,
+                            old_short_url TEXT,
+                            short_url TEXT,
+                            long_url TEXT,
+                            created_at TIMESTAMP
+                        )
+                    ''')
+                cur.execute('''
+                        CREATE TRIGGER IF NOT EXISTS urls_log_insert AFTER INSERT ON urls BEGIN
+                            INSERT INTO url_changes (url_id, short_url, long_url, created_at)
+                            VALUES (NEW.id, NEW.short_url, NEW.long_url, NEW.created_at);
+                        END
+                    ''')
+                cur.execute('''
+                        CREATE TRIGGER IF NOT EXISTS urls_log_update AFTER UPDATE ON urls BEGIN
+                            INSERT INTO url_changes (url_id, old_short_url, short_url, long_url, created_at)
+                            VALUES (NEW.id, OLD.short_url, NEW.short_url, NEW.long_url, NEW.created_at);
+                        END
+                    ''')
+                cur.execute('''
+                        CREATE TRIGGER IF NOT EXISTS urls_log_delete AFTER DELETE ON urls BEGIN
+                            INSERT INTO url_changes (url_id, old_short_url) VALUES (OLD.id, OLD.short_url);
+                        END
+                    ''')
+                cur.execute('''
+                        CREATE TABLE IF NOT EXISTS click_counts (
+                            url_id INTEGER PRIMARY KEY,
+                            clicks INTEGER NOT NULL,
+                            last_clicked_at REAL
+                        )
+                    ''')
+                cur.execute('''
+                        CREATE TABLE IF NOT EXISTS clicks (
+                            id INTEGER PRIMARY KEY,
+                            url_id INTEGER NOT NULL,
+                            clicked_at REAL NOT NULL
+                        )
+                    ''')
+                cur.execute('CREATE INDEX IF NOT EXISTS idx_clicks_url_id_clicked_at ON clicks (url_id, clicked_at)')
+                cur.execute('CREATE INDEX IF NOT EXISTS idx_clicks_clicked_at ON clicks (clicked_at)')
+                cur.execute('CREATE INDEX IF NOT EXISTS idx_click_counts_clicks ON click_counts (clicks DESC)')
+                rollups_exist = cur.execute(
+                        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'click_rollups'"
+                    ).fetchone()
+                cur.execute('''
+                        CREATE TABLE IF NOT EXISTS click_rollups (
+                            url_id INTEGER NOT NULL,
+                            granularity TEXT NOT NULL,
+                            bucket INTEGER NOT NULL,
+                            clicks INTEGER NOT NULL,
+                            PRIMARY KEY (url_id, granularity, bucket)
+                        ) WITHOUT ROWID
+                    ''')
+                cur.execute('''
+                        CREATE INDEX IF NOT EXISTS idx_click_rollups_window
+                        ON click_rollups (granularity, bucket, url_id, clicks)
+                    ''')
+                if not rollups_exist:
+                    # Clicks recorded before rollups existed are folded in once.
+                    for granularity, width in ROLLUP_GRANULARITIES.items():
+                        cur.execute('''
+                                INSERT INTO click_rollups (url_id, granularity, bucket, clicks)
+                                SELECT url_id, ?, CAST(clicked_at / ? AS INTEGER) * ?, COUNT(*)
+                                FROM clicks GROUP BY 1, 2, 3
+                            ''', (granularity, width, width))
+                cur.execute('''
+                        CREATE TABLE IF NOT EXISTS code_sequences (
+                            name TEXT PRIMARY KEY,
+                            next_value INTEGER NOT NULL
+                        )
+                    ''')
+                # Bookkeeping that is not a short code sequence, such as the
+                # change log retention and pruned watermark.
+                cur.execute('''
+                        CREATE TABLE IF NOT EXISTS storage_meta (
+                            name TEXT PRIMARY KEY,
+                            value INTEGER NOT NULL
+                        )
+                    ''')
+                cur.execute('''
+                        INSERT OR IGNORE INTO storage_meta (name, value)
+                        SELECT name, next_value FROM code_sequences WHERE name = 'url_changes_pruned'
+                    ''')
+                cur.execute("DELETE FROM code_sequences WHERE name = 'url_changes_pruned'")
+                # Keeps the change log at about url_changes_retention rows:
+                # every 1000th change drops what is older than that. Readers
+                # that fall further behind get a ChangeLogGapError and reload.
+                cur.execute('''
+                        CREATE TRIGGER IF NOT EXISTS url_changes_retention AFTER INSERT ON url_changes
+                        WHEN NEW.seq % 1000 = 0 BEGIN
+                            INSERT INTO storage_meta (name, value)
+                            SELECT 'url_changes_pruned', NEW.seq - value FROM storage_meta
+                            WHERE name = 'url_changes_retention' AND value > 0 AND NEW.seq > value
+                            ON CONFLICT(name) DO UPDATE SET value = MAX(value, excluded.value);
+                            DELETE FROM url_changes
+                            WHERE seq <= (SELECT value FROM storage_meta WHERE name = 'url_changes_pruned');
+                        END
+                    ''')
                 conn.commit()
         except sqlite3.Error as e:
             raise RuntimeError(f"Error connecting to database: {e}")
 
     @contextmanager
     def _get_connection(self):
-        conn = None
-        try:
-            conn = sqlite3.connect(self.database_path)
-            conn.row_factory = sqlite3.Row
-            yield conn
-        except sqlite3.Error as e:
-            if conn:
+        with self.pool.connection() as conn:
+            try:
+                yield conn
+            except sqlite3.Error as e:
                 conn.rollback()
-            raise RuntimeError(f"Database error: {e}")
-        finally:
-            if conn:
-                conn.close()
+                raise RuntimeError(f"Database error: {e}")
+
+    def verify_storage(self):
+        return self.pool.verify()
+
+    def close(self):
+        self.pool.close()
 
     def save(self, url: Url) -> Url:
         with self._get_connection() as conn:
             cur = conn.cursor()
-            cur.execute(
-                    'INSERT INTO urls (short_url, long_url) VALUES (?, ?)',
-                    (url.short_url, url.long_url)
-                )
+            try:
+                cur.execute(
+                        'INSERT INTO urls (short_url, long_url) VALUES (?, ?) RETURNING id, created_at',
+                        (url.short_url, url.long_url)
+                    )
+                # RETURNING values carry no declared type, so the timestamp
+                # comes back as text.
+                url.id, created_at = cur.fetchone()
+            except sqlite3.IntegrityError:
+                conn.rollback()
+                raise ShortUrlConflictError("Short url already exists")
             conn.commit()
-            url.id = cur.lastrowid
+            url.created_at = datetime.fromisoformat(created_at)
             return url
 
+    def save_many(self, urls: List[Url]) -> List[Url]:
+        # One transaction and one executemany for the whole batch. Rows whose
+        # short_url is already taken are skipped and come back with id None,
+        # so the caller can give them new codes and retry just those.
+        if not urls:
+            return []
+        with self._get_connection() as conn:
+            if not conn.in_transaction:
+                conn.execute('BEGIN IMMEDIATE')
+            last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM urls').fetchone()[0]
+            conn.executemany(
+                    'INSERT OR IGNORE INTO urls (short_url, long_url) VALUES (?, ?)',
+                    [(url.short_url, url.long_url) for url in urls]
+                )
+            inserted = {
+                row['short_url']: row
+                for row in conn.execute('SELECT id, short_url, created_at FROM urls WHERE id > ?', (last_id,))
+            }
+            conn.commit()
+
+        saved = []
+        for url in urls:
+            row = inserted.pop(url.short_url, None)
+            if row is not None:
+                url.id = row['id']
+                url.created_at = row['created_at']
+                saved.append(url)
+        return saved
+
     def find_by_short_url(self, short_url: str) -> Optional[Url]:
         with self._get_connection() as conn:
-            cur = conn.cursor()
-            cur.execute('SELECT * FROM urls WHERE short_url = ?', (short_url,))
+            cur = self._url_cursor(conn)
+            cur.execute('SELECT id, short_url, long_url, created_at FROM urls WHERE short_url = ?', (short_url,))
             row = cur.fetchone()
-            return self._row_to_url(row) if row else None
+            return Url(*row) if row else None
 
     def find_by_id(self, url_id: int) -> Optional[Url]:
         with self._get_connection() as conn:
-            cur = conn.cursor()
-            cur.execute('SELECT * FROM urls WHERE id = ?', (url_id,))
+            cur = self._url_cursor(conn)
+            cur.execute('SELECT id, short_url, long_url, created_at FROM urls WHERE id = ?', (url_id,))
             row = cur.fetchone()
-            return self._row_to_url(row) if row else None
+            return Url(*row) if row else None
 
     def get_all(self) -> List[Url]:
         with self._get_connection() as conn:
-            cur = conn.cursor()
-            cur.execute('SELECT * FROM urls')
+            cur = self._url_cursor(conn)
+            cur.execute('SELECT id, short_url, long_url, created_at FROM urls')
+            return [Url(*row) for row in cur.fetchall()]
+
+    def get_page(self, limit: int, cursor: Optional[str] = None) -> UrlPage:
+        with self._get_connection() as conn:
+            cur = self._url_cursor(conn)
+            if cursor:
+                created_at, url_id = decode_cursor(cursor)
+                cur.execute('''
+                        SELECT id, short_url, long_url, created_at FROM urls
+                        WHERE (created_at, id) < (?, ?)
+                        ORDER BY created_at DESC, id DESC LIMIT ?
+                    ''', (created_at, url_id, limit + 1))
+            else:
+                cur.execute('''
+                        SELECT id, short_url, long_url, created_at FROM urls
+                        ORDER BY created_at DESC, id DESC LIMIT ?
+                    ''', (limit + 1,))
             rows = cur.fetchall()
-            return [self._row_to_url(row) for row in rows]
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1][3], rows[-1][0])
+        return UrlPage(items=[Url(*row) for row in rows], next_cursor=next_cursor)
+
+    def iter_all(self, chunk_size: int = 1000) -> Iterator[Url]:
+        # Walks the table by id in keyset chunks, borrowing a connection per
+        # chunk so a slow consumer never pins one from the pool.
+        last_id = 0
+        while True:
+            with self._get_connection() as conn:
+                rows = self._url_cursor(conn).execute(
+                        'SELECT id, short_url, long_url, created_at FROM urls WHERE id > ? ORDER BY id LIMIT ?',
+                        (last_id, chunk_size)
+                    ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield Url(*row)
+            last_id = rows[-1][0]
 
     def update(self, url_id: int, short_url: str, long_url: str) -> Optional[Url]:
         with self._get_connection() as conn:
             cur = conn.cursor()
-            cur.execute(
-                    'UPDATE urls SET short_url = ?, long_url = ? WHERE id = ?',
-                    (short_url, long_url, url_id)
-                )
+            try:
+                cur.execute(
+                        'UPDATE urls SET short_url = ?, long_url = ? WHERE id = ?',
+                        (short_url, long_url, url_id)
+                    )
+            except sqlite3.IntegrityError:
+                conn.rollback()
+                raise ShortUrlConflictError("Short url already exists")
             if cur.rowcount == 0:
                 return None
             conn.commit()
@@ -90,6 +305,10 @@ class SQLiteUrlRepository(UrlRepository):
             cur = conn.cursor()
             cur.execute('DELETE FROM urls WHERE id = ?', (url_id,))
             deleted = cur.rowcount > 0
+            if deleted:
+                cur.execute('DELETE FROM click_counts WHERE url_id = ?', (url_id,))
+                cur.execute('DELETE FROM clicks WHERE url_id = ?', (url_id,))
+                cur.execute('DELETE FROM click_rollups WHERE url_id = ?', (url_id,))
             conn.commit()
             return deleted
 
@@ -99,13 +318,229 @@ class SQLiteUrlRepository(UrlRepository):
             cur.execute('SELECT 1 FROM urls WHERE short_url = ?', (short_url,))
             return cur.fetchone() is not None
 
-    def _row_to_url(self, row) -> Url:
-        return Url(
-            id=row['id'],
+    def count(self) -> int:
+        with self._get_connection() as conn:
+            return conn.execute('SELECT COUNT(*) FROM urls').fetchone()[0]
+
+    def reserve_code_block(self, name: str, size: int) -> int:
+        with self._get_connection() as conn:
+            cur = conn.execute('''
+                    INSERT INTO code_sequences (name, next_value) VALUES (?, ?)
+                    ON CONFLICT(name) DO UPDATE SET next_value = next_value + excluded.next_value
+                    RETURNING next_value
+                ''', (name, size))
+            end = cur.fetchone()[0]
+            conn.commit()
+            return end - size
+
+    def current_change_seq(self) -> int:
+        with self._get_connection() as conn:
+            # sqlite_sequence keeps the high-water mark even after pruning.
+            row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'url_changes'").fetchone()
+            return row[0] if row else 0
+
+    def get_changes(self, since_seq: int, limit: int = 1000) -> List[UrlChange]:
+        with self._get_connection() as conn:
+            pruned = conn.execute(
+                    "SELECT value FROM storage_meta WHERE name = 'url_changes_pruned'"
+                ).fetchone()
+            if pruned is not None and since_seq < pruned[0]:
+                raise ChangeLogGapError(f"Changes up to {pruned[0]} have been pruned")
+            rows = conn.execute(
+                    'SELECT * FROM url_changes WHERE seq > ? ORDER BY seq LIMIT ?', (since_seq, limit)
+                ).fetchall()
+        return [UrlChange(
+            seq=row['seq'],
+            url_id=row['url_id'],
+            old_short_url=row['old_short_url'],
             short_url=row['short_url'],
             long_url=row['long_url'],
-            created_at=datetime.fromisoformat(row['created_at'])
-        )
+            created_at=datetime.fromisoformat(row['created_at']) if row['created_at'] else None
+        ) for row in rows]
+
+    def prune_changes(self, up_to_seq: int) -> int:
+        # Readers still behind up_to_seq get a ChangeLogGapError and reload.
+        with self._get_connection() as conn:
+            if not conn.in_transaction:
+                conn.execute('BEGIN IMMEDIATE')
+            cur = conn.execute('DELETE FROM url_changes WHERE seq <= ?', (up_to_seq,))
+            conn.execute('''
+                    INSERT INTO storage_meta (name, value) VALUES ('url_changes_pruned', ?)
+                    ON CONFLICT(name) DO UPDATE SET value = MAX(value, excluded.value)
+                ''', (up_to_seq,))
+            conn.commit()
+            return cur.rowcount
+
+    def set_change_log_retention(self, keep: int):
+        # Shared by every process using the database; 0 keeps everything.
+        with self._get_connection() as conn:
+            conn.execute('''
+                    INSERT INTO storage_meta (name, value) VALUES ('url_changes_retention', ?)
+                    ON CONFLICT(name) DO UPDATE SET value = excluded.value
+                ''', (keep,))
+            conn.commit()
+
+    def record_clicks(self, events: List[Tuple[str, float]]):
+        # Raw events, per-link totals and rollups in one transaction. Short codes are
+        # resolved to ids here, off the redirect path.
+        if not events:
+            return
+        counts = aggregate_clicks(events)
+        with self._get_connection() as conn:
+            if not conn.in_transaction:
+                conn.execute('BEGIN IMMEDIATE')
+            conn.executemany(
+                    'INSERT INTO clicks (url_id, clicked_at) SELECT id, ? FROM urls WHERE short_url = ?',
+                    [(clicked_at, short_url) for short_url, clicked_at in events]
+                )
+            conn.executemany('''
+                    INSERT INTO click_counts (url_id, clicks, last_clicked_at)
+                    SELECT id, ?, ? FROM urls WHERE short_url = ?
+                    ON CONFLICT(url_id) DO UPDATE SET
+                        clicks = clicks + excluded.clicks,
+                        last_clicked_at = MAX(last_clicked_at, excluded.last_clicked_at)
+                ''', [(count, last, short_url) for short_url, (count, last) in counts.items()])
+            conn.executemany('''
+                    INSERT INTO click_rollups (url_id, granularity, bucket, clicks)
+                    SELECT id, ?, ?, ? FROM urls WHERE short_url = ?
+                    ON CONFLICT(url_id, granularity, bucket) DO UPDATE SET clicks = clicks + excluded.clicks
+                ''', [(granularity, bucket, count, short_url)
+                      for (short_url, granularity, bucket), count in aggregate_rollups(events).items()])
+            conn.commit()
+
+    def prune_click_rollups(self, cutoffs: Dict[str, int]) -> int:
+        # Deletes buckets older than cutoffs[granularity]; the
+        # (granularity, bucket) index keeps this a range delete.
+        with self._get_connection() as conn:
+            if not conn.in_transaction:
+                conn.execute('BEGIN IMMEDIATE')
+            deleted = 0
+            for granularity, cutoff in cutoffs.items():
+                deleted += conn.execute('DELETE FROM click_rollups WHERE granularity = ? AND bucket < ?',
+                                        (granularity, cutoff)).rowcount
+            conn.commit()
+            return deleted
+
+    def prune_clicks(self, before: float) -> int:
+        # Raw events older than before, CLICK_PRUNE_BATCH rows per transaction
+        # so a large backlog does not hold the write lock for long. Totals and
+        # rollups already count them.
+        deleted = 0
+        while True:
+            with self._get_connection() as conn:
+                if not conn.in_transaction:
+                    conn.execute('BEGIN IMMEDIATE')
+                batch = conn.execute('''
+                        DELETE FROM clicks WHERE id IN (
+                            SELECT id FROM clicks WHERE clicked_at < ? LIMIT ?)
+                    ''', (before, CLICK_PRUNE_BATCH)).rowcount
+                conn.commit()
+            deleted += batch
+            if batch < CLICK_PRUNE_BATCH:
+                return deleted
+
+    def get_click_counts(self, url_ids: List[int]) -> Dict[int, int]:
+        if not url_ids:
+            return {}
+        placeholders = ','.join('?' * len(url_ids))
+        with self._get_connection() as conn:
+            rows = conn.execute(
+                    f'SELECT url_id, clicks FROM click_counts WHERE url_id IN ({placeholders})', list(url_ids)
+                ).fetchall()
+        counts = {url_id: 0 for url_id in url_ids}
+        counts.update({row['url_id']: row['clicks'] for row in rows})
+        return counts
+
+    def get_top_urls(self, limit: int, granularity: Optional[str] = None,
+                     since: Optional[int] = None) -> List[Tuple[Url, int]]:
+        # All-time totals walk the click_counts index; windowed totals only
+        # read the rollup buckets inside the window.
+        with self._get_connection() as conn:
+            cur = self._url_cursor(conn)
+            if granularity is None:
+                rows = cur.execute('''
+                        SELECT urls.id, short_url, long_url, created_at, clicks FROM click_counts
+                        JOIN urls ON urls.id = click_counts.url_id
+                        ORDER BY click_counts.clicks DESC LIMIT ?
+                    ''', (limit,)).fetchall()
+            else:
+                rows = cur.execute('''
+                        SELECT urls.id, short_url, long_url, created_at, ranked.total FROM (
+                            SELECT url_id, SUM(clicks) AS total FROM click_rollups
+                            WHERE granularity = ? AND bucket >= ?
+                            GROUP BY url_id ORDER BY total DESC LIMIT ?
+                        ) AS ranked
+                        JOIN urls ON urls.id = ranked.url_id
+                        ORDER BY ranked.total DESC
+                    ''', (granularity, since or 0, limit)).fetchall()
+        return [(Url(*row[:4]), row[4]) for row in rows]
+
+    def get_click_series(self, url_id: int, granularity: str, since: int,
+                         until: Optional[int] = None) -> List[Tuple[int, int]]:
+        with self._get_connection() as conn:
+            rows = conn.execute('''
+                    SELECT bucket, clicks FROM click_rollups
+                    WHERE url_id = ? AND granularity = ? AND bucket >= ? AND bucket < ?
+                    ORDER BY bucket
+                ''', (url_id, granularity, since, until if until is not None else 2 ** 62)).fetchall()
+        return [(row['bucket'], row['clicks']) for row in rows]
+
+    @staticmethod
+    def _url_cursor(conn):
+        # Plain tuples instead of sqlite3.Row: url queries select
+        # id, short_url, long_url, created_at in that order and map the
+        # tuple positionally onto Url.
+        cur = conn.cursor()
+        cur.row_factory = None
+        return cur
+
+
+class AsyncUrlRepository:
+    # Async facade over any UrlRepository: each call runs on a bounded thread
+    # pool so the event loop never blocks on SQLite, and a semaphore caps how
+    # many calls may queue up behind the pool.
+    def __init__(self, url_repository: UrlRepository, max_workers: int = 8, max_pending: int = 1000):
+        self.url_repository = url_repository
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='url-repo')
+        self._pending = asyncio.Semaphore(max_pending)
+
+    async def run(self, func: Callable, *args, **kwargs):
+        async with self._pending:
+            loop = asyncio.get_running_loop()
+            # The copied context carries request-scoped state such as the
+            # replication read-your-writes marker into the worker thread.
+            context = contextvars.copy_context()
+            return await loop.run_in_executor(self.executor, functools.partial(context.run, func, *args, **kwargs))
+
+    async def save(self, url: Url) -> Url:
+        return await self.run(self.url_repository.save, url)
+
+    async def save_many(self, urls: List[Url]) -> List[Url]:
+        return await self.run(self.url_repository.save_many, urls)
+
+    async def find_by_short_url(self, short_url: str) -> Optional[Url]:
+        return await self.run(self.url_repository.find_by_short_url, short_url)
+
+    async def find_by_id(self, url_id: int) -> Optional[Url]:
+        return await self.run(self.url_repository.find_by_id, url_id)
+
+    async def get_page(self, limit: int, cursor: Optional[str] = None) -> UrlPage:
+        return await self.run(self.url_repository.get_page, limit, cursor)
+
+    async def update(self, url_id: int, short_url: str, long_url: str) -> Optional[Url]:
+        return await self.run(self.url_repository.update, url_id, short_url, long_url)
+
+    async def delete(self, url_id: int) -> bool:
+        return await self.run(self.url_repository.delete, url_id)
+
+    async def exists_by_short_url(self, short_url: str) -> bool:
+        return await self.run(self.url_repository.exists_by_short_url, short_url)
+
+    async def count(self) -> int:
+        return await self.run(self.url_repository.count)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
 
 
 class InMemoryAuthRepository(AuthRepository):
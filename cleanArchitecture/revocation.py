@@ -0,0 +1,194 @@
+import random
+import sqlite3
+import threading
+import time
+from array import array
+from typing import Optional
+from cleanArchitecture.cache import MappedCounter
+from cleanArchitecture.database import ConnectionPool, SQLiteTuning
+
+
+def _build_masks(hash_count: int, mask_bits: int):
+    rng = random.Random(hash_count)
+    masks = array('Q')
+    for _ in range(1 << mask_bits):
+        mask = 0
+        for bit in rng.sample(range(64), hash_count):
+            mask |= 1 << bit
+        masks.append(mask)
+    return masks
+
+
+class BloomFilter:
+    # Blocked Bloom filter: one hash picks a 64-bit word and, through a
+    # precomputed table, a mask with hash_count bits set, so a membership
+    # test is a few integer operations instead of hash_count probes. The
+    # hash is Python's own str hash (cached on the string object). It is
+    # salted per process, which is fine: each worker builds its own filter
+    # from the shared revocation table.
+    MASK_BITS = 14
+    _mask_tables = {}
+
+    def __init__(self, capacity: int = 100000, bits_per_entry: int = 12, hash_count: int = 8):
+        self.capacity = capacity
+        self.hash_count = hash_count
+        self.words = max(1, capacity * bits_per_entry // 64)
+        self.size = self.words * 64
+        self.count = 0
+        self._bits = array('Q', bytes(8 * self.words))
+        if hash_count not in self._mask_tables:
+            self._mask_tables[hash_count] = _build_masks(hash_count, self.MASK_BITS)
+        self._masks = self._mask_tables[hash_count]
+        self._mask_mask = (1 << self.MASK_BITS) - 1
+
+    def add(self, item: str):
+        h = hash(item)
+        self._bits[h % self.words] |= self._masks[(h >> 40) & self._mask_mask]
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        h = hash(item)
+        mask = self._masks[(h >> 40) & self._mask_mask]
+        return self._bits[h % self.words] & mask == mask
+
+
+class RevocationList:
+    # Revoked jti values are stored, with their token's exp, in a SQLite file
+    # shared by all workers. Each worker only keeps a Bloom filter in memory:
+    # a token that is not in the filter is definitely not revoked, which is
+    # the answer for nearly every request. Filter hits are confirmed against
+    # the table. New revocations are announced through a mmap'd sequence
+    # counter, and a background thread purges expired rows and rebuilds the
+    # filter periodically so expired entries stop producing false positives.
+    def __init__(self, path: str, capacity: int = 100000, bits_per_entry: int = 12,
+                 rebuild_interval: float = 300.0):
+        self.path = path
+        self.capacity = capacity
+        self.bits_per_entry = bits_per_entry
+        self.rebuild_interval = rebuild_interval
+        self.pool = ConnectionPool(path, size=2, tuning=SQLiteTuning(synchronous='NORMAL'))
+        self._lock = threading.Lock()
+        self._init_db()
+        self._counter = MappedCounter(path + '.seq')
+        self._rebuild()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='revocation-purger', daemon=True)
+        self._thread.start()
+
+    def _init_db(self):
+        with self.pool.connection() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS revoked_tokens (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    jti TEXT UNIQUE NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            ''')
+            conn.commit()
+
+    def _rebuild(self):
+        bloom = BloomFilter(self.capacity, self.bits_per_entry)
+        with self.pool.connection() as conn:
+            # High water first, as in _sync: a revocation committed between
+            # the two reads is then in the rows, not skipped past.
+            seen = self._high_water(conn)
+            rows = conn.execute(
+                'SELECT seq, jti FROM revoked_tokens WHERE expires_at > ?', (time.time(),)
+            ).fetchall()
+        for row in rows:
+            bloom.add(row['jti'])
+        if bloom.count > self.capacity:
+            bloom = BloomFilter(bloom.count * 2, self.bits_per_entry)
+            for row in rows:
+                bloom.add(row['jti'])
+        self._bloom = bloom
+        self._seen = seen
+        self._rebuilt_at = time.monotonic()
+
+    @staticmethod
+    def _high_water(conn) -> int:
+        # The last seq handed out, which is what revoke() publishes. Unlike
+        # MAX(seq) it does not move back when expired rows are purged.
+        row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'revoked_tokens'").fetchone()
+        return row[0] if row else 0
+
+    def _sync(self):
+        with self._lock:
+            if time.monotonic() - self._rebuilt_at >= self.rebuild_interval:
+                self._rebuild()
+                return
+            with self.pool.connection() as conn:
+                # Read first: a revocation landing in between is then still
+                # returned by the query below.
+                high_water = self._high_water(conn)
+                rows = conn.execute(
+                    'SELECT seq, jti FROM revoked_tokens WHERE seq > ? ORDER BY seq', (self._seen,)
+                ).fetchall()
+            for row in rows:
+                self._bloom.add(row['jti'])
+            self._seen = max(high_water, rows[-1]['seq'] if rows else 0)
+
+    def _run(self):
+        while not self._stop.wait(self.rebuild_interval):
+            try:
+                self.purge_expired()
+            except sqlite3.Error:
+                pass  # retried on the next interval
+
+    def is_revoked(self, jti: Optional[str]) -> bool:
+        if jti is None:
+            return False
+        if self._counter.read() > self._seen:
+            self._sync()  # also picks up this worker's own revocations
+        if jti not in self._bloom:
+            return False
+        with self.pool.connection() as conn:
+            row = conn.execute(
+                'SELECT 1 FROM revoked_tokens WHERE jti = ? AND expires_at > ?', (jti, time.time())
+            ).fetchone()
+        return row is not None
+
+    def is_revoked_in_memory(self, jti: Optional[str]) -> Optional[bool]:
+        # The answer is_revoked() would give if it needs no lock and no
+        # query, else None.
+        if jti is None:
+            return False
+        if self._counter.read() > self._seen or jti in self._bloom:
+            return None
+        return False
+
+    def revoke(self, jti: str, expires_at: float):
+        with self.pool.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute(
+                    'INSERT OR IGNORE INTO revoked_tokens (jti, expires_at) VALUES (?, ?)', (jti, expires_at)
+                )
+                self._counter.publish(self._high_water(conn))
+                conn.commit()
+            except sqlite3.Error:
+                conn.rollback()
+                raise
+
+    def purge_expired(self) -> int:
+        with self.pool.connection() as conn:
+            cur = conn.execute('DELETE FROM revoked_tokens WHERE expires_at <= ?', (time.time(),))
+            conn.commit()
+        with self._lock:
+            self._rebuild()
+        return cur.rowcount
+
+    def stats(self) -> dict:
+        return {
+            'bloom_bits': self._bloom.size,
+            'bloom_hashes': self._bloom.hash_count,
+            'bloom_capacity': self._bloom.capacity,
+            'bloom_entries': self._bloom.count,
+            'sequence': self._seen,
+        }
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        self.pool.close()
+        self._counter.close()
@@ -1,44 +1,220 @@
-import random, string, jwt
-from typing import Optional, List
-from cleanArchitecture.models import UrlRepository, Url, AuthRepository
+import hashlib, time, uuid, jwt
+from typing import Dict, Iterable, Iterator, Optional, List, Tuple, Union
+from cleanArchitecture.models import UrlRepository, Url, UrlPage, AuthRepository, ShortUrlConflictError
+from cleanArchitecture.cache import LRUCache, SharedRedirectCache
+from cleanArchitecture.codes import CodeAllocator, RandomCodeAllocator, keyspace_report
+from cleanArchitecture.jwt_keyring import KeyRing, KeyNotFoundError
+from cleanArchitecture.revocation import RevocationList
+from cleanArchitecture.repositories import AsyncUrlRepository
+from cleanArchitecture.clicks import ClickTracker, ROLLUP_GRANULARITIES, bucket_start
 from datetime import datetime, timedelta
 
+# Passed as the default to cache.get() rather than comparing against
+# cache.MISSING, which differs when app.py imports the cache module by its
+# bare name.
+_NOT_CACHED = object()
+
 
 class UrlShortenerService:
-    def __init__(self, url_repository: UrlRepository):
+    def __init__(self, url_repository: UrlRepository,
+                 cache: Optional[Union[LRUCache, SharedRedirectCache]] = None,
+                 code_allocator: Optional[CodeAllocator] = None, max_create_attempts: int = 10,
+                 default_page_size: int = 50, max_page_size: int = 500,
+                 click_tracker: Optional[ClickTracker] = None, stale_read_ttl: Optional[float] = None,
+                 max_url_length: Optional[int] = None):
         self.url_repository = url_repository
+        self.click_tracker = click_tracker
+        self.cache = cache
+        self.code_allocator = code_allocator or RandomCodeAllocator()
+        self.max_create_attempts = max_create_attempts
+        self.default_page_size = default_page_size
+        self.max_page_size = max_page_size
+        # Set when lookups may come from a replica: cached targets then live
+        # no longer than the replica may lag, so an update or delete is not
+        # undone for the full cache TTL by a refill from a lagging copy.
+        self.stale_read_ttl = stale_read_ttl
+        self.max_url_length = max_url_length
+
+    def _check_long_url(self, long_url):
+        if not isinstance(long_url, str) or not long_url:
+            raise ValueError("long_url must be a non-empty string")
+        if self.max_url_length is not None and len(long_url) > self.max_url_length:
+            raise ValueError(f"long_url is longer than {self.max_url_length} characters")
+
+    def create_short_url(self, long_url: str) -> Url:
+        self._check_long_url(long_url)
+        for _ in range(self.max_create_attempts):
+            url = Url(id=None, long_url=long_url, short_url=self.code_allocator.next_code())
+            try:
+                saved = self.url_repository.save(url)
+            except ShortUrlConflictError:
+                continue
+            self._invalidate(saved.short_url)
+            return saved
+        raise RuntimeError("Could not allocate a unique short url")
 
-    def create_short_url(self, url_id: int, short_url:str, long_url:str) -> Optional[Url]:
-        short_url = self._generate_unique_short_url()
-        url = Url(id=url_id, long_url=long_url, short_url=short_url)
-        return self.url_repository.save(url)
+    def bulk_create_short_urls(self, long_urls: Iterable[str], batch_size: int = 5000) -> List[Url]:
+        # The whole input is read and checked before the first batch is
+        # written, so a bad entry late in the stream creates nothing rather
+        # than leaving earlier batches committed but unreported.
+        pending = []
+        for number, long_url in enumerate(long_urls, 1):
+            try:
+                self._check_long_url(long_url)
+            except ValueError as e:
+                raise ValueError(f"entry {number}: {e}")
+            pending.append(long_url)
+        created = []
+        for start in range(0, len(pending), batch_size):
+            created.extend(self._create_batch(pending[start:start + batch_size]))
+        return created
+
+    def _create_batch(self, long_urls: List[str]) -> List[Url]:
+        codes = self.code_allocator.next_codes(len(long_urls))
+        urls = [Url(id=None, short_url=code, long_url=long_url) for code, long_url in zip(codes, long_urls)]
+        pending = urls
+        for _ in range(self.max_create_attempts):
+            self.url_repository.save_many(pending)
+            pending = [url for url in pending if url.id is None]
+            if not pending:
+                break
+            for url, code in zip(pending, self.code_allocator.next_codes(len(pending))):
+                url.short_url = code
+        if pending:
+            raise RuntimeError(f"Could not allocate unique short urls for {len(pending)} links")
+        self._invalidate(*(url.short_url for url in urls))
+        return urls
+
+    def export_urls(self, chunk_size: int = 1000) -> Iterator[Url]:
+        return self.url_repository.iter_all(chunk_size)
 
     def get_long_url(self, short_url: str) -> Optional[str]:
+        if self.cache is not None:
+            return self.cache.get_or_load(short_url, lambda: self._load_long_url(short_url), self.stale_read_ttl)
+        return self._load_long_url(short_url)
+
+    def _load_long_url(self, short_url: str) -> Optional[str]:
         url = self.url_repository.find_by_short_url(short_url)
         return url.long_url if url else None
 
+    def record_click(self, short_url: str):
+        if self.click_tracker is not None:
+            self.click_tracker.record(short_url)
+
+    def record_click_nowait(self, short_url: str) -> bool:
+        # False when the click would wait for buffer space; record_click it
+        # off the event loop then.
+        return self.click_tracker is None or self.click_tracker.record_nowait(short_url)
+
+    def get_click_count(self, url_id: int) -> int:
+        return self.url_repository.get_click_counts([url_id])[url_id]
+
+    def get_click_counts(self, url_ids: List[int]) -> Dict[int, int]:
+        return self.url_repository.get_click_counts(url_ids)
+
+    def get_top_urls(self, limit: int = 10, period: Optional[float] = None) -> List[Tuple[Url, int]]:
+        # period is in seconds back from now; None means all time. The
+        # finest granularity that keeps the window under a few hundred
+        # buckets is used.
+        if period is None:
+            return self.url_repository.get_top_urls(limit)
+        if period <= 6 * 3600:
+            granularity = 'minute'
+        elif period <= 14 * 86400:
+            granularity = 'hour'
+        else:
+            granularity = 'day'
+        since = bucket_start(time.time() - period, granularity)
+        return self.url_repository.get_top_urls(limit, granularity, since)
+
+    def get_click_series(self, url_id: int, granularity: str = 'hour', buckets: int = 24) -> List[Tuple[int, int]]:
+        # The last `buckets` buckets up to and including the current one,
+        # with empty buckets filled in as zero.
+        if granularity not in ROLLUP_GRANULARITIES:
+            raise ValueError(f"Unknown granularity: {granularity}")
+        width = ROLLUP_GRANULARITIES[granularity]
+        until = bucket_start(time.time(), granularity) + width
+        since = until - buckets * width
+        counts = dict(self.url_repository.get_click_series(url_id, granularity, since, until))
+        return [(bucket, counts.get(bucket, 0)) for bucket in range(since, until, width)]
+
     def get_all_urls(self) -> List[Url]:
         return self.url_repository.get_all()
 
+    def get_url_page(self, cursor: Optional[str] = None, limit: Optional[int] = None) -> UrlPage:
+        if not limit or limit < 1:
+            limit = self.default_page_size
+        return self.url_repository.get_page(min(limit, self.max_page_size), cursor)
+
+    def listing_version(self) -> int:
+        # Changes on every save, update and delete, from any process. Sharded
+        # seqs hold one field per shard, so those are hashed down to 64 bits
+        # to keep the ETag short.
+        version = self.url_repository.change_version()
+        if version >> 64:
+            digest = hashlib.blake2b(version.to_bytes((version.bit_length() + 7) // 8, 'little'), digest_size=8)
+            version = int.from_bytes(digest.digest(), 'little')
+        return version
+
     def get_url_by_id(self, url_id: int) -> Optional[Url]:
         return self.url_repository.find_by_id(url_id)
 
     def update_url(self, url_id:int, short_url:str, long_url:str) -> Optional[Url]:
-        existing = self.url_repository.find_by_short_url(short_url)
+        source = self.url_repository.authoritative()
+        existing = source.find_by_short_url(short_url)
         if existing and existing.id != url_id:
             raise ValueError("Short url already exists")
 
-        return self.url_repository.update(url_id, short_url, long_url)
+        previous = source.find_by_id(url_id)
+        updated = self.url_repository.update(url_id, short_url, long_url)
+        self._invalidate(short_url, previous.short_url if previous else None)
+        return updated
 
     def delete_url(self, url_id: int) -> bool:
-        return self.url_repository.delete(url_id)
+        previous = self.url_repository.authoritative().find_by_id(url_id)
+        deleted = self.url_repository.delete(url_id)
+        if previous:
+            self._invalidate(previous.short_url)
+        return deleted
+
+    def cache_stats(self) -> Optional[dict]:
+        return self.cache.stats() if self.cache is not None else None
+
+    def _invalidate(self, *short_urls: Optional[str]):
+        if self.cache is not None:
+            self.cache.invalidate(*[code for code in short_urls if code])
+
+    def keyspace_stats(self) -> dict:
+        return keyspace_report(self.url_repository.count(), self.code_allocator)
+
+
+class AsyncUrlShortenerService:
+    # Async variant of the redirect path. A purely in-memory cache is
+    # consulted on the event loop; repository calls, and caches that may do
+    # file I/O, go through the AsyncUrlRepository executor.
+    def __init__(self, url_service: UrlShortenerService, async_repository: AsyncUrlRepository):
+        self.url_service = url_service
+        self.url_repository = async_repository
+
+    async def get_long_url(self, short_url: str) -> Optional[str]:
+        cache = self.url_service.cache
+        if cache is None:
+            url = await self.url_repository.find_by_short_url(short_url)
+            return url.long_url if url else None
+        if getattr(cache, 'blocking', True):
+            return await self.url_repository.run(self.url_service.get_long_url, short_url)
+
+        long_url = cache.get(short_url, _NOT_CACHED)
+        if long_url is _NOT_CACHED:
+            generation = cache.generation(short_url)
+            url = await self.url_repository.find_by_short_url(short_url)
+            long_url = url.long_url if url else None
+            cache.set_if_current(short_url, long_url, generation,
+                                 cache.fill_ttl(long_url, self.url_service.stale_read_ttl))
+        return long_url
 
-    def _generate_unique_short_url(self, lenght: int = 6) -> str:
-        chars = string.ascii_letters + string.digits
-        while True:
-            short_url = ''.join(random.choice(chars) for _ in range(lenght))
-            if not self.url_repository.exists_by_short_url(short_url):
-                return short_url
+    async def run(self, func, *args, **kwargs):
+        return await self.url_repository.run(func, *args, **kwargs)
 
 
 class AuthService:
@@ -62,23 +238,120 @@ class AuthService:
     def validate_token(self, token: str) -> Optional[str]:
         return self.jwt_service.validate_token(token)
 
+    def validate_token_in_memory(self, token: str) -> Optional[dict]:
+        return self.jwt_service.validate_token_in_memory(token)
+
+    def revoke_token(self, token: str):
+        self.jwt_service.revoke_token(token)
+
 
 class JWTService:
-    def __init__(self, secret_key: str):
+    def __init__(self, secret_key: str, token_cache: Optional[LRUCache] = None,
+                 revocation_list: Optional[RevocationList] = None):
         self.secret_key = secret_key
+        self.token_cache = token_cache
+        self.revocation_list = revocation_list
 
     def generate_token(self, username: str) -> str:
-        payload = {
+        return jwt.encode(self._new_payload(username), self.secret_key, algorithm='HS256')
+
+    def _new_payload(self, username: str) -> dict:
+        return {
             'user': username,
+            'jti': uuid.uuid4().hex,
             'exp': datetime.utcnow() + timedelta(seconds=3660)
         }
-        return jwt.encode(payload, self.secret_key, algorithm='HS256')
 
     def validate_token(self, token: str) -> Optional[str]:
+        if self.token_cache is None:
+            payload = self._decode(token)
+        else:
+            payload = self._validate_cached(token)
+
+        if self.revocation_list is not None and self.revocation_list.is_revoked(payload.get('jti')):
+            raise Exception('Token revoked')
+        return payload
+
+    def validate_token_in_memory(self, token: str) -> Optional[dict]:
+        # validate_token's answer when the token cache and the revocation
+        # filter can give it without I/O, else None. Cached rejections raise.
+        if self.token_cache is None:
+            return None
+        cached = self.token_cache.get(hashlib.sha256(token.encode()).digest(), _NOT_CACHED)
+        if cached is _NOT_CACHED:
+            return None
+        valid, result = cached
+        if not valid:
+            raise Exception(result)
+        if self.revocation_list is not None and \
+                self.revocation_list.is_revoked_in_memory(result.get('jti')) is not False:
+            return None
+        return dict(result)
+
+    def revoke_token(self, token: str):
+        if self.revocation_list is None:
+            raise Exception('Token revocation is not enabled')
+        payload = self.validate_token(token)
+        if 'jti' not in payload:
+            raise Exception('Token cannot be revoked')
+        self.revocation_list.revoke(payload['jti'], payload['exp'])
+
+    def _validate_cached(self, token: str) -> dict:
+        # Keyed by a digest so the cache never holds usable tokens. Verified
+        # payloads live until the token's own exp; rejections are remembered
+        # for the cache's negative TTL.
+        key = hashlib.sha256(token.encode()).digest()
+        cached = self.token_cache.get(key, _NOT_CACHED)
+        if cached is not _NOT_CACHED:
+            valid, result = cached
+            if valid:
+                return dict(result)
+            raise Exception(result)
+
+        try:
+            payload = self._decode(token)
+        except Exception as e:
+            self.token_cache.set(key, (False, str(e)), ttl=self.token_cache.negative_ttl)
+            raise
+
+        exp = payload.get('exp')
+        ttl = self.token_cache.ttl if exp is None else min(self.token_cache.ttl, exp - time.time())
+        if ttl > 0:
+            self.token_cache.set(key, (True, payload), ttl=ttl)
+        return dict(payload)
+
+    def _decode(self, token: str) -> dict:
         try:
             payload = jwt.decode(token, self.secret_key, algorithms=['HS256'])
             return payload
         except jwt.ExpiredSignatureError:
             raise Exception('Token expired')
         except jwt.InvalidTokenError:
-            raise Exception('Invalid token')
\ No newline at end of file
+            raise Exception('Invalid token')
+
+    def cache_stats(self) -> Optional[dict]:
+        return self.token_cache.stats() if self.token_cache is not None else None
+
+
+class KeyringJWTService(JWTService):
+    # Signs with the keyring's current key (RS256/ES256/EdDSA) and puts its
+    # kid in the header; verifiers only need the public halves.
+    def __init__(self, keyring: KeyRing, token_cache: Optional[LRUCache] = None,
+                 revocation_list: Optional[RevocationList] = None):
+        super().__init__(secret_key=None, token_cache=token_cache, revocation_list=revocation_list)
+        self.keyring = keyring
+
+    def generate_token(self, username: str) -> str:
+        key = self.keyring.signing_key()
+        return jwt.encode(self._new_payload(username), key.private_key, algorithm=key.algorithm,
+                          headers={'kid': key.kid})
+
+    def _decode(self, token: str) -> dict:
+        try:
+            kid = jwt.get_unverified_header(token).get('kid')
+            key = self.keyring.verification_key(kid)
+            return jwt.decode(token, key.public_key, algorithms=[key.algorithm])
+        except jwt.ExpiredSignatureError:
+            raise Exception('Token expired')
+        except (jwt.InvalidTokenError, KeyNotFoundError):
+            raise Exception('Invalid token')
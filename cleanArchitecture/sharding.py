@@ -0,0 +1,396 @@
+import argparse
+import heapq
+import itertools
+import os
+import sqlite3
+import sys
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+from cleanArchitecture.codes import ALPHABET
+from cleanArchitecture.models import UrlRepository, Url, UrlPage, UrlChange
+from cleanArchitecture.repositories import SQLiteUrlRepository, encode_cursor, decode_cursor
+
+# Global ids carry the shard in their low bits: id = local_id << SHARD_BITS | shard.
+# Ids only change when links are resharded; a code change never moves a link.
+SHARD_BITS = 6
+MAX_SHARDS = 1 << SHARD_BITS
+# get_changes positions pack every shard's change log seq into one integer.
+SEQ_BITS = 48
+
+
+def shard_for_code(short_url: str, shards: int) -> int:
+    return zlib.crc32(short_url.encode()) % shards
+
+
+def to_global_id(local_id: int, shard: int) -> int:
+    return local_id << SHARD_BITS | shard
+
+
+def split_id(url_id: int) -> Tuple[int, int]:
+    # (shard, local id)
+    return url_id & (MAX_SHARDS - 1), url_id >> SHARD_BITS
+
+
+class ShardedUrlRepository(UrlRepository):
+    # Links spread over several UrlRepository shards by a hash of the short
+    # code, so each shard has its own file and write lock. Lookups by code
+    # or id touch one shard; listings, counts and rankings fan out to all
+    # shards in parallel and merge; batched writes are split per shard and
+    # written concurrently.
+    def __init__(self, shards: Sequence[UrlRepository]):
+        if not 1 <= len(shards) <= MAX_SHARDS:
+            raise ValueError(f"Between 1 and {MAX_SHARDS} shards are supported")
+        self.shards = list(shards)
+        self.executor = ThreadPoolExecutor(max_workers=len(self.shards), thread_name_prefix='url-shard')
+
+    def _shard(self, short_url: str) -> int:
+        return shard_for_code(short_url, len(self.shards))
+
+    def _map(self, func: Callable, items: Sequence) -> list:
+        if len(items) == 1:
+            return [func(items[0])]
+        try:
+            results = self.executor.map(func, items)
+        except RuntimeError:
+            # Interpreter shutdown stops every executor before atexit
+            # handlers run, and the click tracker's last flush comes after.
+            return [func(item) for item in items]
+        return list(results)
+
+    def _each(self, func: Callable) -> list:
+        # func(shard_index, repository) on every shard, in shard order.
+        return self._map(lambda index: func(index, self.shards[index]), range(len(self.shards)))
+
+    @staticmethod
+    def _globalize(url: Optional[Url], shard: int) -> Optional[Url]:
+        if url is not None and url.id is not None:
+            url.id = to_global_id(url.id, shard)
+        return url
+
+    def _owner(self, url_id: int) -> Optional[Tuple[int, int]]:
+        shard, local_id = split_id(url_id)
+        if shard >= len(self.shards):
+            return None
+        return shard, local_id
+
+    def save(self, url: Url) -> Url:
+        shard = self._shard(url.short_url)
+        return self._globalize(self.shards[shard].save(url), shard)
+
+    def save_many(self, urls: List[Url]) -> List[Url]:
+        groups: Dict[int, List[Url]] = {}
+        for url in urls:
+            groups.setdefault(self._shard(url.short_url), []).append(url)
+
+        def save_group(shard):
+            saved = self.shards[shard].save_many(groups[shard])
+            for url in saved:
+                self._globalize(url, shard)
+            return saved
+        self._map(save_group, list(groups))
+        # In input order, like the single-file repository.
+        return [url for url in urls if url.id is not None]
+
+    def find_by_short_url(self, short_url: str) -> Optional[Url]:
+        shard = self._shard(short_url)
+        return self._globalize(self.shards[shard].find_by_short_url(short_url), shard)
+
+    def find_by_id(self, url_id: int) -> Optional[Url]:
+        owner = self._owner(url_id)
+        if owner is None:
+            return None
+        shard, local_id = owner
+        return self._globalize(self.shards[shard].find_by_id(local_id), shard)
+
+    def get_all(self) -> List[Url]:
+        return list(self.iter_all(10000))
+
+    def get_page(self, limit: int, cursor: Optional[str] = None) -> UrlPage:
+        # Each shard returns its own first `limit` rows after the cursor and
+        # the pages are merged newest first. A global (created_at, id) bound
+        # becomes a per-shard local id bound: local << bits | shard < id
+        # exactly when local <= (id - shard - 1) >> bits.
+        created_at, url_id = decode_cursor(cursor) if cursor else (None, None)
+
+        def shard_page(index, repository):
+            shard_cursor = None
+            if cursor:
+                shard_cursor = encode_cursor(created_at, ((url_id - index - 1) >> SHARD_BITS) + 1)
+            page = repository.get_page(limit, shard_cursor)
+            for url in page.items:
+                self._globalize(url, index)
+            return page
+
+        pages = self._each(shard_page)
+        more = any(page.next_cursor for page in pages)
+        merged = list(heapq.merge(*[page.items for page in pages], key=self._page_key, reverse=True))
+        items = merged[:limit]
+        next_cursor = None
+        if items and (more or len(merged) > limit):
+            last = items[-1]
+            next_cursor = encode_cursor(last.created_at.isoformat(' '), last.id)
+        return UrlPage(items=items, next_cursor=next_cursor)
+
+    @staticmethod
+    def _page_key(url: Url):
+        return url.created_at, url.id
+
+    def iter_all(self, chunk_size: int = 1000) -> Iterator[Url]:
+        # Every shard walks its rows in local id order, which is also global
+        # id order within the shard, so a merge gives global id order.
+        def walk(index):
+            for url in self.shards[index].iter_all(chunk_size):
+                yield self._globalize(url, index)
+        return heapq.merge(*[walk(index) for index in range(len(self.shards))], key=lambda url: url.id)
+
+    def update(self, url_id: int, short_url: str, long_url: str) -> Optional[Url]:
+        owner = self._owner(url_id)
+        if owner is None:
+            return None
+        shard, local_id = owner
+        if self._shard(short_url) != shard:
+            # Moving the link would change its id, and shard files cannot
+            # share a transaction to move it with its clicks.
+            if self.shards[shard].find_by_id(local_id) is None:
+                return None
+            message = (f"With {len(self.shards)} shards a link keeps the shard its code hashes to: "
+                       f"{short_url!r} belongs on shard {self._shard(short_url)}, this link is on shard {shard}.")
+            suggestion = self._code_on_shard(short_url, shard)
+            if suggestion:
+                message += f" Use {suggestion!r}, which does, or"
+            else:
+                message += " To use it,"
+            raise ValueError(f"{message} delete the link and create it again with {short_url!r}")
+        return self._globalize(self.shards[shard].update(local_id, short_url, long_url), shard)
+
+    def _code_on_shard(self, short_url: str, shard: int) -> Optional[str]:
+        # The requested code plus the first one or two character suffix that
+        # hashes to the shard and is free.
+        suffixes = itertools.chain(ALPHABET, (a + b for a, b in itertools.product(ALPHABET, repeat=2)))
+        for suffix in suffixes:
+            candidate = short_url + suffix
+            if self._shard(candidate) == shard and not self.shards[shard].exists_by_short_url(candidate):
+                return candidate
+        return None
+
+    def delete(self, url_id: int) -> bool:
+        owner = self._owner(url_id)
+        if owner is None:
+            return False
+        shard, local_id = owner
+        return self.shards[shard].delete(local_id)
+
+    def exists_by_short_url(self, short_url: str) -> bool:
+        return self.shards[self._shard(short_url)].exists_by_short_url(short_url)
+
+    def count(self) -> int:
+        return sum(self._each(lambda index, repository: repository.count()))
+
+    def reserve_code_block(self, name: str, size: int) -> int:
+        # Code sequences are global; shard 0 holds them.
+        return self.shards[0].reserve_code_block(name, size)
+
+    def current_change_seq(self) -> int:
+        return self._pack(self._each(lambda index, repository: repository.current_change_seq()))
+
+    def change_version(self) -> int:
+        return self._pack(self._each(lambda index, repository: repository.change_version()))
+
+    def get_changes(self, since_seq: int, limit: int = 1000) -> List[UrlChange]:
+        # Changes are taken shard by shard; each change's seq is the packed
+        # position after it, so resuming from any returned seq is exact.
+        position = self._unpack(since_seq)
+        changes = []
+        for index, repository in enumerate(self.shards):
+            if len(changes) >= limit:
+                break
+            for change in repository.get_changes(position[index], limit - len(changes)):
+                position[index] = change.seq
+                change.seq = self._pack(position)
+                change.url_id = to_global_id(change.url_id, index)
+                changes.append(change)
+        return changes
+
+    @staticmethod
+    def _pack(seqs: List[int]) -> int:
+        packed = 0
+        for index, seq in enumerate(seqs):
+            packed |= seq << (SEQ_BITS * index)
+        return packed
+
+    def _unpack(self, packed: int) -> List[int]:
+        mask = (1 << SEQ_BITS) - 1
+        return [(packed >> (SEQ_BITS * index)) & mask for index in range(len(self.shards))]
+
+    def record_clicks(self, events: List[Tuple[str, float]]):
+        groups: Dict[int, List[Tuple[str, float]]] = {}
+        for event in events:
+            groups.setdefault(self._shard(event[0]), []).append(event)
+        self._map(lambda shard: self.shards[shard].record_clicks(groups[shard]), list(groups))
+
+    def prune_click_rollups(self, cutoffs: Dict[str, int]) -> int:
+        return sum(self._each(lambda index, repository: repository.prune_click_rollups(cutoffs)))
+
+    def prune_clicks(self, before: float) -> int:
+        return sum(self._each(lambda index, repository: repository.prune_clicks(before)))
+
+    def get_click_counts(self, url_ids: List[int]) -> Dict[int, int]:
+        groups: Dict[int, List[int]] = {}
+        counts = {url_id: 0 for url_id in url_ids}
+        for url_id in url_ids:
+            owner = self._owner(url_id)
+            if owner is not None:
+                groups.setdefault(owner[0], []).append(owner[1])
+
+        def shard_counts(shard):
+            return shard, self.shards[shard].get_click_counts(groups[shard])
+        for shard, local_counts in self._map(shard_counts, list(groups)):
+            for local_id, clicks in local_counts.items():
+                counts[to_global_id(local_id, shard)] = clicks
+        return counts
+
+    def get_top_urls(self, limit: int, granularity: Optional[str] = None,
+                     since: Optional[int] = None) -> List[Tuple[Url, int]]:
+        # A link's clicks all live on its own shard, so the global top N is
+        # within the union of every shard's top N.
+        def shard_top(index, repository):
+            return [(self._globalize(url, index), clicks)
+                    for url, clicks in repository.get_top_urls(limit, granularity, since)]
+        ranked = [entry for entries in self._each(shard_top) for entry in entries]
+        ranked.sort(key=lambda entry: entry[1], reverse=True)
+        return ranked[:limit]
+
+    def get_click_series(self, url_id: int, granularity: str, since: int,
+                         until: Optional[int] = None) -> List[Tuple[int, int]]:
+        owner = self._owner(url_id)
+        if owner is None:
+            return []
+        shard, local_id = owner
+        return self.shards[shard].get_click_series(local_id, granularity, since, until)
+
+    def verify_storage(self):
+        problems = {}
+        for index, repository in enumerate(self.shards):
+            for key, value in repository.verify_storage().items():
+                problems[f'shard{index}.{key}'] = value
+        return problems
+
+    def pool_stats(self) -> dict:
+        # Pool usage summed over the shards.
+        totals = {}
+        for repository in self.shards:
+            for key, value in repository.pool.stats().items():
+                if isinstance(value, int) and not isinstance(value, bool):
+                    totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        for repository in self.shards:
+            repository.close()
+
+
+def reshard(sources: List[str], targets: List[str], progress: bool = False) -> List[int]:
+    # Copies every link in the source files (one urls.db, or the shards of
+    # an existing layout) into empty target shards, routed by code. Rows
+    # keep their created_at; ids are reassigned per target. Click totals,
+    # rollups and raw clicks follow their links. Returns rows per target.
+    for path in targets:
+        SQLiteUrlRepository(path, pool_size=1).close()
+    written = []
+    for index, path in enumerate(targets):
+        conn = sqlite3.connect(path)
+        conn.create_function('shard_for_code', 2, shard_for_code, deterministic=True)
+        if conn.execute('SELECT 1 FROM urls LIMIT 1').fetchone():
+            conn.close()
+            raise ValueError(f"{path} already has links; reshard into empty files")
+        rows = 0
+        for source in sources:
+            conn.execute('ATTACH DATABASE ? AS src', (source,))
+            mine = f'shard_for_code(su.short_url, {len(targets)}) = {index}'
+            conn.execute('BEGIN')
+            rows += conn.execute(f'''
+                    INSERT INTO urls (short_url, long_url, created_at)
+                    SELECT su.short_url, su.long_url, su.created_at FROM src.urls AS su
+                    WHERE {mine} ORDER BY su.id
+                ''').rowcount
+            conn.execute(f'''
+                    INSERT INTO click_counts (url_id, clicks, last_clicked_at)
+                    SELECT u.id, c.clicks, c.last_clicked_at FROM src.click_counts AS c
+                    JOIN src.urls AS su ON su.id = c.url_id JOIN urls AS u ON u.short_url = su.short_url
+                    WHERE {mine}
+                    ON CONFLICT(url_id) DO UPDATE SET clicks = clicks + excluded.clicks
+                ''')
+            conn.execute(f'''
+                    INSERT INTO click_rollups (url_id, granularity, bucket, clicks)
+                    SELECT u.id, r.granularity, r.bucket, r.clicks FROM src.click_rollups AS r
+                    JOIN src.urls AS su ON su.id = r.url_id JOIN urls AS u ON u.short_url = su.short_url
+                    WHERE {mine}
+                    ON CONFLICT(url_id, granularity, bucket) DO UPDATE SET clicks = clicks + excluded.clicks
+                ''')
+            conn.execute(f'''
+                    INSERT INTO clicks (url_id, clicked_at)
+                    SELECT u.id, c.clicked_at FROM src.clicks AS c
+                    JOIN src.urls AS su ON su.id = c.url_id JOIN urls AS u ON u.short_url = su.short_url
+                    WHERE {mine}
+                ''')
+            if index == 0:
+                conn.execute('''
+                        INSERT INTO code_sequences (name, next_value)
+                        SELECT name, next_value FROM src.code_sequences WHERE name != 'url_changes_pruned'
+                        ON CONFLICT(name) DO UPDATE SET next_value = MAX(next_value, excluded.next_value)
+                    ''')
+            conn.commit()
+            conn.execute('DETACH DATABASE src')
+            if progress:
+                print(f"{source} -> {path}: {rows} links", file=sys.stderr)
+        conn.close()
+        written.append(rows)
+    return written
+
+
+def plan(sources: List[str], shards: int) -> List[int]:
+    # Links per target shard if the sources were resharded into `shards`.
+    counts = [0] * shards
+    for source in sources:
+        conn = sqlite3.connect(f'file:{source}?mode=ro', uri=True)
+        for (short_url,) in conn.execute('SELECT short_url FROM urls'):
+            counts[shard_for_code(short_url, shards)] += 1
+        conn.close()
+    return counts
+
+
+def main(argv=None):
+    # python -m cleanArchitecture.sharding plan urls.db --shards 4
+    # python -m cleanArchitecture.sharding reshard urls.db --target shard0.db --target shard1.db ...
+    parser = argparse.ArgumentParser(prog='python -m cleanArchitecture.sharding')
+    commands = parser.add_subparsers(dest='command', required=True)
+    plan_parser = commands.add_parser('plan', help='show how links would spread over N shards')
+    plan_parser.add_argument('sources', nargs='+')
+    plan_parser.add_argument('--shards', type=int, required=True)
+    reshard_parser = commands.add_parser('reshard', help='copy links into a new set of shard files')
+    reshard_parser.add_argument('sources', nargs='+', help='urls.db, or every file of the current layout')
+    reshard_parser.add_argument('--target', action='append', required=True, help='new shard file, in shard order')
+    args = parser.parse_args(argv)
+
+    if args.command == 'plan':
+        counts = plan(args.sources, args.shards)
+        total = sum(counts) or 1
+        for index, count in enumerate(counts):
+            print(f"shard {index}: {count} links ({count / total:.1%})")
+        return
+
+    if not 1 <= len(args.target) <= MAX_SHARDS:
+        parser.error(f"Between 1 and {MAX_SHARDS} targets are supported")
+    overlap = {os.path.abspath(path) for path in args.sources} & {os.path.abspath(path) for path in args.target}
+    if overlap:
+        parser.error(f"Targets must be new files: {sorted(overlap)}")
+    counts = reshard(args.sources, args.target, progress=True)
+    for path, count in zip(args.target, counts):
+        print(f"{path}: {count} links")
+    print("Set SHARD_PATHS to the targets, in this order, and restart.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+import argparse
+import mmap
+import os
+import struct
+import sys
+import time
+import zlib
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timezone
+from typing import Iterator, List, Optional, Tuple
+from cleanArchitecture.codes import BASE, decode
+from cleanArchitecture.models import UrlRepository
+
+# Snapshot file layout, version 2 (little-endian):
+#   header   magic, version, fanout bits, code length, entry count, buffer
+#            size, position size, export time, CRC32 of everything after
+#            the header
+#   fanout   (2**fanout_bits + 1) x int64
+#   keys, ids, created, offsets   count x int64 each, sorted by key
+#   lengths  count x uint32, padded to 8 bytes
+#   buffer   long URLs, UTF-8, back to back
+#   position change log seq, position size bytes unsigned
+# The seq has no fixed width because a sharded repository packs one seq per
+# shard into it. Older versions are rejected; export a new snapshot.
+# Columns are read in place through memoryviews over the mapping, so opening
+# a snapshot costs the same for ten links as for ten million.
+SNAPSHOT_MAGIC = b'URLSNAP\x00'
+SNAPSHOT_VERSION = 2
+_HEADER = struct.Struct('<8sHHIQQQQI')
+_HEADER_SIZE = 64
+FANOUT_BITS = 16
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+def to_epoch(created_at: Optional[datetime]) -> int:
+    # created_at comes from SQLite's CURRENT_TIMESTAMP: naive UTC, whole seconds.
+    if created_at is None:
+        return 0
+    return int(created_at.replace(tzinfo=timezone.utc).timestamp())
+
+
+def from_epoch(seconds: int) -> Optional[datetime]:
+    if not seconds:
+        return None
+    return datetime.fromtimestamp(seconds, timezone.utc).replace(tzinfo=None)
+
+
+def pack_code(short_url: str, code_length: int) -> Optional[int]:
+    # Fixed-length base62 codes map to distinct integers below BASE**length;
+    # anything else cannot be packed.
+    if len(short_url) != code_length:
+        return None
+    try:
+        return decode(short_url)
+    except KeyError:
+        return None
+
+
+class Segment:
+    # Parallel columns sorted by packed code, with every long URL stored back
+    # to back in one buffer. A fanout table (as in git's pack index) maps the
+    # top FANOUT_BITS of a key to its range of the columns, so a lookup
+    # bisects a handful of entries instead of the whole index. Columns are
+    # arrays for a segment built in memory and memoryviews for a mapped
+    # snapshot; a segment is never modified once built.
+    __slots__ = ('code_length', 'keys', 'ids', 'created', 'offsets', 'lengths', 'buffer', 'shift', 'fanout',
+                 'log_seq')
+
+    def __init__(self, code_length: int, keys=None, ids=None, created=None, offsets=None, lengths=None,
+                 buffer=b'', fanout=None, log_seq: int = 0):
+        self.code_length = code_length
+        self.keys = keys if keys is not None else array('q')
+        self.ids = ids if ids is not None else array('q')
+        self.created = created if created is not None else array('q')
+        self.offsets = offsets if offsets is not None else array('q')
+        self.lengths = lengths if lengths is not None else array('I')
+        self.buffer = buffer
+        self.shift = max(0, (BASE ** code_length - 1).bit_length() - FANOUT_BITS)
+        self.fanout = fanout if fanout is not None else self._build_fanout()
+        self.log_seq = log_seq
+
+    def _build_fanout(self):
+        fanout = array('q', bytes(8 * ((1 << FANOUT_BITS) + 1)))
+        for key in self.keys:
+            fanout[(key >> self.shift) + 1] += 1
+        for i in range(1, len(fanout)):
+            fanout[i] += fanout[i - 1]
+        return fanout
+
+    @classmethod
+    def build(cls, code_length: int, entries: List[Tuple[int, int, bytes, int]], log_seq: int = 0) -> 'Segment':
+        # entries: (packed code, id, long url bytes, created epoch)
+        entries.sort(key=lambda entry: entry[0])
+        offsets = array('q', [0]) * len(entries)
+        offset = 0
+        for i, entry in enumerate(entries):
+            offsets[i] = offset
+            offset += len(entry[2])
+        return cls(
+            code_length,
+            keys=array('q', [entry[0] for entry in entries]),
+            ids=array('q', [entry[1] for entry in entries]),
+            created=array('q', [entry[3] for entry in entries]),
+            offsets=offsets,
+            lengths=array('I', [len(entry[2]) for entry in entries]),
+            buffer=b''.join([entry[2] for entry in entries]),
+            log_seq=log_seq
+        )
+
+    def find(self, key: int) -> Optional[Tuple[int, str, int]]:
+        bucket = key >> self.shift
+        hi = self.fanout[bucket + 1]
+        i = bisect_left(self.keys, key, self.fanout[bucket], hi)
+        if i == hi or self.keys[i] != key:
+            return None
+        offset = self.offsets[i]
+        return self.ids[i], str(self.buffer[offset:offset + self.lengths[i]], 'utf-8'), self.created[i]
+
+    def entries(self) -> Iterator[Tuple[int, int, bytes, int]]:
+        for i in range(len(self.keys)):
+            offset = self.offsets[i]
+            yield self.keys[i], self.ids[i], bytes(self.buffer[offset:offset + self.lengths[i]]), self.created[i]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def nbytes(self) -> int:
+        columns = (self.keys, self.ids, self.created, self.offsets, self.lengths, self.fanout)
+        return sum(len(column) * column.itemsize for column in columns) + len(self.buffer)
+
+
+def write_snapshot(path: str, segment: Segment):
+    # Written to a temporary file and renamed, so workers never map a
+    # half-written snapshot.
+    if sys.byteorder != 'little':
+        raise SnapshotError("Snapshots can only be written on little-endian hosts")
+    tmp_path = f'{path}.tmp'
+    crc = 0
+    with open(tmp_path, 'wb') as f:
+        f.write(bytes(_HEADER_SIZE))
+        for column in (array('q', segment.fanout), array('q', segment.keys), array('q', segment.ids),
+                       array('q', segment.created), array('q', segment.offsets), array('I', segment.lengths)):
+            data = column.tobytes()
+            data += bytes(-len(data) % 8)
+            crc = zlib.crc32(data, crc)
+            f.write(data)
+        crc = zlib.crc32(segment.buffer, crc)
+        f.write(segment.buffer)
+        position = segment.log_seq.to_bytes(max(8, (segment.log_seq.bit_length() + 7) // 8), 'little')
+        crc = zlib.crc32(position, crc)
+        f.write(position)
+        f.seek(0)
+        f.write(_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, FANOUT_BITS, segment.code_length, len(segment),
+                             len(segment.buffer), len(position), int(time.time()), crc))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _column_sizes(count: int) -> List[int]:
+    return [8 * ((1 << FANOUT_BITS) + 1)] + [8 * count] * 4 + [4 * count + (-4 * count % 8)]
+
+
+def read_header(mapped) -> dict:
+    if len(mapped) < _HEADER_SIZE:
+        raise SnapshotError("Snapshot is truncated")
+    magic, version, fanout_bits, code_length, count, buffer_size, log_seq, exported_at, crc = \
+        _HEADER.unpack_from(mapped, 0)
+    if magic != SNAPSHOT_MAGIC:
+        raise SnapshotError("Not a url snapshot")
+    if version != SNAPSHOT_VERSION:
+        raise SnapshotError(f"Unsupported snapshot version {version}")
+    if fanout_bits != FANOUT_BITS:
+        raise SnapshotError(f"Unsupported fanout size {fanout_bits}")
+    # The header's seq field holds the position size.
+    position_size = log_seq
+    start = _HEADER_SIZE + sum(_column_sizes(count)) + buffer_size
+    log_seq = int.from_bytes(mapped[start:start + position_size], 'little')
+    return {
+        'version': version,
+        'code_length': code_length,
+        'count': count,
+        'buffer_size': buffer_size,
+        'position_size': position_size,
+        'log_seq': log_seq,
+        'exported_at': exported_at,
+        'crc32': crc,
+    }
+
+
+def open_snapshot(path: str, verify: bool = True) -> Segment:
+    # The returned segment's columns are views into the mapping, which stays
+    # open for as long as the segment is referenced.
+    if sys.byteorder != 'little':
+        raise SnapshotError("Snapshots can only be mapped on little-endian hosts")
+    with open(path, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    header = read_header(mapped)
+    count = header['count']
+    view = memoryview(mapped)
+    sizes = _column_sizes(count)
+    if len(mapped) != _HEADER_SIZE + sum(sizes) + header['buffer_size'] + header['position_size']:
+        raise SnapshotError("Snapshot size does not match its header")
+    if verify and zlib.crc32(view[_HEADER_SIZE:]) != header['crc32']:
+        raise SnapshotError("Snapshot checksum mismatch")
+    columns = []
+    position = _HEADER_SIZE
+    for size, typecode in zip(sizes, 'qqqqqI'):
+        used = 4 * count if typecode == 'I' else size
+        columns.append(view[position:position + used].cast(typecode))
+        position += size
+    fanout, keys, ids, created, offsets, lengths = columns
+    return Segment(header['code_length'], keys=keys, ids=ids, created=created, offsets=offsets, lengths=lengths,
+                   buffer=view[position:position + header['buffer_size']], fanout=fanout,
+                   log_seq=header['log_seq'])
+
+
+def export_snapshot(url_repository: UrlRepository, path: str, code_length: int = 6,
+                    chunk_size: int = 10000) -> Segment:
+    # The change log position is read before the scan. Changes that land
+    # during the scan are replayed by readers on top of the snapshot, which
+    # converges because every change carries the full new state of its row.
+    log_seq = url_repository.current_change_seq()
+    entries = []
+    for url in url_repository.iter_all(chunk_size):
+        key = pack_code(url.short_url, code_length)
+        if key is not None:
+            entries.append((key, url.id, url.long_url.encode(), to_epoch(url.created_at)))
+    segment = Segment.build(code_length, entries, log_seq)
+    write_snapshot(path, segment)
+    return segment
+
+
+def main(argv=None):
+    from cleanArchitecture.config import Config
+    from cleanArchitecture.repositories import SQLiteUrlRepository
+
+    parser = argparse.ArgumentParser(prog='python -m cleanArchitecture.snapshot')
+    commands = parser.add_subparsers(dest='command', required=True)
+    export = commands.add_parser('export', help='write a snapshot of the urls table')
+    export.add_argument('output')
+    export.add_argument('--database', default=Config.DATABASE_PATH)
+    export.add_argument('--code-length', type=int, default=Config.SHORT_URL_LENGTH)
+    export.add_argument('--prune-log', action='store_true',
+                        help='drop change log entries already contained in the snapshot')
+    info = commands.add_parser('info', help='verify a snapshot and print its header')
+    info.add_argument('snapshot')
+    args = parser.parse_args(argv)
+
+    if args.command == 'export':
+        url_repository = SQLiteUrlRepository(args.database, pool_size=1)
+        started = time.monotonic()
+        segment = export_snapshot(url_repository, args.output, args.code_length)
+        if args.prune_log:
+            url_repository.prune_changes(segment.log_seq)
+        url_repository.close()
+        print(f"{args.output}: {len(segment)} links at change {segment.log_seq} "
+              f"in {time.monotonic() - started:.2f}s")
+    else:
+        try:
+            segment = open_snapshot(args.snapshot)
+        except SnapshotError as e:
+            print(f"{args.snapshot}: {e}")
+            sys.exit(1)
+        print(f"{args.snapshot}: {len(segment)} links, code length {segment.code_length}, "
+              f"change {segment.log_seq}, checksum ok")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+import logging
+import threading
+from typing import Dict, Iterator, List, Optional, Tuple
+from cleanArchitecture.models import UrlRepository, Url, UrlPage, UrlChange, ChangeLogGapError
+from cleanArchitecture.snapshot import Segment, open_snapshot, write_snapshot, pack_code, to_epoch, from_epoch
+
+logger = logging.getLogger(__name__)
+
+_ABSENT = object()
+
+
+class IndexedUrlRepository(UrlRepository):
+    # Serves find_by_short_url and exists_by_short_url from a compact
+    # in-memory index and delegates everything else to the wrapped
+    # repository. Codes of code_length base62 characters are packed into
+    # 64-bit integers. Writes go to the wrapped repository first and are then
+    # applied to a small delta dict, which is folded into a fresh segment once
+    # it holds merge_threshold entries. Codes of any other shape live in a
+    # plain dict.
+    #
+    # Other workers' writes reach the index through the repository's change
+    # log, which a background thread replays every sync_interval seconds, so
+    # lookups never wait on a catch-up or a reload; with miss_fallback a miss
+    # is also checked against the wrapped repository, so new links resolve
+    # immediately.
+    def __init__(self, url_repository: UrlRepository, code_length: int = 6, merge_threshold: int = 10000,
+                 snapshot_path: Optional[str] = None, miss_fallback: bool = True,
+                 sync_interval: Optional[float] = 5.0):
+        self.url_repository = url_repository
+        self.code_length = code_length
+        self.merge_threshold = merge_threshold
+        self.miss_fallback = miss_fallback
+        self.sync_interval = sync_interval
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._segment = Segment(code_length)
+        self._delta: Dict[int, Optional[Tuple[int, str, int]]] = {}
+        self._extra: Dict[str, Tuple[int, str, int]] = {}
+        self._log_seq = 0
+        # Bumped by every change to the index; a miss_fallback fill is only
+        # kept if nothing changed while it read the repository.
+        self._version = 0
+        if snapshot_path:
+            self.load_snapshot(snapshot_path)
+        else:
+            self.reload()
+        self._stop = threading.Event()
+        self._thread = None
+        if sync_interval is not None:
+            self._thread = threading.Thread(target=self._run, name='url-index-sync', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.sync_interval):
+            try:
+                self.catch_up()
+            except Exception:
+                logger.exception("Failed to catch up with the url change log")
+
+    def reload(self):
+        # Rebuilds the index from the wrapped repository. The change log
+        # position is taken first; changes made during the scan are replayed
+        # by the next catch_up.
+        log_seq = self.url_repository.current_change_seq()
+        segment_entries = []
+        extra = {}
+        for url in self.url_repository.iter_all():
+            key = pack_code(url.short_url, self.code_length)
+            if key is None:
+                extra[url.short_url] = (url.id, url.long_url, to_epoch(url.created_at))
+            else:
+                segment_entries.append((key, url.id, url.long_url.encode(), to_epoch(url.created_at)))
+        segment = Segment.build(self.code_length, segment_entries, log_seq)
+        with self._lock:
+            self._segment = segment
+            self._delta = {}
+            self._extra = extra
+            self._log_seq = log_seq
+            self._version += 1
+
+    def save_snapshot(self, path: str):
+        with self._lock:
+            self._merge()
+            segment = self._segment
+        write_snapshot(path, segment)
+
+    def load_snapshot(self, path: str):
+        # The snapshot is mapped, not copied; changes logged after it was
+        # exported are applied on top. Codes that do not pack are not part
+        # of snapshots and are found through miss_fallback.
+        segment = open_snapshot(path)
+        if segment.code_length != self.code_length:
+            raise ValueError(f"Snapshot holds {segment.code_length}-character codes, "
+                             f"expected {self.code_length}")
+        with self._lock:
+            self._segment = segment
+            self._delta = {}
+            self._extra = {}
+            self._log_seq = segment.log_seq
+            self._version += 1
+        self.catch_up()
+
+    def catch_up(self) -> int:
+        # Applies the url change log since the last position. Only one
+        # thread syncs at a time; the others keep serving the current state.
+        if not self._sync_lock.acquire(blocking=False):
+            return 0
+        applied = 0
+        try:
+            while True:
+                try:
+                    changes = self.url_repository.get_changes(self._log_seq)
+                except ChangeLogGapError:
+                    self.reload()
+                    continue
+                for change in changes:
+                    self._apply(change)
+                applied += len(changes)
+                if changes:
+                    self._log_seq = changes[-1].seq
+                if len(changes) < 1000:
+                    break
+        finally:
+            self._sync_lock.release()
+        return applied
+
+    def _apply(self, change: UrlChange):
+        if change.old_short_url is not None and change.old_short_url != change.short_url:
+            self._remove(change.old_short_url)
+        if change.short_url is not None:
+            self._put(change.short_url, (change.url_id, change.long_url, to_epoch(change.created_at)))
+
+    def _lookup(self, short_url: str) -> Optional[Tuple[int, str, int]]:
+        version = self._version
+        key = pack_code(short_url, self.code_length)
+        if key is None:
+            entry = self._extra.get(short_url)
+        else:
+            # The delta is read before the segment: a merge swaps in the new
+            # segment before it empties the delta.
+            entry = self._delta.get(key, _ABSENT)
+            if entry is _ABSENT:
+                entry = self._segment.find(key)
+        if entry is None and self.miss_fallback:
+            url = self.url_repository.find_by_short_url(short_url)
+            if url is not None:
+                entry = (url.id, url.long_url, to_epoch(url.created_at))
+                self._put(short_url, entry, version)
+        return entry
+
+    def _put_url(self, url: Url):
+        self._put(url.short_url, (url.id, url.long_url, to_epoch(url.created_at)))
+
+    def _put(self, short_url: str, entry: Tuple[int, str, int], version: Optional[int] = None):
+        # With a version, the entry is dropped if the index changed since
+        # it was read, e.g. by a delete that raced the repository read.
+        key = pack_code(short_url, self.code_length)
+        with self._lock:
+            if version is not None and version != self._version:
+                return
+            self._version += 1
+            if key is None:
+                self._extra[short_url] = entry
+            else:
+                self._delta[key] = entry
+                self._maybe_merge()
+
+    def _remove(self, short_url: str):
+        key = pack_code(short_url, self.code_length)
+        with self._lock:
+            self._version += 1
+            if key is None:
+                self._extra.pop(short_url, None)
+            else:
+                self._delta[key] = None
+                self._maybe_merge()
+
+    def _maybe_merge(self):
+        if len(self._delta) >= self.merge_threshold:
+            self._merge()
+
+    def _merge(self):
+        # Called with the lock held.
+        if not self._delta:
+            return
+        delta = self._delta
+        entries = [entry for entry in self._segment.entries() if entry[0] not in delta]
+        entries.extend((key, value[0], value[1].encode(), value[2])
+                       for key, value in delta.items() if value is not None)
+        self._segment = Segment.build(self.code_length, entries, self._log_seq)
+        self._delta = {}
+
+    def stats(self) -> dict:
+        segment = self._segment
+        return {
+            'segment_entries': len(segment),
+            'segment_bytes': segment.nbytes(),
+            'delta_entries': len(self._delta),
+            'extra_entries': len(self._extra),
+            'change_seq': self._log_seq,
+        }
+
+    def find_by_short_url(self, short_url: str) -> Optional[Url]:
+        entry = self._lookup(short_url)
+        if entry is None:
+            return None
+        url_id, long_url, created = entry
+        return Url(id=url_id, short_url=short_url, long_url=long_url, created_at=from_epoch(created))
+
+    def exists_by_short_url(self, short_url: str) -> bool:
+        return self._lookup(short_url) is not None
+
+    def save(self, url: Url) -> Url:
+        saved = self.url_repository.save(url)
+        self._put_url(saved)
+        return saved
+
+    def save_many(self, urls: List[Url]) -> List[Url]:
+        saved = self.url_repository.save_many(urls)
+        for url in saved:
+            self._put_url(url)
+        return saved
+
+    def update(self, url_id: int, short_url: str, long_url: str) -> Optional[Url]:
+        existing = self.url_repository.find_by_id(url_id)
+        updated = self.url_repository.update(url_id, short_url, long_url)
+        if updated is not None:
+            if existing is not None and existing.short_url != updated.short_url:
+                self._remove(existing.short_url)
+            self._put_url(updated)
+        return updated
+
+    def delete(self, url_id: int) -> bool:
+        existing = self.url_repository.find_by_id(url_id)
+        deleted = self.url_repository.delete(url_id)
+        if deleted and existing is not None:
+            self._remove(existing.short_url)
+        return deleted
+
+    def find_by_id(self, url_id: int) -> Optional[Url]:
+        return self.url_repository.find_by_id(url_id)
+
+    def authoritative(self) -> UrlRepository:
+        return self.url_repository.authoritative()
+
+    def get_all(self) -> List[Url]:
+        return self.url_repository.get_all()
+
+    def get_page(self, limit: int, cursor: Optional[str] = None) -> UrlPage:
+        return self.url_repository.get_page(limit, cursor)
+
+    def iter_all(self, chunk_size: int = 1000) -> Iterator[Url]:
+        return self.url_repository.iter_all(chunk_size)
+
+    def count(self) -> int:
+        return self.url_repository.count()
+
+    def reserve_code_block(self, name: str, size: int) -> int:
+        return self.url_repository.reserve_code_block(name, size)
+
+    def current_change_seq(self) -> int:
+        return self.url_repository.current_change_seq()
+
+    def change_version(self) -> int:
+        return self.url_repository.change_version()
+
+    def get_changes(self, since_seq: int, limit: int = 1000) -> List[UrlChange]:
+        return self.url_repository.get_changes(since_seq, limit)
+
+    def record_clicks(self, events: List[Tuple[str, float]]):
+        self.url_repository.record_clicks(events)
+
+    def prune_click_rollups(self, cutoffs: Dict[str, int]) -> int:
+        return self.url_repository.prune_click_rollups(cutoffs)
+
+    def prune_clicks(self, before: float) -> int:
+        return self.url_repository.prune_clicks(before)
+
+    def get_click_counts(self, url_ids: List[int]) -> Dict[int, int]:
+        return self.url_repository.get_click_counts(url_ids)
+
+    def get_top_urls(self, limit: int, granularity: Optional[str] = None,
+                     since: Optional[int] = None) -> List[Tuple[Url, int]]:
+        return self.url_repository.get_top_urls(limit, granularity, since)
+
+    def get_click_series(self, url_id: int, granularity: str, since: int,
+                         until: Optional[int] = None) -> List[Tuple[int, int]]:
+        return self.url_repository.get_click_series(url_id, granularity, since, until)
+
+    def verify_storage(self):
+        return self.url_repository.verify_storage()
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.url_repository.close()
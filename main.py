@@ -3,14 +3,26 @@ from flask import (Flask, render_template, request, redirect,
 from contextlib import contextmanager
 from datetime import datetime, timedelta
 from functools import wraps
-import string, random, sqlite3, jwt
+import sqlite3, jwt, atexit
+from cleanArchitecture.config import Config
+from cleanArchitecture.database import ConnectionPool, SQLiteTuning
+from cleanArchitecture.cache import LRUCache, MISSING
+from cleanArchitecture.codes import RandomCodeAllocator
+from cleanArchitecture.repositories import encode_cursor, decode_cursor
 
 app = Flask(__name__)
 DATABASE = 'urls.db'
+MAX_CREATE_ATTEMPTS = 10
+tuning = SQLiteTuning.from_config(Config)
+pool = ConnectionPool(DATABASE, size=Config.DB_POOL_SIZE, timeout=Config.DB_POOL_TIMEOUT,
+                      health_check_interval=Config.DB_POOL_HEALTH_CHECK_INTERVAL, tuning=tuning)
+atexit.register(pool.close)
+redirect_cache = LRUCache(max_size=Config.URL_CACHE_SIZE, ttl=Config.URL_CACHE_TTL,
+                          negative_ttl=Config.URL_CACHE_NEGATIVE_TTL)
 
 def init_db():
     try:
-        conn = sqlite3.connect(DATABASE)
+        conn = tuning.connect(DATABASE)
         cur = conn.cursor()
         cur.execute('''
             CREATE TABLE IF NOT EXISTS urls (
@@ -19,46 +31,36 @@ def init_db():
                 long_url TEXT,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)
                     ''')
+        cur.execute('''
+            CREATE INDEX IF NOT EXISTS idx_urls_created_at_id
+            ON urls (created_at DESC, id DESC)
+                    ''')
         conn.commit()
         cur.close()
         conn.close()
         print("Database initialized successfully")
+        problems = pool.verify()
+        if problems:
+            print(f"SQLite settings not applied: {problems}")
     except sqlite3.Error as error:
         print(f"Error while connecting to database: {error}")
         raise
 
 @contextmanager
 def get_db():
-    conn = None
-    try:
-        conn = sqlite3.connect(DATABASE)
-        conn.row_factory = sqlite3.Row
-        yield conn
-    except sqlite3.Error as error:
-        if conn:
+    with pool.connection() as conn:
+        try:
+            yield conn
+        except sqlite3.Error as error:
             conn.rollback()
-        print(f"Database error: {error}")
-        raise
-    finally:
-        if conn:
-            conn.close()
+            print(f"Database error: {error}")
+            raise
 
 
-def generate_short_url(length=6):
-    chars = string.ascii_letters + string.digits
-    short_url = ''.join(random.choice(chars) for _ in range(length))
-    return short_url
+code_allocator = RandomCodeAllocator(length=Config.SHORT_URL_LENGTH)
 
-def is_short_url(short_url):
-    try:
-        with get_db() as conn:
-            cur = conn.cursor()
-            cur.execute('SELECT 1 FROM urls WHERE short_url = ?', (short_url,))
-            result = cur.fetchone() is not None
-            cur.close()
-            return result
-    except sqlite3.Error as error:
-        print(error)
+def generate_short_url():
+    return code_allocator.next_code()
 
 @app.route('/')
 def home():
@@ -69,40 +71,63 @@ def index():
     if request.method == 'POST':
         long_url = request.form['long_url']
 
-        short_url = generate_short_url()
-        while is_short_url(short_url):  # Fixed: use function instead of checking against DATABASE string
-            short_url = generate_short_url()
         try:
             with get_db() as conn:
                 cur = conn.cursor()
-                cur.execute(
-                    'INSERT INTO urls (short_url, long_url) VALUES (?, ?)',
-                    (short_url, long_url)
-                )
+                # Insert and retry on the UNIQUE constraint instead of
+                # checking each candidate code with a separate query
+                for _ in range(MAX_CREATE_ATTEMPTS):
+                    short_url = generate_short_url()
+                    try:
+                        cur.execute(
+                            'INSERT INTO urls (short_url, long_url) VALUES (?, ?)',
+                            (short_url, long_url)
+                        )
+                        break
+                    except sqlite3.IntegrityError:
+                        continue
+                else:
+                    cur.close()
+                    return render_template('index.html', error="Could not allocate a unique short url"), 503
                 conn.commit()
                 cur.close()
-                result = _getAllLink()
-                return render_template('index.html', links=result)
+                redirect_cache.invalidate(short_url)
+                result, next_cursor = _getLinkPage()
+                return render_template('index.html', links=result, next_cursor=next_cursor)
         except sqlite3.Error as error:
             print(f"Database error: {error}")
             return render_template('index.html', error="Failed to create short URL")
 
     try:
-        result = _getAllLink()
-        return render_template('index.html', links=result)
+        cursor = request.args.get('cursor')
+        limit = request.args.get('limit', type=int)
+        result, next_cursor = _getLinkPage(cursor, limit)
+        return render_template('index.html', links=result, next_cursor=next_cursor, cursor=cursor, limit=limit)
+    except ValueError as error:
+        return render_template('index.html', error=str(error)), 400
     except sqlite3.Error as error:
         print(f"Database error: {error}")
 
 
-def _getAllLink():
+def _getLinkPage(cursor=None, limit=None):
+    if not limit or limit < 1:
+        limit = Config.DEFAULT_PAGE_SIZE
+    limit = min(limit, Config.MAX_PAGE_SIZE)
     with get_db() as conn:
         cur = conn.cursor()
-        cur.execute("SELECT * FROM urls ORDER BY created_at DESC")
+        if cursor:
+            created_at, last_id = decode_cursor(cursor)
+            cur.execute("SELECT * FROM urls WHERE (created_at, id) < (?, ?) "
+                        "ORDER BY created_at DESC, id DESC LIMIT ?", (created_at, last_id, limit + 1))
+        else:
+            cur.execute("SELECT * FROM urls ORDER BY created_at DESC, id DESC LIMIT ?", (limit + 1,))
         result = cur.fetchall()
-        if len(result) == 0:
-            return []
 
-    return result
+    next_cursor = None
+    if len(result) > limit:
+        result = result[:limit]
+        next_cursor = encode_cursor(result[-1]['created_at'], result[-1]['id'])
+    return result, next_cursor
 
 @app.route("/link/<int:id>", methods=['GET', 'POST','PUT'])
 def update(id):
@@ -118,6 +143,9 @@ def update(id):
             with get_db() as conn:
                 cur = conn.cursor()
 
+                cur.execute("SELECT short_url FROM urls WHERE id = ?", (id,))
+                previous = cur.fetchone()
+
                 # Update the record where short_url matches the URL parameter
                 cur.execute(
                     'UPDATE urls SET short_url = ?, long_url = ? WHERE id = ?',
@@ -128,6 +156,7 @@ def update(id):
                     return render_template('404.html')
 
                 conn.commit()
+                redirect_cache.invalidate(new_short_url, previous['short_url'])
 
                 cur.execute("SELECT * FROM urls WHERE id = ?", (id,))
                 result = cur.fetchone()
@@ -164,12 +193,15 @@ def delete(id):
     try:
         with get_db() as conn:
             cur = conn.cursor()
+            cur.execute("SELECT short_url FROM urls WHERE id = ?", (id,))
+            previous = cur.fetchone()
             cur.execute("DELETE FROM urls WHERE id = ?", (id,))
 
             if cur.rowcount == 0:
                 return render_template('success.html')
 
             conn.commit()
+            redirect_cache.invalidate(previous['short_url'])
 
             cur.execute("SELECT * FROM urls WHERE id = ?", (id,))
             result = cur.fetchone()
@@ -195,6 +227,15 @@ def delete(id):
 
 @app.route("/link/<short_url>")
 def redirect_short(short_url):
+    long_url = redirect_cache.get(short_url)
+    if long_url is not MISSING:
+        if long_url:
+            return redirect(long_url, code=302)
+        return "URL NOT FOUND", 404
+
+    # Read before the query, so a lookup that raced an edit or delete does
+    # not put the old target back.
+    generation = redirect_cache.generation(short_url)
     try:
         with get_db() as conn:
             cur = conn.cursor()
@@ -204,8 +245,10 @@ def redirect_short(short_url):
 
             if result:
                 long_url = result['long_url']
+                redirect_cache.set_if_current(short_url, long_url, generation)
                 return redirect(long_url, code=302)
             else:
+                redirect_cache.set_if_current(short_url, None, generation)
                 return "URL NOT FOUND", 404
     except sqlite3.Error:
         return "Database error", 500